@@ -14,7 +14,7 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
-import bisect
+import time
 import gevent
 
 from gevent.pool import Group
@@ -65,6 +65,13 @@ class AccountPool(list):
         self.account_class = account_class
         self.log = log.getLogger(self.name)
         self.lock = Semaphore()
+        self._ranking = None # (valid until, usable accounts, [(weight, account), ...])
+        self._generation = 0
+
+    def invalidate(self):
+        """drops the cached ranking of the accounts"""
+        self._ranking = None
+        self._generation += 1
 
     def add(self, **kwargs):
         with transaction:
@@ -73,6 +80,7 @@ class AccountPool(list):
             if account in self:
                 raise ValueError('account already exists: {} {}'.format(account, kwargs))
         self.append(account)
+        self.invalidate()
         gevent.spawn(account.boot)
         return account
 
@@ -80,10 +88,41 @@ class AccountPool(list):
         if account not in self:
             raise ValueError('account not exists')
         list.remove(self, account)
+        self.invalidate()
         account.delete()
 
     def clear(self):
         self[:] = []
+        self.invalidate()
+
+    def get_ranking(self):
+        """returns the usable accounts and the accounts with a weight, best first.
+        the result is cached until an account changes (see models.py) or expires
+        """
+        now = time.time()
+        if self._ranking is not None and self._ranking[0] > now:
+            return self._ranking[1], self._ranking[2]
+
+        generation = self._generation
+        valid_until = now + config['recheck_interval']
+        usable = [a for a in self if a._private_account or (a.enabled and a.last_error is None)]
+        ranking = []
+        for account in usable:
+            try:
+                weight = account.weight
+            except gevent.GreenletExit:
+                continue
+            if weight is None:
+                continue
+            ranking.append((weight, account))
+            expires = getattr(account, 'expires', None)
+            if expires and now < expires < valid_until:
+                valid_until = expires
+        ranking.sort(key=lambda r: r[0], reverse=True) # stable, equal weights keep the pool order
+
+        if generation == self._generation:
+            self._ranking = valid_until, usable, ranking
+        return usable, ranking
 
     def get_best(self, task, file):
         with self.lock:
@@ -92,34 +131,36 @@ class AccountPool(list):
             else:
                 all_accounts = [a for a in self if a._private_account]
 
-            group = Group()
-            for account in all_accounts:
-                group.spawn(account.boot)
-            group.join()
-
-            all_accounts = [a for a in all_accounts if a._private_account or (a.enabled and a.last_error is None)]
-            
-            accounts = []
-            best_weight = 0
-            for account in all_accounts:
-                if file is not None and not account.match(file):
-                    continue
-                try:
-                    weight = account.weight
-                except gevent.GreenletExit:
+            booting = [a for a in all_accounts if a.needs_boot()]
+            if booting:
+                group = Group()
+                for account in booting:
+                    group.spawn(account.boot)
+                group.join()
+
+            usable, ranking = self.get_ranking()
+            if not config.use_useraccounts:
+                usable = [a for a in usable if a._private_account]
+
+            # the first account with the best weight that has a free task slot
+            best = None
+            for weight, account in ranking:
+                if best is not None and weight != best[0]:
+                    break
+                if not config.use_useraccounts and not account._private_account:
                     continue
-                if weight is None or weight < best_weight:
+                if file is not None and not account.match(file):
                     continue
-                if weight > best_weight:
-                    accounts = []
-                    best_weight = weight
-                bisect.insort(accounts, (account.get_task_pool(task).full() and 1 or 0, len(accounts), account))
-
-            if accounts:
-                return accounts[0][2]
-            if len(all_accounts) > 0:
+                if not account.get_task_pool(task).full():
+                    return account
+                if best is None:
+                    best = weight, account
+
+            if best is not None:
+                return best[1]
+            if len(usable) > 0:
                 #self.log.warning('found no account. returning first one...')
-                return all_accounts[0]
+                return usable[0]
             else:
                 self.log.info('found no account. creating a "free" account')
                 account = self.add(_private_account=True)
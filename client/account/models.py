@@ -151,6 +151,14 @@ class Account(Table, ErrorFunctions, InputFunctions, GreenletObject):
                 self.check_pool.set(self.max_check_tasks)
                 self.download_pool.set(self.max_download_tasks)
                 
+    def needs_boot(self):
+        """checks if boot would do anything"""
+        if self.working or not self.enabled or self.next_try is not None:
+            return False
+        if self.last_error is not None or self.last_error_type is not None:
+            return True
+        return not self._initialized or self._last_check is None or self._last_check + config['recheck_interval'] < time.time()
+
     def reboot(self):
         self.reset()
         self.boot()
@@ -551,7 +559,7 @@ class Http(object):
     @property
     def response_cache(self):
         if self._response_cache is None:
-            self._response_cache = CachedDict(livetime=30)
+            self._response_cache = CachedDict(livetime=30, max_size=100)
         return self._response_cache
 
     def _http_request_prepare(self, kwargs):
@@ -756,3 +764,18 @@ class HttpMultiAccount(Http, MultiAccount):
     def on_reset(self):
         MultiAccount.on_reset(self)
         Http.on_reset(self)
+
+
+# invalidate the account ranking of the pools
+
+@Account.enabled.changed
+@Account.last_error.changed
+@Account.next_try.changed
+@HosterAccount.username.changed
+@PremiumAccount.premium.changed
+@PremiumAccount.expires.changed
+@PremiumAccount.traffic.changed
+def on_account_changed(account, old):
+    pool = manager.get(account.name)
+    if pool is not None:
+        pool.invalidate()
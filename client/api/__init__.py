@@ -65,6 +65,10 @@ class Interface(interface.Interface):
     def ping():
         return {'uuid': settings.app_uuid}
 
+    def push_metrics():
+        """returns the statistics of the pushes to the frontend"""
+        return listener.metrics.get()
+
 is_connected = client.is_connected
 wait_connected = client.wait_connected
 
@@ -58,6 +58,14 @@ def deflate(data, compresslevel=9):
     deflated += compress.flush()
     return deflated
 
+def get_compresslevel(size):
+    """big messages are compressed faster at the cost of a slightly worse ratio"""
+    if size > 1024*1024:
+        return 1
+    if size > 64*1024:
+        return 6
+    return 9
+
 def inflate(data):
     return zlib.decompress(data, -zlib.MAX_WBITS)
 
@@ -92,7 +100,7 @@ def pack_message(destination, command=None, in_response_to=None, payload=None, c
         log.debug('SEND: {}'.format(layer1))
     if len(layer1[6]) > 300:
         layer1[5] |= COMPRESSED
-        layer1[6] = deflate(layer1[6])
+        layer1[6] = deflate(layer1[6], get_compresslevel(len(layer1[6])))
     if encrypt:
         layer1[5] |= ENCRYPTED
         layer1[6] = encrypt(layer1[6])
@@ -162,6 +170,16 @@ def send(destination, command=None, in_response_to=None, payload=None, channel=N
     if client is None:
         return
     message = pack_message(destination, command, in_response_to, payload, channel, encrypt)
+    send_packed(destination, message, _wait_for_master_connection)
+
+def get_backlog():
+    """returns the number of messages the local frontend connections did not send yet"""
+    return sum(connection.socket.client_queue.qsize() for connection in connections)
+
+def send_packed(destination, message, _wait_for_master_connection=False):
+    """sends a message returned by pack_message"""
+    if client is None:
+        return
     if _wait_for_master_connection:
         client.wait_connected()
     if client.is_connected():
@@ -15,10 +15,12 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
 import json
-import bisect
+import time
+import gevent
 
 from . import proto
 from .. import scheme, logger
+from ..scheme.transaction import merge_transaction_data
 from ..config import globalconfig
 from ..plugintools import Url
 
@@ -26,14 +28,61 @@ log = logger.get('api.push')
 
 config = globalconfig.new('api').new('push')
 config.default('interval', 0, float)
+config.default('max_interval', 5.0, float, description='Upper limit of the push interval while the frontend connections drain slowly')
+config.default('volatile_interval', 1.0, float)
 
-@config.register('inverval')
+@config.register('interval')
 def _(value):
     listener.delay = value
 
+# updates that only change these columns are sent at most every volatile_interval seconds
+volatile_columns = set(['action', 'table', 'id', 'progress', 'speed', 'eta'])
+
+
+class PushMetrics(object):
+    """statistics of the pushes to the frontend"""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.pushes = 0
+        self.objects = 0
+        self.bytes = 0
+        self.encode_time = 0.0
+        self.deferred = 0
+        self.drain_time = None
+        self.delay = 0.0
+        self.last = None
+
+    def add(self, objects, bytes, encode_time):
+        self.pushes += 1
+        self.objects += objects
+        self.bytes += bytes
+        self.encode_time += encode_time
+        self.last = dict(objects=objects, bytes=bytes, encode_time=encode_time)
+
+    def get(self):
+        pushes = float(self.pushes or 1)
+        return dict(
+            pushes=self.pushes,
+            deferred=self.deferred,
+            objects_per_push=self.objects/pushes,
+            bytes_per_push=self.bytes/pushes,
+            encode_time_per_push=self.encode_time/pushes,
+            drain_time=self.drain_time,
+            delay=self.delay,
+            last=self.last)
+
+
 class ApiListener(scheme.DelayedListener):
+    """coalesces the updates of all objects between two pushes. updates that
+    only change volatile columns are sent at most every volatile_interval seconds.
+    the delay between the pushes grows while the connections drain slowly.
+    """
     def __init__(self):
         scheme.DelayedListener.__init__(self, 'api', config['interval'])
+        self.metrics = PushMetrics()
+        self.last_volatile = 0
 
     def prepare(self, update):
         def rename(old, new):
@@ -109,21 +158,67 @@ class ApiListener(scheme.DelayedListener):
                 if data['table'] in ('account', 'package', 'file'):
                     rename('next_try', 'retry')
 
-            bisect.insort(push, (priority, data))
+            push.append((priority, data))
 
+        push.sort(key=lambda p: p[0])
         push = [p[1] for p in push]
         #self.dump(push)
         return push
 
+    def split_volatile(self, update):
+        """returns the updates to send now and the ones that only change volatile columns"""
+        now = time.time()
+        if now - self.last_volatile >= config['volatile_interval']:
+            self.last_volatile = now
+            return update, None
+        deferred = dict()
+        for uid, data in update.items():
+            if data['action'] == 'update' and volatile_columns.issuperset(data):
+                deferred[uid] = update.pop(uid)
+        self.metrics.deferred += len(deferred)
+        return update, deferred
+
+    def defer(self, deferred):
+        """keeps the deferred updates for the next push. updates committed
+        while sending are newer and win."""
+        newer, self.update = self.update, deferred
+        merge_transaction_data(self.update, newer)
+
+    def adapt_delay(self, elapsed, backlog):
+        """waits at least as long as the last push needed to be written to the
+        sockets. while the local frontends did not send the previous push yet
+        the delay is doubled, up to max_interval.
+        """
+        drain_time = self.metrics.drain_time
+        drain_time = elapsed if drain_time is None else drain_time*0.7 + elapsed*0.3
+        self.metrics.drain_time = drain_time
+        delay = max(config['interval'], drain_time)
+        if backlog:
+            delay = max(delay, self.delay*2, 0.1)
+        self.delay = self.metrics.delay = min(config['max_interval'], delay)
+
     def on_commit(self, update):
+        if proto.client is None:
+            return
+        update, deferred = self.split_volatile(update)
         push = self.prepare(update.values())
-        #log.debug('sending {} objects'.format(len(push)))
-        """if len(push) > 15:
-            self.delay = config['interval'] + 1.0
-            log.debug('throttling to {}'.format(self.delay))
-        else:
-            self.delay = config['interval']"""
-        proto.send('frontend', payload=push)
+        if push:
+            backlog = proto.get_backlog()
+            t = time.time()
+            message = proto.pack_message('frontend', payload=push)
+            encoded = time.time()
+            proto.send_packed('frontend', message)
+            self.metrics.add(len(push), len(message[6]), encoded - t)
+            self.adapt_delay(time.time() - encoded, backlog)
+        if deferred:
+            self.defer(deferred)
+
+    def do_commit(self):
+        scheme.DelayedListener.do_commit(self)
+        if self.update and not self.greenlet:
+            # deferred volatile updates
+            delay = self.last_volatile + config['volatile_interval'] - time.time()
+            self.greenlet = gevent.spawn_later(max(self.delay, delay), self.do_commit)
 
     def dump(self, update):
         print "ApiListener:"
@@ -0,0 +1,128 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import os
+import time
+import struct
+import hashlib
+
+
+class BloomFilter(object):
+    """set of strings with false positives but without false negatives"""
+    def __init__(self, bits=1 << 20, hashes=7, data=None, count=0):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray(data) if data is not None else bytearray((bits + 7)//8)
+        self.count = count
+
+    def _positions(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        a, b = struct.unpack('<QQ', hashlib.md5(key).digest())
+        for i in xrange(self.hashes):
+            yield (a + i*b) % self.bits
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.data[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        data = self.data
+        return all(data[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def __len__(self):
+        return self.count
+
+
+class ExpiringBloomFilter(object):
+    """bloom filter that forgets its keys after ttl/2 to ttl seconds.
+
+    keys are added to the newer of two generations. the older one is dropped
+    when the newer one is ttl/2 seconds old or reached its capacity.
+    """
+    magic = 'BLM1'
+    header = struct.Struct('<4sIIIdII')
+
+    def __init__(self, ttl, capacity=100000, bits=1 << 20, hashes=7):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.bits = bits
+        self.hashes = hashes
+        self.generations = [BloomFilter(bits, hashes), BloomFilter(bits, hashes)]
+        self.created = time.time()
+        self.dirty = False
+
+    def _rotate(self):
+        age = time.time() - self.created
+        if age >= self.ttl:
+            self.generations = [BloomFilter(self.bits, self.hashes), BloomFilter(self.bits, self.hashes)]
+        elif age >= self.ttl/2.0 or len(self.generations[0]) >= self.capacity:
+            self.generations = [BloomFilter(self.bits, self.hashes), self.generations[0]]
+        else:
+            return
+        self.created = time.time()
+        self.dirty = True
+
+    def add(self, key):
+        self._rotate()
+        self.generations[0].add(key)
+        self.dirty = True
+
+    def __contains__(self, key):
+        self._rotate()
+        return any(key in g for g in self.generations)
+
+    def __len__(self):
+        return sum(len(g) for g in self.generations)
+
+    def save(self, path):
+        current, old = self.generations
+        with open(path + '.tmp', 'wb') as f:
+            f.write(self.header.pack(self.magic, self.capacity, self.bits, self.hashes, self.created, current.count, old.count))
+            f.write(current.data)
+            f.write(old.data)
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        os.rename(path + '.tmp', path)
+        self.dirty = False
+
+    def load(self, path):
+        """loads the filter saved at path. returns False when it does not
+        exist or was saved with other parameters.
+        """
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return False
+        size = (self.bits + 7)//8
+        if len(data) != self.header.size + 2*size:
+            return False
+        magic, capacity, bits, hashes, created, count, old_count = self.header.unpack_from(data)
+        if magic != self.magic or bits != self.bits or hashes != self.hashes:
+            return False
+        pos = self.header.size
+        self.generations = [
+            BloomFilter(bits, hashes, data[pos:pos + size], count),
+            BloomFilter(bits, hashes, data[pos + size:], old_count)]
+        self.created = created
+        self.dirty = False
+        self._rotate()
+        return True
@@ -16,10 +16,13 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import os
 import time
+import math
 import bisect
 import gevent
 import hashlib
 
+from collections import OrderedDict
+
 from gevent.event import AsyncResult
 
 from . import interface, logger, api, settings
@@ -60,56 +63,135 @@ class Interface(interface.Interface):
         get_results[id].set(items)
 
 
+class TimerWheel(object):
+    """hierarchical timer wheel for the expiry of CachedDict keys.
+
+    every level has `slots` slots, a slot of level n covers slots**n ticks.
+    keys are scheduled once, touching a key only updates its deadline in the
+    cache. when a slot fires, keys with a later deadline are scheduled again.
+    one greenlet ticks the wheel while it contains keys.
+    """
+    def __init__(self, resolution=1.0, slots=64, levels=3):
+        self.resolution = resolution
+        self.slots = slots
+        self.levels = [[[] for _ in xrange(slots)] for _ in xrange(levels)]
+        self.overflow = []
+        self.current = int(time.time()/resolution)
+        self.count = 0
+        self.greenlet = None
+
+    def schedule(self, cache, key, deadline):
+        if not self.count:
+            # the wheel was idle, start at the current time
+            self.current = max(self.current, int(time.time()/self.resolution))
+        tick = max(int(math.ceil(deadline/self.resolution)), self.current + 1)
+        entry = cache, key
+        for level, wheel in enumerate(self.levels):
+            span = self.slots**level
+            if tick//span - self.current//span < self.slots:
+                wheel[(tick//span) % self.slots].append(entry)
+                break
+        else:
+            self.overflow.append(entry)
+        self.count += 1
+        if self.greenlet is None:
+            self.greenlet = gevent.spawn(self._run)
+
+    def _run(self):
+        try:
+            while self.count:
+                gevent.sleep(self.resolution)
+                self.advance(time.time())
+        finally:
+            self.greenlet = None
+
+    def advance(self, now):
+        """processes all ticks until now"""
+        end = int(now/self.resolution)
+        while self.current < end:
+            if not self.count:
+                self.current = end
+                break
+            tick = self.current + 1
+            # the keys moved down are scheduled relative to this tick
+            self.current = tick
+            # move the keys of the upper levels down when their slot starts
+            for level in xrange(len(self.levels), 0, -1):
+                span = self.slots**level
+                if tick % span:
+                    continue
+                if level == len(self.levels):
+                    entries, self.overflow = self.overflow, []
+                else:
+                    wheel = self.levels[level]
+                    slot = (tick//span) % self.slots
+                    entries, wheel[slot] = wheel[slot], []
+                self._reschedule(entries, now)
+
+            wheel = self.levels[0]
+            slot = tick % self.slots
+            entries, wheel[slot] = wheel[slot], []
+            self._reschedule(entries, now)
+
+    def _reschedule(self, entries, now):
+        self.count -= len(entries)
+        for cache, key in entries:
+            deadline = cache.timeouts.get(key)
+            if deadline is None:
+                continue
+            if deadline <= now:
+                cache._expire(key)
+            else:
+                self.schedule(cache, key, deadline)
+
+timer_wheel = TimerWheel()
+
+
 class CachedDict(dict):
-    def __init__(self, livetime=600, callback=None):
+    """dict with a sliding expiry time per key.
+
+    max_size limits the number of keys, the least recently used keys are
+    removed first. callback is called with the value of expired and removed keys.
+    """
+    def __init__(self, livetime=600, callback=None, max_size=None, wheel=None):
         self.livetime = livetime
         self.callback = callback
-        self.timeouts = dict()
-        self.greenlet = None
+        self.max_size = max_size
+        self.wheel = wheel or timer_wheel
+        self.timeouts = OrderedDict() if max_size else dict()
 
     def set_livetime(self, livetime):
         self.livetime = livetime
 
     def _set_timeout(self, key):
         t = time.time() + self.livetime
+        old = self.timeouts.pop(key, None) if self.max_size else self.timeouts.get(key)
         self.timeouts[key] = t
-        if self.greenlet is not None and self.greenlet.eta > t:
-            self.greenlet.kill()
-        self.greenlet = gevent.spawn_later(self.livetime, self._cleanup)
-        self.greenlet.eta = t
+        if old is None or t < old:
+            self.wheel.schedule(self, key, t)
 
-    def _cleanup(self):
-        self.greenlet = None
-        t = time.time()
-        smallest = None
-        for key, value in self.timeouts.items():
-            if value < t:
-                if self.callback:
-                    item = dict.__getitem__(self, key)
-                del self.timeouts[key]
-                dict.__delitem__(self, key)
-                if self.callback:
-                    self.callback(item)
-            elif smallest is None or smallest > value:
-                smallest = value
-        if smallest is not None:
-            self.greenlet = gevent.spawn_later(smallest - t, self._cleanup)
-            self.greenlet.eta = t
+    def _expire(self, key):
+        del self.timeouts[key]
+        if dict.__contains__(self, key):
+            item = dict.pop(self, key)
+            if self.callback:
+                self.callback(item)
 
     def __setitem__(self, key, value):
         self._set_timeout(key)
         dict.__setitem__(self, key, value)
+        if self.max_size:
+            while len(self.timeouts) > self.max_size:
+                self._expire(next(iter(self.timeouts)))
 
     def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
         self._set_timeout(key)
-        return dict.__getitem__(self, key)
+        return value
 
     def __delitem__(self, key):
         del self.timeouts[key]
         dict.__delitem__(self, key)
-        if not self and self.greenlet:
-            self.greenlet.kill()
-            self.greenlet = None
 
 
 def sha256(s):
@@ -20,11 +20,13 @@ import json
 import zlib
 import gevent
 import base64
-import random
 import difflib
 import types
 
-from . import core, event, plugintools, logger, cache, api
+from collections import OrderedDict
+
+from . import core, event, plugintools, logger, cache, api, settings
+from .bloomfilter import ExpiringBloomFilter
 from .contrib import gibberishaes
 from .scheme import transaction
 from .config import globalconfig
@@ -32,6 +34,7 @@ from .variablesizepool import VariableSizePool
 
 from gevent.pool import Pool
 from gevent.lock import Semaphore
+from gevent.threadpool import ThreadPool
 
 pool = Pool(size=40)
 lock = Semaphore()
@@ -41,9 +44,15 @@ config = globalconfig.new('check')
 config.default('max_retires', 3, int)
 config.default('use_cache', False, bool)
 config.default('get_cache_timeout', 5, int)
+config.default('cache_page_size', 500, int, description='Number of links per request to the remote file status cache')
+config.default('cache_miss_ttl', 7*24*3600, int, description='Seconds until links unknown to the remote file status cache are asked again')
 
 def init():
-    pass
+    if settings.check_cache_misses_file:
+        cache_misses.load(settings.check_cache_misses_file)
+
+def terminate():
+    save_cache_misses()
 
 ################################## hoster functions
 
@@ -238,6 +247,81 @@ def file_changed(e, file, old=None):
 def file_stopped(e, file):
     event.fire_once_later(0.5, 'check:spawn_tasks')
 
+################## ready queues
+
+# the files that are ready for a check by host. the queues are maintained by
+# the column change hooks of core.File, so spawn_tasks does not have to walk
+# over all files on every tick.
+
+ready = dict()          # host -> OrderedDict of files
+_ready_hosts = dict()   # file -> host of the queue
+_next_host = 0          # round robin offset of spawn_tasks
+
+def update(file):
+    host = _ready_hosts.get(file)
+    if _file_ready(file) and not file._table_deleted:
+        if host is file.host:
+            return
+        if host is not None:
+            remove(file)
+        ready.setdefault(file.host, OrderedDict())[file] = None
+        _ready_hosts[file] = file.host
+    elif host is not None:
+        remove(file)
+
+def remove(file):
+    host = _ready_hosts.pop(file, None)
+    if host is None:
+        return
+    files = ready[host]
+    del files[file]
+    if not files:
+        del ready[host]
+
+def iter_ready():
+    """yields all files of the ready queues"""
+    for files in ready.values():
+        for file in files.keys():
+            yield file
+
+def iter_candidates():
+    """yields the ready files round robin over all hosts with a free check slot.
+    a host is skipped as soon as its pool (or the pool of the selected account)
+    is full, so the costs depend on the number of spawned files.
+    """
+    global _next_host
+    hosts = ready.keys()
+    if not hosts:
+        return
+    start = _next_host % len(hosts)
+    _next_host += 1
+    queues = [(host, iter(ready[host])) for host in hosts[start:] + hosts[:start]]
+    while queues:
+        next_queues = []
+        for host, files in queues:
+            if host.check_pool.full():
+                continue
+            for file in files:
+                if _file_ready(file):
+                    break
+            else:
+                continue
+            if (yield file):
+                next_queues.append((host, files))
+        queues = next_queues
+
+@core.File.state.changed
+@core.File.enabled.changed
+@core.File.last_error.changed
+@core.File.working.changed
+@core.File.host.changed
+def on_file_changed(file, old):
+    update(file)
+
+@event.register('file:deleted')
+def on_file_deleted(e, file):
+    remove(file)
+
 ################## spawn tasks
 
 @event.register('check:spawn_tasks')
@@ -245,19 +329,21 @@ def spawn_tasks(e):
     core.sort_queue.wait()
     with lock, transaction:
         if config.use_cache and api.client.is_connected():
-            files = list(_check_via_api())
-        else:
-            files = core.files()
+            _check_via_api()
         if pool.full():
             return
-        for file in files:
-            if not _file_ready(file):
-                continue
-            if not _file_pools_ready(file):
-                continue
-            _spawn_task(file)
-            if pool.full():
+        candidates = iter_candidates()
+        spawned = None
+        while True:
+            try:
+                file = candidates.send(spawned)
+            except StopIteration:
                 return
+            spawned = _file_account_ready(file)
+            if spawned:
+                _spawn_task(file)
+                if pool.full():
+                    return
 
 def _spawn_task(file):
     if file.retry_num > config.max_retires:
@@ -281,14 +367,11 @@ def _file_ready(file):
         return False
     return True
 
-def _file_pools_ready(file):
-    if file.host.check_pool.full():
-        return False
-
+def _file_account_ready(file):
+    """resolves the account of file. returns False when its check pool is full"""
     file.account = file.host.get_account('check', file)
     if file.account.check_pool.full():
         return False
-
     return True
 
 ################## get/set remote file status cache
@@ -296,62 +379,98 @@ def _file_pools_ready(file):
 get_cache_results = dict()
 check_cache = dict()
 from_cache = set()
-cache_ignore = set()
 
-def _check_via_api():
-    global cache_ignore
+# hashed urls the remote cache knows nothing about
+cache_misses = ExpiringBloomFilter(config.cache_miss_ttl)
+
+@config.register('cache_miss_ttl')
+def config_cache_miss_ttl(value):
+    cache_misses.ttl = value
+
+decode_pool = ThreadPool(2)
 
+def _decode_cache_data(url, data):
+    data = base64.b64decode(data)
+    data = gibberishaes.decrypt(url, data)
+    data = zlib.decompress(data)
+    return json.loads(data)
+
+def _decode_cache_result(result, files):
+    """decodes the cache entries in the threadpool, returns [(fid, data), ...]"""
+    items = [(fid, files[fid].url, data) for fid, data in result.iteritems() if data is not None and fid in files]
+    return zip([fid for fid, _, _ in items], decode_pool.map(lambda item: _decode_cache_data(*item[1:]), items))
+
+def _check_via_api():
     files = dict()
-    for file in core.files():
+    for file in iter_ready():
         if file.package.system != 'download':
             continue
         if not _file_ready(file):
             continue
-        yield file # this file is maybe ready for a local check
-        if random.randint(0, 9) == 0:
-            continue
-        if file.hashed_url in cache_ignore:
-            continue
         if not file.host.use_check_cache:
             continue
+        if file.hashed_url in cache_misses:
+            continue
         files[file.hashed_url] = file
     if not files:
         return
 
     keys = files.keys()
+    page_size = max(1, config.cache_page_size)
     log.info('asking remote file status cache for infos about {} files'.format(len(keys)))
-    try:
-        result = cache.get(keys)
-    except BaseException as e:
-        log.error('error getting file status cache result: {}'.format(e))
-        return
+    found = missed = 0
+    for i in xrange(0, len(keys), page_size):
+        if not api.client.is_connected():
+            log.info('lost connection to the remote file status cache')
+            break
+        page = keys[i:i + page_size]
+        try:
+            result = cache.get(page)
+        except BaseException as e:
+            log.error('error getting file status cache result: {}'.format(e))
+            return
 
-    with transaction:
-        for fid, data in result.iteritems():
-            if data is None:
-                continue
-            if fid not in files:
-                log.warning('found no file with id {} for file status cache'.format(fid))
-                continue
-            from_cache.add(fid)
-            data = base64.b64decode(data)
-            data = gibberishaes.decrypt(files[fid].url, data)
-            data = zlib.decompress(data)
-            data = json.loads(data)
-            if 'offline' in data:
-                try:
-                    files[fid].set_offline(data['offline'])
-                except gevent.GreenletExit:
-                    pass
-                del data['offline']
-            if data:
-                files[fid].set_infos(**data)
-                event.fire('file:checked', files[fid])
-            del files[fid]
-
-    cache_ignore |= set(files.keys())
-
-    log.info('got {} files from remote cache ({} not found)'.format(len(result), len(files)))
+        try:
+            decoded = _decode_cache_result(result, files)
+        except BaseException as e:
+            log.error('error decoding file status cache result: {}'.format(e))
+            continue
+
+        with transaction:
+            for fid, data in decoded:
+                from_cache.add(fid)
+                file = files[fid]
+                if file._table_deleted:
+                    continue
+                if 'offline' in data:
+                    try:
+                        file.set_offline(data['offline'])
+                    except gevent.GreenletExit:
+                        pass
+                    del data['offline']
+                if data:
+                    file.set_infos(**data)
+                    event.fire('file:checked', file)
+        found += len(decoded)
+
+        # only links the backend answered with None are unknown to the cache
+        for fid in page:
+            if fid in result and result[fid] is None:
+                cache_misses.add(fid)
+                missed += 1
+
+    if cache_misses.dirty:
+        event.fire_once_later(30, 'check:save_cache_misses')
+
+    log.info('got {} files from remote cache ({} not found)'.format(found, missed))
+
+@event.register('check:save_cache_misses')
+def save_cache_misses(e=None):
+    if settings.check_cache_misses_file and cache_misses.dirty:
+        try:
+            cache_misses.save(settings.check_cache_misses_file)
+        except (IOError, OSError) as e:
+            log.warning('error saving file status cache misses: {}'.format(e))
 
 @event.register('file:checked')
 @event.register('file:offline')
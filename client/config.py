@@ -21,6 +21,8 @@ import json
 import keyring
 import traceback
 
+from collections import Counter
+
 from gevent.lock import Semaphore
 from gevent.event import Event
 
@@ -39,6 +41,51 @@ class ConfigTable(scheme.Table):
 
 _defaults = dict()
 
+_handles = dict()
+
+# read counters of the config keys, enabled by set_profile()
+profile = False
+read_counts = Counter()
+
+def set_profile(enabled):
+    global profile
+    profile = enabled
+    if not enabled:
+        read_counts.clear()
+
+
+class Handle(object):
+    """cached accessor of a config key for hot code paths.
+
+    the value is invalidated by a setter hook of the config column, so the
+    handle never returns a stale value (the config.*:changed events are
+    fired asynchronously).
+    """
+    __slots__ = ('key', 'value')
+
+    _invalid = object()
+
+    def __init__(self, key):
+        col = getattr(ConfigTable, key, None)
+        if not isinstance(col, scheme.Column):
+            raise AttributeError(key)
+        self.key = key
+        self.value = self._invalid
+        col.setter(self._invalidate)
+
+    def _invalidate(self, table, value):
+        self.value = self._invalid
+        return value
+
+    def get(self):
+        if profile:
+            read_counts[self.key] += 1
+        value = self.value
+        if value is self._invalid:
+            value = self.value = getattr(_configtable, self.key)
+        return value
+    __call__ = get
+
 
 class Config(object):
     def new(self, name):
@@ -110,7 +157,17 @@ config, value, old_value), 2 (value, old_value), 1 (value) or 0 arguments, not {
         except NameError:
             pass
 
+    def handle(self, key):
+        """returns the memoized Handle of key"""
+        try:
+            return _handles[key]
+        except KeyError:
+            h = _handles[key] = Handle(key)
+            return h
+
     def __getattr__(self, key):
+        if profile:
+            read_counts[key] += 1
         return getattr(_configtable, key)
     __getitem__ = __getattr__
 
@@ -204,6 +261,9 @@ class SubConfig(object):
     def register_hook(self, key, func, _config=None):
         return self._config.register_hook('{}.{}'.format(self._name, key), func, _config or self)
 
+    def handle(self, key):
+        return self._config.handle('{}.{}'.format(self._name, key))
+
     def __getattr__(self, key):
         #if key.startswith('_'):
         #    return object.__getattr__(self, key)
@@ -245,6 +305,9 @@ def configobj(config):
         def register_hook(self, key, func, _config=None):
             return config.register_hook(key, func, _config)
 
+        def handle(self, key):
+            return config.handle(key)
+
         def get(self, key):
             if not key.startswith('_'):
                 try:
@@ -334,6 +397,14 @@ class Interface(interface.Interface):
                     enum=value['enum'])
         return result
 
+    def profile(enabled=True):
+        """enables the read counters of the config keys"""
+        set_profile(enabled)
+
+    def read_counts(limit=20):
+        """returns the most often read config keys as [key, count] pairs"""
+        return read_counts.most_common(limit)
+
 
 @event.register('loader:initialized')
 def _(e):
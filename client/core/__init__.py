@@ -154,50 +154,48 @@ class Interface(interface.Interface):
 
     def stop_package(**filter):
         """stops packages. for arguments see accept_collected"""
+        def stop(obj):
+            obj.stop()
+            for f in obj.files:
+                f.enabled = False
         with transaction:
-            for obj in packages():
-                if obj.match_filter('api', **filter):
-                    obj.stop()
-                    for f in obj.files:
-                        f.enabled = False
+            filter_objects_callback(packages(), filter, stop, Package)
 
     def start_file(**filter):
         """open a file. With MacOS use VLC by default, windows will use startfile only for now. other oses will use xdg-open"""
-        filter_objects_callback(files(), filter, lambda obj: obj.startfile())
+        filter_objects_callback(files(), filter, lambda obj: obj.startfile(), File)
 
     def stop_file(**filter):
         """stops files. for arguments see accept_collected"""
+        def stop(obj):
+            obj.stop()
+            obj.enabled = False
         with transaction:
-            for obj in files():
-                if obj.match_filter('api', **filter):
-                    obj.stop()
-                    obj.enabled = False
+            filter_objects_callback(files(), filter, stop, File)
 
     def delete_package(**filter):
         """deletes packages. for arguments see accept_collected"""
         with lock:
             with transaction:
-                filter_objects_callback(_packages[:], filter, lambda obj: obj.delete())
+                filter_objects_callback(_packages[:], filter, lambda obj: obj.delete(), Package)
 
     def delete_file(**filter):
         """deletes files. for arguments see accept_collected"""
         with lock:
             with transaction:
-                for package in _packages[:]:
-                    filter_objects_callback(package.files[:], filter, lambda obj: obj.delete())
+                filter_objects_callback(files(), filter, lambda obj: obj.delete(), File)
 
     def erase_package(**filter):
         """erases packages. for arguments see accept_collected"""
         with lock:
             with transaction:
-                filter_objects_callback(_packages[:], filter, lambda obj: obj.erase())
+                filter_objects_callback(_packages[:], filter, lambda obj: obj.erase(), Package)
 
     def erase_file(**filter):
         """erases files. for arguments see accept_collected"""
         with lock:
             with transaction:
-                for package in _packages[:]:
-                    filter_objects_callback(package.files[:], filter, lambda obj: obj.erase())
+                filter_objects_callback(files(), filter, lambda obj: obj.erase(), File)
 
     def modify_package(update=None, **filter):
         """modifies packages
@@ -221,11 +219,11 @@ class Interface(interface.Interface):
                 func = rename_package
             else:
                 func = lambda obj: obj.modify_table(update)
-            filter_objects_callback(packages(), filter, func)
+            filter_objects_callback(packages(), filter, func, Package)
 
     def modify_file(update=None, **filter):
         with transaction:
-            filter_objects_callback(files(), filter, lambda obj: obj.modify_table(update))
+            filter_objects_callback(files(), filter, lambda obj: obj.modify_table(update), File)
 
     def move_file(target=None, **filter):
         target = get_by_uuid(int(target))
@@ -234,32 +232,31 @@ class Interface(interface.Interface):
         def update(file):
             file.package = target
         with transaction:
-            for p in _packages[:]:
-                filter_objects_callback(p.files[:], filter, update)
+            filter_objects_callback(files(), filter, update, File)
 
     def activate_package(**filter):
         with transaction:
-            filter_objects_callback(packages(), filter, lambda obj: obj.activate())
+            filter_objects_callback(packages(), filter, lambda obj: obj.activate(), Package)
 
     def activate_file(**filter):
         with transaction:
-            filter_objects_callback(files(), filter, lambda obj: obj.activate())
+            filter_objects_callback(files(), filter, lambda obj: obj.activate(), File)
 
     def deactivate_package(**filter):
         with transaction:
-            filter_objects_callback(packages(), filter, lambda obj: obj.deactivate())
+            filter_objects_callback(packages(), filter, lambda obj: obj.deactivate(), Package)
 
     def deactivate_file(**filter):
         with transaction:
-            filter_objects_callback(files(), filter, lambda obj: obj.deactivate())
+            filter_objects_callback(files(), filter, lambda obj: obj.deactivate(), File)
 
     def reset_package(**filter):
         with transaction:
-            filter_objects_callback(packages(), filter, lambda obj: obj.reset())
+            filter_objects_callback(packages(), filter, lambda obj: obj.reset(), Package)
 
     def reset_file(**filter):
         with transaction:
-            filter_objects_callback(files(), filter, lambda obj: obj.reset())
+            filter_objects_callback(files(), filter, lambda obj: obj.reset(), File)
 
     def start():
         with transaction:
@@ -294,6 +291,6 @@ class Interface(interface.Interface):
 
     def split_by(key=None, **filter):
         filter['system'] = 'download'
-        filter_objects_callback(_packages[:], filter, lambda obj: obj.split(key))
+        filter_objects_callback(_packages[:], filter, lambda obj: obj.split(key), Package)
 
 _pyflakes_silence = [config, log, lock, _packages, packages, files, Package, File, Chunk, GlobalStatus, global_status, sort_queue]
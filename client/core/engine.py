@@ -53,6 +53,7 @@ config.default('delete_extracted_archives', False, bool)
 # misc options
 config.default('removed_completed', 'never', str, enum="never package file".split())
 config.default('open_browser_after_add_links', False, bool)
+config.default('add_links_batch_size', 500, int, description='Number of links added per transaction')
 
 # adult
 config.default('adult', False, bool)
@@ -94,7 +95,7 @@ class GlobalStatus(Table):
     id = Column('api')
     tabs = Column('api', always_use_getter=True, getter_cached=True)
     packages = Column('api')
-    packages_working = Column('api')
+    packages_working = Column('api', always_use_getter=True, getter_cached=True)
     files = Column('api', always_use_getter=True, getter_cached=True)
     files_working = Column('api', always_use_getter=True, getter_cached=True)
     chunks = Column('api', always_use_getter=True, getter_cached=True)
@@ -115,28 +116,25 @@ class GlobalStatus(Table):
         return tabs
 
     def on_get_packages_working(self, value):
-        return sum(1 for p in packages() if p.working)
+        return value or 0
 
     def on_get_files(self, value):
-        return sum(len(p.files) for p in packages())
+        return value or 0
 
     def on_get_files_working(self, value):
-        return sum(p.files_working for p in packages())
+        return value or 0
 
     def on_get_chunks(self, value):
-        return sum(p.chunks for p in packages())
+        return value or 0
 
     def on_get_chunks_working(self, value):
-        return sum(p.chunks_working for p in packages())
+        return value or 0
 
     def on_get_size(self, value):
         return sum(p.size for p in packages())
 
     def on_get__progress(self, value):
-        ff = [f for f in files() if f.enabled and f._max_progress and f.progress]
-        max_progress = sum(f._max_progress for f in ff)
-        progress = sum(f.progress for f in ff) if max_progress else 0
-        return max_progress, progress
+        return value or (0, 0)
 
     def on_get_progress(self, value):
         if self.files == 0:
@@ -145,9 +143,9 @@ class GlobalStatus(Table):
         return max_progress and progress/max_progress or None
 
     def on_get_speed(self, value):
-        if not _packages:
+        if not _packages or not self.files_working:
             return 0
-        return sum(p.speed or 0 for p in packages())
+        return speedregister.globalspeed.get_bytes()
 
     def on_get_eta(self, value):
         if self.files == 0:
@@ -161,6 +159,29 @@ class GlobalStatus(Table):
         remaining = max_progress - progress
         return int((remaining/speed)*1000)
 
+    ####################### full recomputation of the aggregates (settings.check_aggregates)
+
+    def on_recompute_packages_working(self):
+        return sum(1 for p in packages() if p.working)
+
+    def on_recompute_files(self):
+        return sum(len(p.files) for p in packages())
+
+    def on_recompute_files_working(self):
+        return sum(p.on_recompute_files_working() for p in packages())
+
+    def on_recompute_chunks(self):
+        return sum(p.on_recompute_chunks() for p in packages())
+
+    def on_recompute_chunks_working(self):
+        return sum(p.on_recompute_chunks_working() for p in packages())
+
+    def on_recompute__progress(self):
+        ff = [f for f in files() if f.enabled and f._max_progress and f.progress]
+        max_progress = sum(f._max_progress for f in ff)
+        progress = sum(f.progress for f in ff) if max_progress else 0
+        return max_progress, progress
+
 with transaction:
     global_status = GlobalStatus()
 
@@ -176,7 +197,7 @@ class Package(Table):
     _table_created_event = True
     _table_deleted_event = True
 
-    id = Column(('db', 'api'), change_affects=[['global_status', 'packages']])
+    id = Column(('db', 'api'), change_affects=[['global_status', 'packages']], index=True)
     name = Column(('db', 'api'), read_only=False, fire_event=True)
     download_dir = Column(('db', 'api'), read_only=False)
     complete_dir = Column(('db', 'api'), read_only=False)
@@ -184,8 +205,8 @@ class Package(Table):
     extract = Column(('db', 'api'), read_only=False)             # value of None means global setting
     extract_passwords = Column(('db', 'api'), read_only=False)
     position = Column(('db', 'api'), read_only=False, fire_event=True)
-    enabled = Column('api', fire_event=True, change_affects=['tab'])        # dummy variable needed for frontend
-    state = Column(('db', 'api'), change_affects=['tab'], fire_event=True)  # collect, download, (extract), complete
+    enabled = Column('api', fire_event=True, change_affects=['tab'], index=True)        # dummy variable needed for frontend
+    state = Column(('db', 'api'), change_affects=['tab'], fire_event=True, index=True)  # collect, download, (extract), complete
     
     # collect download torrent complete
     tab = Column('api', always_use_getter=True, getter_cached=True, change_affects=[['global_status', 'tabs']])
@@ -196,7 +217,7 @@ class Package(Table):
 
     last_error = Column(('db', 'api'), change_affects=['last_error_type'])
     last_error_type = Column(('db', 'api'))
-    global_status = Column()
+    global_status = Column(change_affects=['files', 'files_working', 'chunks', 'chunks_working', 'working'])
 
     size = Column('api', always_use_getter=True, getter_cached=True, change_affects=['eta', ['global_status', 'size']])
     _progress = Column(always_use_getter=True, getter_cached=True)
@@ -204,21 +225,24 @@ class Package(Table):
                       change_affects=['speed', 'eta', '_progress', ['global_status', 'progress']])
     speed = Column('api', always_use_getter=True, getter_cached=True, change_affects=['eta', ['global_status', 'speed']])
     eta = Column('api', always_use_getter=True, getter_cached=True, change_affects=[['global_status', 'eta']])
-    files = Column(None, change_affects=[['global_status', 'files'], 'hosts', 'size', 'progress', 'tab'])
-    files_working = Column(None, always_use_getter=True, getter_cached=True,
-                           change_affects=[['global_status', 'files_working'], 'tab', 'working'])
-    chunks = Column('api', always_use_getter=True, getter_cached=True, change_affects=[['global_status', 'chunks']])
+    files = Column(None, change_affects=['hosts', 'size', 'progress', 'tab'],
+                   aggregate=['global_status', 'files', lambda self: len(self.files or ())])
+    files_working = Column(None, always_use_getter=True, getter_cached=True, change_affects=['tab', 'working'],
+                           aggregate=['global_status', 'files_working'])
+    chunks = Column('api', always_use_getter=True, getter_cached=True, aggregate=['global_status', 'chunks'])
     chunks_working = Column('api', always_use_getter=True, getter_cached=True,
-                            change_affects=[['global_status', 'chunks_working']])
+                            aggregate=['global_status', 'chunks_working'])
 
-    working = Column('api', always_use_getter=True, getter_cached=True,
-                     change_affects=['tab', ['global_status', 'packages_working']])
+    working = Column('api', always_use_getter=True, getter_cached=True, change_affects=['tab'],
+                     aggregate=['global_status', 'packages_working'])
 
     _torrent_hash = None
     _log = None
     _tab_set = False
+    _speed = None
 
     def __init__(self, extract_passwords=None, position=None, state='collect', system='download', **kwargs):
+        self._speed = speedregister.SpeedRegister(parent=speedregister.globalspeed)
         self.files = []
         self.global_status = global_status
 
@@ -265,7 +289,9 @@ class Package(Table):
     def on_get_speed(self, value):
         if not self.files:
             return
-        return sum(f.speed for f in self.files)
+        if not self.files_working:
+            return 0
+        return self._speed.get_bytes()
 
     def on_get_eta(self, value):
         if not self.files:
@@ -285,12 +311,21 @@ class Package(Table):
         return len(self.files)
 
     def on_get_files_working(self, value):
-        return self.files and sum(1 for f in self.files if f.working) or 0
+        return value or 0
 
     def on_get_chunks(self, value):
-        return self.files and sum(len(f.chunks) for f in self.files) or 0
+        return value or 0
 
     def on_get_chunks_working(self, value):
+        return value or 0
+
+    def on_recompute_files_working(self):
+        return self.files and sum(1 for f in self.files if f.working) or 0
+
+    def on_recompute_chunks(self):
+        return self.files and sum(len(f.chunks) for f in self.files) or 0
+
+    def on_recompute_chunks_working(self):
         return self.files and sum(f.chunks_working for f in self.files) or 0
 
     def on_get_working(self, value):
@@ -503,20 +538,20 @@ class File(Table, ErrorFunctions, InputFunctions, GreenletObject):
     _table_created_event = True
     _table_deleted_event = True
 
-    id = Column(('db', 'api'), change_affects=[['global_status', 'files']])
-    package = Column(('db', 'api'), fire_event=True,
+    id = Column(('db', 'api'), change_affects=[['global_status', 'files']], index=True)
+    package = Column(('db', 'api'), fire_event=True, index=True,
                      foreign_key=[Package, 'files', lambda self, package: package.delete()],
-                     change_affects=[['package', 'files']])
+                     change_affects=[['package', 'files'], 'working', 'chunks', 'chunks_working'])
     name = Column(('db', 'api'), getter_cached=True)
     size = Column(('db', 'api'), change_affects=[['package', 'size'], 'eta'], fire_event=True)
     position = Column(('db', 'api'), fire_event=True)
 
     # states: check, collect, download, download_complete, (extract, extract_complete), complete
-    state = Column(('db', 'api'), fire_event=True,
+    state = Column(('db', 'api'), fire_event=True, index=True,
                    change_affects=[['package', 'tab']])
     enabled = Column(('db', 'api'),
-                     fire_event=True, read_only=False,
-                     change_affects=['speed', 'name', 'working', ['package', 'tab'], ['package', 'size']])
+                     fire_event=True, read_only=False, index=True,
+                     change_affects=['speed', 'name', 'working', '_progress', ['package', 'tab'], ['package', 'size']])
     last_error = Column(('db', 'api'), change_affects=['name', 'working', 'last_error_type'], fire_event=True)
     last_error_type = Column(('db', 'api'))
     completed_plugins = Column(('db', 'api'))
@@ -532,13 +567,15 @@ class File(Table, ErrorFunctions, InputFunctions, GreenletObject):
     approx_size = Column('db', change_affects=['size'], fire_event=True)
     weight = Column('db')
 
-    host = Column('api', change_affects=['domain', ['package', 'hosts']], fire_event=True)
+    host = Column('api', change_affects=['domain', ['package', 'hosts']], fire_event=True, index=True)
     domain = Column('api', always_use_getter=True, getter_cached=True)
 
-    chunks = Column('api', change_affects=['chunks_working', ['package', 'chunks']], fire_event=True)
-    chunks_working = Column('api', always_use_getter=True, getter_cached=True, change_affects=[['package', 'chunks_working']])
+    chunks = Column('api', change_affects=['chunks_working'], fire_event=True,
+                    aggregate=['package', 'chunks', lambda self: len(self.chunks or ())])
+    chunks_working = Column('api', always_use_getter=True, getter_cached=True, aggregate=['package', 'chunks_working'])
 
-    progress = Column('api', change_affects=['speed', 'eta', ['package', 'progress']])
+    progress = Column('api', change_affects=['speed', 'eta', '_progress', ['package', 'progress']])
+    _progress = Column(always_use_getter=True, aggregate=['global_status', '_progress'])
     _max_progress = None
     speed = Column('api', always_use_getter=True, getter_cached=True, change_affects=['eta', ['package', 'speed']])
     _last_speed = False
@@ -550,11 +587,12 @@ class File(Table, ErrorFunctions, InputFunctions, GreenletObject):
     input = Column(None, fire_event=True)
 
     greenlet = Column(None, change_affects=['working'])
-    working = Column('api', always_use_getter=True, getter_cached=True, change_affects=['speed', ['package', 'files_working']])
+    working = Column('api', always_use_getter=True, getter_cached=True, change_affects=['speed'],
+                     aggregate=['package', 'files_working'])
 
     openable = Column('api', always_use_getter=True, getter_cached=True)
 
-    global_status = Column()
+    global_status = Column(change_affects=['_progress'])
 
     # variables only for download
     account = None
@@ -563,6 +601,8 @@ class File(Table, ErrorFunctions, InputFunctions, GreenletObject):
     download_next_func = None
     can_resume = True
     max_chunks = None
+    hasher = None
+    checksum_result = None
 
     # internal variables
     _log = None
@@ -657,7 +697,7 @@ class File(Table, ErrorFunctions, InputFunctions, GreenletObject):
             else:
                 self.last_error_type = 'fatal'
 
-        self._speed = speedregister.SpeedRegister()
+        self._speed = speedregister.SpeedRegister(parent=package and package._speed)
 
         self.retry_num = 0
 
@@ -673,6 +713,11 @@ class File(Table, ErrorFunctions, InputFunctions, GreenletObject):
         value = convert_name(self.package.system, value)
         return value
 
+    def on_set_package(self, value):
+        if self._speed is not None:
+            self._speed.set_parent(getattr(value, '_speed', None))
+        return value
+
     def on_set_hash_type(self, value):
         return value and value.lower() or None
         
@@ -800,6 +845,10 @@ class File(Table, ErrorFunctions, InputFunctions, GreenletObject):
     def on_get_progress(self, progress):
         return progress and self._max_progress and progress/self._max_progress or 0.0
 
+    def on_get__progress(self, value):
+        if self.enabled and self._max_progress and self.progress:
+            return self._max_progress, self.progress
+
     def on_get_speed(self, speed):
         return self.greenlet and self.enabled and self._speed and self._speed.get_bytes() or 0
 
@@ -924,9 +973,11 @@ class File(Table, ErrorFunctions, InputFunctions, GreenletObject):
 
     def init_progress(self, max, init=0.0):
         self._max_progress = float(max)
-        if self.progress != init:
-            with transaction:
+        with transaction:
+            if self.progress != init:
                 self.progress = float(init)
+            else:
+                self.set_column_dirty('progress')
 
     def add_progress(self, current):
         if self.progress is not None:
@@ -950,8 +1001,8 @@ class File(Table, ErrorFunctions, InputFunctions, GreenletObject):
     ####################### speed
 
     def register_speed(self, value):
+        """registers the bytes in the speed registers of the file, its package and globalspeed"""
         self._speed.register(value)
-        speedregister.globalspeed.register(value)
 
     ####################### wait/retry/fatal
 
@@ -1066,6 +1117,7 @@ class File(Table, ErrorFunctions, InputFunctions, GreenletObject):
             self.download_next_func = None
             self.can_resume = True
             self.max_chunks = None
+            self.checksum_result = None
 
             if self.package.system == 'download':
                 self.state = 'check'
@@ -1104,6 +1156,7 @@ class File(Table, ErrorFunctions, InputFunctions, GreenletObject):
         for chunk in self.chunks[:]:
             chunk.table_delete()
         self.chunks = []
+        self.hasher = None
 
     def delete(self, _package=False):
         if self.state == 'deleted':
@@ -16,17 +16,49 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import gevent
 
-from collections import defaultdict
+from itertools import islice
+from collections import Iterator
 
-from .engine import packages, files, convert_name, lock, log, config, Package, File
-from .. import hoster, ui
+from .engine import packages, convert_name, lock, log, config, Package, File
+from .. import hoster, ui, event
 from ..scheme import transaction
-from types import GeneratorType
+from ..progress import Progress
+
+########################## url index
+
+url_index = dict()      # url -> set of files
+_indexed_urls = dict()  # file -> indexed url
+
+def update_url_index(file):
+    old = _indexed_urls.pop(file, None)
+    if old is not None:
+        files = url_index[old]
+        files.discard(file)
+        if not files:
+            del url_index[old]
+    if not file._table_deleted and file.url is not None:
+        url_index.setdefault(file.url, set()).add(file)
+        _indexed_urls[file] = file.url
+
+def find_files_by_url(url):
+    """returns the files with the (normalized) url"""
+    return url_index.get(url, set())
+
+@File.url.changed
+def on_file_url_changed(file, old):
+    update_url_index(file)
+
+@event.register('file:deleted')
+def on_file_deleted(e, file):
+    update_url_index(file)
+
+
+########################## links
 
 def add_links(links, package_name=None, extract_passwords=None, system='download', package_id=None, ignore_plugins=None):
     if isinstance(links, basestring):
-        links = hoster.collect_links(links)
-    elif type(links) not in (list, dict, set, GeneratorType):
+        links = hoster.collect_links(links) or []
+    elif type(links) not in (list, tuple, dict, set) and not isinstance(links, Iterator):
         links = [links]
 
     if extract_passwords:
@@ -35,7 +67,6 @@ def add_links(links, package_name=None, extract_passwords=None, system='download
         elif not isinstance(extract_passwords, list):
             extract_passwords = list(extract_passwords)
     added = []
-    set_infos = list()
     if package_id:
         for p in packages():
             if p.id == package_id:
@@ -50,123 +81,153 @@ def add_links(links, package_name=None, extract_passwords=None, system='download
     else:
         default_package = None
 
-    with lock:
-        url_index = defaultdict(set)
-        for f in files():
-            url_index[f.url].add(f)
-
-        if package_name is not None:
+    # links are added in batches with their own transactions. the hub gets
+    # control between the batches, so huge imports do not block the client
+    # and the listeners do not get one giant commit.
+    batch_size = max(1, config.add_links_batch_size)
+    total = len(links) if hasattr(links, '__len__') else None
+    links = iter(links)
+    progress = None
+    done = 0
+
+    if package_name is not None:
+        with lock:
             package_name = convert_name(system, package_name)
 
-        hosts = set()
-        
-        with transaction:
-            for link in links:
-                if not isinstance(link, dict):
-                    link = {'url': link}
+    hosts = dict()
 
-                # get plugin
-                if 'host' not in link:
+    try:
+        while True:
+            batch = list(islice(links, batch_size))
+            if not batch:
+                break
+            set_infos = list()
+
+            # core.lock is taken per batch, other users can run between the batches
+            with lock, transaction:
+                if default_package is not None and default_package._table_deleted:
+                    default_package = None
+                for link in batch:
+                    if not isinstance(link, dict):
+                        link = {'url': link}
+
+                    # get plugin
+                    if 'host' not in link:
+                        try:
+                            host = hoster.find(link['url'])
+                        except ValueError:
+                            host = None
+                        if not host:
+                            log.warning('found no module for url {}'.format(link['url']))
+                            continue
+                        if ignore_plugins and host[0].name in ignore_plugins:
+                            log.debug('ignored url {} as requested'.format(link['url']))
+                            continue
+                        link['host'], link['pmatch'] = host
+
+                    # normalize url
                     try:
-                        host = hoster.find(link['url'])
+                        link['url'], link['extra'] = link['url'].rsplit("&---extra=", 1)
                     except ValueError:
-                        host = None
-                    if not host:
-                        log.warning('found no module for url {}'.format(link['url']))
-                        continue
-                    if ignore_plugins and host[0].name in ignore_plugins:
-                        log.debug('ignored url {} as requested'.format(link['url']))
-                        continue
-                    link['host'], link['pmatch'] = host
-
-                # normalize url
-                try:
-                    link['url'], link['extra'] = link['url'].rsplit("&---extra=", 1)
-                except ValueError:
-                    pass
-                link['url'] = link['host'].normalize_url(link['url'], link['pmatch'])
-                if not link['url']:
-                    log.warning('{}.normalize({}) returned null'.format(link['host'].name, link['url']))
-                    continue
-
-                # set package infos
-                link['extract_passwords'] = extract_passwords
-
-                # check if file already exists
-                dupes = url_index[link['url']]
-                if dupes:
-                    if any(True for f in dupes if f.state == 'check' and f.last_error == 'link already exists' and f.enabled is False):
+                        pass
+                    link['url'] = link['host'].normalize_url(link['url'], link['pmatch'])
+                    if not link['url']:
+                        log.warning('{}.normalize({}) returned null'.format(link['host'].name, link['url']))
                         continue
 
-                    if any(True for f in dupes if f.state in ('check', 'collect')):
-                        log.warning(u'duplicate link: {url}'.format(**link))
+                    # set package infos
+                    link['extract_passwords'] = extract_passwords
+
+                    # check if file already exists
+                    dupes = find_files_by_url(link['url'])
+                    if dupes:
+                        if any(True for f in dupes if f.state == 'check' and f.last_error == 'link already exists' and f.enabled is False):
+                            continue
+
+                        if any(True for f in dupes if f.state in ('check', 'collect')):
+                            log.warning(u'duplicate link: {url}'.format(**link))
+                            continue
+
+                    #find package by package_name or create a new one
+                    if default_package is None:
+                        package = filter(lambda p: p.state == 'collect' and p.name == package_name and p.system == system and (package_id is None or package_id == p.id), packages())
+                        if package:
+                            package = package[0]
+                            if extract_passwords:
+                                for password in extract_passwords:
+                                    if password not in package.extract_passwords:
+                                        package.extract_passwords.append(password)
+                            default_package = package
+                    if default_package is None:
+                        package = Package(id=package_id, name=package_name, extract_passwords=extract_passwords, system=system)
+                        default_package = package
+                    else:
+                        package = default_package
+                    link['package'] = package
+
+                    if dupes:
+                        dupe = next(iter(dupes))
+                        log.debug(u'already downloading: {url}'.format(**link))
+                        link['size'] = dupe.size
+                        link['approx_size'] = dupe.approx_size
+                        link['name'] = dupe.name
+                        link['enabled'] = False
+                        link['state'] = 'check'
+                        link['last_error'] = 'link already exists'
+                        link['last_error_type'] = 'info'
+                        file = File(**link)
+                        update_url_index(file)
+
+                        from .. import check
+                        check.assign_file(file, dupe.package.name)
+                        added.append(file.id)
                         continue
 
-                #find package by package_name or create a new one
-                if default_package is None:
-                    package = filter(lambda p: p.state == 'collect' and p.name == package_name and p.system == system and (package_id is None or package_id == p.id), packages())
-                    if package:
-                        package = package[0]
-                        if extract_passwords:
-                            for password in extract_passwords:
-                                if password not in package.extract_passwords:
-                                    package.extract_passwords.append(password)
-                        default_package = package
-                if default_package is None:
-                    package = Package(id=package_id, name=package_name, extract_passwords=extract_passwords, system=system)
-                    default_package = package
-                else:
-                    package = default_package
-                link['package'] = package
-
-                if dupes:
-                    dupe = dupes.pop()
-                    dupes.add(dupe)
-                    log.debug(u'already downloading: {url}'.format(**link))
-                    link['size'] = dupe.size
-                    link['approx_size'] = dupe.approx_size
-                    link['name'] = dupe.name
-                    link['enabled'] = False
-                    link['state'] = 'check'
-                    link['last_error'] = 'link already exists'
-                    link['last_error_type'] = 'info'
-                    file = File(**link)
-                    url_index[file.url].add(file)
+                    log.debug(u'new link: {url}'.format(**link))
 
-                    from .. import check
-                    check.assign_file(file, dupe.package.name)
-                    added.append(file.id)
-                    continue
+                    if link.get('name'):
+                        name = link['name']
+                        del link['name']
+                    else:
+                        name = None
 
-                log.debug(u'new link: {url}'.format(**link))
+                    file = File(**link)
+                    update_url_index(file)
 
-                if link.get('name'):
-                    name = link['name']
-                    del link['name']
-                else:
-                    name = None
+                    if name:
+                        with transaction:
+                            set_infos.append((file, dict(name=name)))
+                    hosts.setdefault(file.host, file)
+                    added.append(file.id)
 
-                file = File(**link)
-                url_index[file.url].add(file)
+                for i in set_infos:
+                    i[0].set_infos(**i[1])
+                    if i[0].package.system != 'torrent':
+                        i[0].state = 'check'
 
-                if name:
-                    with transaction:
-                        set_infos.append((file, dict(name=name)))
-                hosts.add(file.host)
-                added.append(file.id)
+                done += len(batch)
+                if progress is None and len(batch) == batch_size:
+                    progress = Progress('add_links')
+                if progress is not None:
+                    # the size of generators is unknown, expect at least one more batch
+                    progress.set(total or done + (len(batch) == batch_size and batch_size or 0), done)
+                    progress.commit()
 
-            for i in set_infos:
-                i[0].set_infos(**i[1])
-                if i[0].package.system != 'torrent':
-                    i[0].state = 'check'
+            gevent.sleep(0)
+    finally:
+        if progress is not None:
+            with transaction:
+                progress.set(done, done)
+                progress.commit()
+                progress.table_delete()
 
-        for host in hosts:
-            gevent.spawn(file.host.get_account, 'download', file)
+    for host, file in hosts.iteritems():
+        gevent.spawn(host.get_account, 'download', file)
 
-        if added and config.open_browser_after_add_links:
-            ui.browser_to_focus(True)
+    if added and config.open_browser_after_add_links:
+        ui.browser_to_focus(True)
 
-        return added
+    return added
 
 
 def accept_collected(file_filter=None, **filter):
@@ -229,8 +290,4 @@ def url_exists(url):
         return False
 
     url = host[0].normalize_url(url, host[1])
-    for f in files():
-        if f.url == url:
-            return True
-    
-    return False
+    return bool(find_files_by_url(url))
@@ -14,11 +14,16 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
+import time
 import json
+import gevent
 import keyring
 import sqlite3
 
-from . import scheme, settings, logger, event
+from collections import defaultdict
+
+from . import scheme, settings, logger, event, interface
+from .config import globalconfig
 from gevent.lock import Semaphore
 
 conn = None
@@ -27,8 +32,16 @@ log = logger.get('db')
 
 version = 21
 
+config = globalconfig.new('db')
+config.default('persistence', 'buffered', str, enum="immediate buffered".split())
+config.default('flush_interval', 1.0, float)
+config.default('flush_rows', 1000, int)
+
 class Cursor:
     def __init__(self):
+        # buffered rows have to be written before we read from the database
+        if listener is not None:
+            listener.flush()
         self.c = conn.cursor()
 
     def __enter__(self):
@@ -73,7 +86,12 @@ class SqlListener(scheme.TransactionListener):
                 log.critical('DB ERROR: {}'.format(values))
             raise
 
-    def on_update(self, c, uid, data):
+    def flush(self):
+        pass
+
+    def prepare_update(self, data):
+        """converts the update of a table to the values of its database row.
+        returns None when there is nothing to write"""
         table = data['table']
 
         del data['action']
@@ -117,6 +135,13 @@ class SqlListener(scheme.TransactionListener):
                 t = scheme.get_by_uuid(data['id'])
                 data['url'] = t._table_data['url'].value
 
+        return table, data
+
+    def on_update(self, c, uid, data):
+        prepared = self.prepare_update(data)
+        if prepared is None:
+            return
+        table, data = prepared
         keys = data.keys()
 
         if uid not in self.known_ids:
@@ -147,6 +172,167 @@ class SqlListener(scheme.TransactionListener):
         if uid in self.known_ids:
             self.known_ids.remove(uid)
 
+class BufferedSqlListener(SqlListener):
+    """buffers the row updates and writes them in one database transaction.
+    updates of the same row are coalesced until the buffer is flushed.
+    """
+    def __init__(self):
+        SqlListener.__init__(self)
+        self.updates = dict()   # (table, id) -> column values
+        self.deletes = set()    # (table, id)
+        self.greenlet = None
+        self.statements = dict()
+        self.stats = dict(flushes=0, rows=0, last_rows=0, last_latency=0.0, max_latency=0.0, total_latency=0.0)
+
+    def on_commit(self, update):
+        for data in update.itervalues():
+            key = data['table'], data['id']
+            if data['action'] in ('new', 'update'):
+                prepared = self.prepare_update(data)
+                if prepared is None:
+                    continue
+                self.deletes.discard(key)
+                if key in self.updates:
+                    self.updates[key].update(prepared[1])
+                else:
+                    self.updates[key] = prepared[1]
+            elif data['action'] == 'delete':
+                self.updates.pop(key, None)
+                self.deletes.add(key)
+
+        if len(self.updates) + len(self.deletes) >= config.flush_rows:
+            self.flush()
+        elif self.greenlet is None:
+            self.greenlet = gevent.spawn_later(config.flush_interval, self.flush)
+
+    def get_statement(self, action, table, columns):
+        key = action, table, columns
+        if key not in self.statements:
+            if action == 'insert':
+                q = 'INSERT INTO {} ("{}") VALUES ({})'.format(table, '", "'.join(columns), ', '.join('?'*len(columns)))
+            elif action == 'update':
+                q = 'UPDATE {} SET "{}"=? WHERE id=?'.format(table, '"=?, "'.join(columns))
+            else:
+                q = 'DELETE FROM {} WHERE id=?'.format(table)
+            self.statements[key] = q
+        return self.statements[key]
+
+    def encode(self, value):
+        if value in (True, False, None):
+            return value
+        return json.dumps(value)
+
+    def flush(self):
+        if self.greenlet is not None:
+            if self.greenlet is not gevent.getcurrent():
+                self.greenlet.kill()
+            self.greenlet = None
+        if not self.updates and not self.deletes:
+            return
+
+        updates, self.updates = self.updates, dict()
+        deletes, self.deletes = self.deletes, set()
+        t = time.time()
+
+        with lock:
+            c = conn.cursor()
+            try:
+                self.write(c, updates, deletes)
+                conn.commit()
+            except sqlite3.IntegrityError as e:
+                conn.rollback()
+                log.warning('error writing {} rows at once, writing them one by one: {}'.format(len(updates) + len(deletes), e))
+                self.write_rows(c, updates, deletes)
+                conn.commit()
+            except BaseException as e:
+                conn.rollback()
+                log.critical('DB ERROR: error writing {} rows: {}'.format(len(updates) + len(deletes), e))
+                self.requeue(updates, deletes)
+                raise
+
+        latency = time.time() - t
+        rows = len(updates) + len(deletes)
+        self.stats['flushes'] += 1
+        self.stats['rows'] += rows
+        self.stats['last_rows'] = rows
+        self.stats['last_latency'] = latency
+        self.stats['max_latency'] = max(self.stats['max_latency'], latency)
+        self.stats['total_latency'] += latency
+
+    def requeue(self, updates, deletes):
+        """puts the rows of a failed flush back into the buffer. changes
+        buffered while writing are newer and win."""
+        for key, data in updates.iteritems():
+            if key in self.deletes:
+                continue
+            newer = self.updates.get(key)
+            if newer is not None:
+                data.update(newer)
+            self.updates[key] = data
+        for key in deletes:
+            if key not in self.updates:
+                self.deletes.add(key)
+
+    def close(self):
+        """stops the flush timer and writes the buffered rows"""
+        if self.greenlet is not None:
+            self.greenlet.kill()
+            self.greenlet = None
+        self.flush()
+
+    def write(self, c, updates, deletes):
+        # find the rows that already exist in the database
+        unknown = defaultdict(list)
+        for table, id in updates:
+            if table+str(id) not in self.known_ids:
+                unknown[table].append(self.encode(id))
+        existing = set()
+        for table, ids in unknown.iteritems():
+            for i in xrange(0, len(ids), 500):
+                q = 'SELECT id FROM {} WHERE id IN ({})'.format(table, ', '.join('?'*len(ids[i:i+500])))
+                existing.update((table, unicode(row['id'])) for row in c.execute(q, ids[i:i+500]))
+
+        # group the rows by statement
+        inserts = defaultdict(list)
+        changes = defaultdict(list)
+        for (table, id), data in updates.iteritems():
+            columns = tuple(sorted(data))
+            values = [self.encode(data[k]) for k in columns]
+            if table+str(id) in self.known_ids or (table, unicode(self.encode(id))) in existing:
+                changes[(table, columns)].append(values + [self.encode(id)])
+            else:
+                inserts[(table, columns)].append(values)
+
+        removed = defaultdict(list)
+        for table, id in deletes:
+            removed[table].append([self.encode(id)])
+
+        for table, rows in removed.iteritems():
+            c.executemany(self.get_statement('delete', table, None), rows)
+        for (table, columns), rows in inserts.iteritems():
+            c.executemany(self.get_statement('insert', table, columns), rows)
+        for (table, columns), rows in changes.iteritems():
+            c.executemany(self.get_statement('update', table, columns), rows)
+
+        for table, id in updates:
+            self.known_ids.add(table+str(id))
+        for table, id in deletes:
+            self.known_ids.discard(table+str(id))
+
+    def write_rows(self, c, updates, deletes):
+        """slow path when the bulk write failed"""
+        for table, id in deletes:
+            c.execute(self.get_statement('delete', table, None), [self.encode(id)])
+            self.known_ids.discard(table+str(id))
+        for (table, id), data in updates.iteritems():
+            columns = tuple(sorted(data))
+            values = [self.encode(data[k]) for k in columns]
+            try:
+                c.execute(self.get_statement('insert', table, columns), values)
+            except sqlite3.IntegrityError:
+                c.execute(self.get_statement('update', table, columns), values + [self.encode(id)])
+            self.known_ids.add(table+str(id))
+
 def _dict_factory(cursor, row):
     d = {}
     for idx, col in enumerate(cursor.description):
@@ -229,8 +415,13 @@ def init():
         id UNICODE(100) PRIMARY KEY,
         data BLOB)"""
 
-    conn = sqlite3.connect(settings.db_file)
+    conn = sqlite3.connect(settings.db_file, cached_statements=500)
     conn.row_factory = _dict_factory
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+    except sqlite3.DatabaseError as e:
+        log.warning('could not enable write-ahead logging: {}'.format(e))
 
     #conn.row_factory =  sqlite3.Row
     with Cursor() as c:
@@ -322,7 +513,10 @@ def init():
         log.info('changed database version from {} to {}'.format(old_version, db_version))
 
     # create and register our listener
-    listener = SqlListener()
+    if config.persistence == 'buffered':
+        listener = BufferedSqlListener()
+    else:
+        listener = SqlListener()
     register_listener()
 
 def register_listener():
@@ -330,3 +524,19 @@ def register_listener():
 
 def unregister_listener():
     scheme.unregister(listener)
+
+def terminate():
+    # db is terminated after all other modules, so no row changes follow
+    if isinstance(listener, BufferedSqlListener):
+        listener.close()
+
+@interface.register
+class Interface(interface.Interface):
+    name = 'db'
+
+    def stats():
+        """returns the flush statistics of the buffered persistence"""
+        stats = dict(getattr(listener, 'stats', {}))
+        stats['persistence'] = config.persistence
+        stats['pending'] = len(getattr(listener, 'updates', ())) + len(getattr(listener, 'deletes', ()))
+        return stats
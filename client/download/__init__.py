@@ -14,7 +14,7 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
-from . import events
+from . import events, scheduler
 from .engine import start, pause, stop, config, strategy, DownloadFunction
 from .rtmp import rtmplink, is_rtmplink, load_rtmplink, RTMPDownload
 
@@ -36,11 +36,11 @@ class Interface(interface.Interface):
         stop()
 
     def force_package(**filter):
-        filter_objects_callback(core.packages(), filter, lambda obj: [events.spawn_download(f, ignore_pools=True) for f in obj.files])
+        filter_objects_callback(core.packages(), filter, lambda obj: [events.spawn_download(f, ignore_pools=True) for f in obj.files], core.Package)
 
     def force_file(**filter):
-        filter_objects_callback(core.files(), filter, lambda obj: events.spawn_download(obj, ignore_pools=True))
+        filter_objects_callback(core.files(), filter, lambda obj: events.spawn_download(obj, ignore_pools=True), core.File)
 
 
 def init():
-    pass
+    scheduler.rebuild()
@@ -19,7 +19,7 @@ import time
 import math
 import shutil
 
-from .. import core, event, ratelimit, plugintools, logger, seekingfile
+from .. import core, event, ratelimit, plugintools, logger, seekingfile, hashing
 from ..scheme import transaction, intervalled
 from ..config import globalconfig
 from ..contrib import sizetools
@@ -44,9 +44,20 @@ config.default('max_simultan_downloads', 2, int)
 config.default('max_chunks', 1, int)
 config.default('min_chunk_size', sizetools.KB(500), int)
 config.default('blocksize', sizetools.KB(8), int)
+config.default('max_blocksize', sizetools.KB(512), int)
 config.default('overwrite', 'ask', str, enum="ask skip rename overwrite".split())
 config.default('max_retires', 3, int)
 config.default('rate_limit', 0, int)
+config.default('inline_checksum', True, bool)
+config.default('adaptive_chunks', True, bool)
+config.default('adaptive_initial_chunks', 2, int)
+config.default('adaptive_interval', 5, int)
+config.default('adaptive_threshold', 0.1, float)
+
+# handles of the keys that are read on every block
+blocksize = config.handle('blocksize')
+max_blocksize = config.handle('max_blocksize')
+rate_limit = config.handle('rate_limit')
 
 
 @config.register('max_simultan_downloads')
@@ -176,18 +187,56 @@ def config_state_changed(value, old):
 
 ########################## the default stream download function (can be extended)
 
+class BufferPool(object):
+    """reusable read buffers by size"""
+    def __init__(self, max_free=32):
+        self.max_free = max_free
+        self.free = dict()
+
+    def acquire(self, size):
+        buffers = self.free.get(size)
+        if buffers:
+            return buffers.pop()
+        return bytearray(size)
+
+    def release(self, buf):
+        buffers = self.free.setdefault(len(buf), [])
+        if len(buffers) < self.max_free:
+            buffers.append(buf)
+
+buffers = BufferPool()
+
+
 class DownloadFunction(intervalled.Cache):
+    started = None
+    received = 0
+    buffer = None
+    limiter = None
+
     def __init__(self, input):
         self.input = input
         self.output = None
         self.chunk = None
         self.last_read = 0
         self.last_write = 0
+        self.pending = 0 # size of the block that is read or not yet written
         self.retry = 0
 
+    def get_block_size(self):
+        """grows the block size with the speed of the connection (about 20 reads per second)"""
+        block = blocksize()
+        limit = max_blocksize()
+        rate = rate_limit()
+        if rate > 0:
+            limit = min(limit, max(block, rate//10))
+        speed = self.get_speed()
+        while block*20 < speed and block*2 <= limit:
+            block *= 2
+        return block
+
     def get_read_size(self):
         if self.chunk.end is None:
-            size = config["blocksize"]
+            size = self.get_block_size()
         else:
             remaining = self.chunk.end - (self.chunk.pos + self.last_read)
             if remaining == 0:
@@ -209,35 +258,93 @@ class DownloadFunction(intervalled.Cache):
                     self.reinit_progress()
                     return self.get_read_size()
 
-            size = remaining > config["blocksize"] and config["blocksize"] or remaining
-        return size
+            block = self.get_block_size()
+            size = remaining > block and block or remaining
+        return max(size, 0)
 
     def read(self, retry=0):
         """only register last read size"""
         size = self.get_read_size()
         if size == 0:
             return
-        data = self.input.read(size)
-        size = len(data)
+        if self.started is None:
+            self.started = time.time()
+        self.pending = size
+        readinto = getattr(self.input, 'readinto', None) or getattr(self.input, 'recv_into', None)
+        if readinto is None:
+            data = self.input.read(size)
+            size = len(data)
+        else:
+            size = self.read_buffer(readinto, size)
+            data = buffer(self.buffer, 0, size)
+        self.pending = size
         if size == 0:
             return
-        ratelimit.sleep(size)
+        if self.limiter is None:
+            self.limiter = ratelimit.get_path(self.chunk.file)
+        self.limiter.sleep(size)
         self.last_read += size
+        self.received += size
         return data
 
+    def read_buffer(self, readinto, size):
+        """reads into a reusable buffer. the data is valid until the next read"""
+        if self.buffer is None or len(self.buffer) < size:
+            if self.buffer is not None:
+                buffers.release(self.buffer)
+            self.buffer = buffers.acquire(max(size, self.get_block_size()))
+        if size == len(self.buffer):
+            return readinto(self.buffer) or 0
+        return readinto(memoryview(self.buffer)[:size]) or 0
+
+    def release_buffer(self):
+        if self.buffer is not None:
+            buffers.release(self.buffer)
+            self.buffer = None
+
+    def get_speed(self):
+        """average speed of this connection"""
+        if self.started is None:
+            return 0
+        return self.received/max(time.time() - self.started, 1.0)
+
+    def get_position(self):
+        """the position up to which the connection reads, including the
+        block that is read right now"""
+        return self.chunk.pos + self.last_write + self.pending
+
     def write(self, data):
         size = len(data)
         if size:
-            self.output.write(data, self.chunk.pos + self.last_write)
+            pos = self.chunk.pos + self.last_write
+            self.output.write(data, pos)
+            self.update_hash(data, pos)
             self.last_write += size
+        self.pending = 0
         return size
 
+    def update_hash(self, data, pos):
+        """feeds the written data into the inline checksum of the file"""
+        file = self.chunk.file
+        hasher = file.hasher
+        if hasher is None or not hasher.matches(file.hash_type, file.hash_value, file.size):
+            if not config["inline_checksum"] or not file.hash_type or not file.hash_value or not file.size:
+                return
+            if not hashing.is_supported(file.hash_type):
+                return
+            hasher = file.hasher = hashing.RangeHasher(file.hash_type, file.hash_value, file.size)
+            file.checksum_result = None
+        hasher.update(pos, data)
+
     def reinit_progress(self):
         self.chunk.file.set_progress(sum(chunk.pos - chunk.begin for chunk in self.chunk.file.chunks))
 
     def process(self):
-        for data in iter(self.read, None):
-            self.write(data)
+        try:
+            for data in iter(self.read, None):
+                self.write(data)
+        finally:
+            self.release_buffer()
 
     def commit(self):
         """the intervalled commit function"""
@@ -286,10 +393,16 @@ class FileDownload(object):
         
         self.pool = VariableSizePool(file.max_chunks)
         self.event = Event()
+        self.connections = file.max_chunks
 
         self.stream = None
         self.next_data = None
 
+        # adaptive chunking
+        self.adaptive = False
+        self.functions = dict() # chunk -> running DownloadFunction
+        self.controller = None
+
     def init(self):
         with transaction:
             #self.set_context()
@@ -322,8 +435,16 @@ class FileDownload(object):
             chunk.spawn(self.download_chunk, chunk, stream=self.stream)
             self.pool.add(chunk.greenlet)
 
+        if self.adaptive and self.connections < self.file.max_chunks:
+            self.controller = gevent.spawn(self.adapt_connections)
+
         return self.run()
 
+    def set_connections(self, num):
+        self.connections = max(1, min(num, self.file.max_chunks))
+        self.pool.set(self.connections)
+        self.event.set()
+
     def spawn_chunk_download(self):
         """if self.file.is_paused():
             return 0"""
@@ -351,6 +472,8 @@ class FileDownload(object):
             self.pool.wait_available()
             with transaction:
                 started = self.spawn_chunk_download()
+                if not started and self.adaptive and not self.pool.full() and self.steal_chunk():
+                    started = self.spawn_chunk_download()
             if len(self.pool) == 0:
                 break
             if started == 0:
@@ -361,8 +484,61 @@ class FileDownload(object):
 
         self.file.log.debug('all chunk download greenlets are done')
 
+    def steal_chunk(self):
+        """splits the remaining range of the running chunk that needs the most time to complete.
+        returns the new chunk or None when no range is large enough
+        """
+        min_size = config['min_chunk_size']
+        speeds = [func.get_speed() for func in self.functions.itervalues()]
+        average = speeds and sum(speeds)/len(speeds) or 0
+
+        victim = None
+        for chunk, func in self.functions.iteritems():
+            if chunk.end is None or chunk.state != 'download':
+                continue
+            pos = func.get_position()
+            remaining = chunk.end - pos
+            if remaining < 2*min_size:
+                continue
+            speed = func.get_speed()
+            duration = remaining/speed if speed else float('inf')
+            if victim is None or duration > victim[0]:
+                victim = duration, chunk, pos, remaining, speed
+        if victim is None:
+            return
+
+        # split so that both parts need the same time when the new connection gets the average speed
+        _, chunk, pos, remaining, speed = victim
+        share = speed/(speed + average) if speed and average else 0.5
+        keep = min(max(int(remaining*share), min_size), remaining - min_size)
+        end = chunk.end
+        chunk.end = pos + keep
+        chunk.log.debug('splitting remaining range {}-{} at {}'.format(pos, end, chunk.end))
+        return core.Chunk(file=self.file, begin=chunk.end, end=end)
+
+    def adapt_connections(self):
+        """opens more connections while the speed of the file keeps rising"""
+        interval = config['adaptive_interval']
+        last_speed = None
+        while True:
+            gevent.sleep(interval)
+            if self.file.chunks_working < self.connections:
+                continue
+            speed = self.file._speed.get_bytes(interval)
+            if last_speed is not None and speed < last_speed*(1 + config['adaptive_threshold']):
+                self.file.log.debug('speed did not rise with {} connections. using {}'.format(self.connections, self.connections - 1))
+                self.set_connections(self.connections - 1)
+                break
+            if self.connections >= self.file.max_chunks:
+                break
+            last_speed = speed
+            self.set_connections(self.connections + 1)
+
     def finish(self):
         """clean up chunks and set errors/next_try to file"""
+        if self.controller:
+            self.controller.kill()
+
         if self.stream:
             close_stream(self.stream)
 
@@ -426,6 +602,8 @@ class FileDownload(object):
 
         download_file = self.file.get_download_file()
 
+        self.finalize_checksum(download_file)
+
         with transaction:
             # disable all other files in group
             hostname = self.file.host.get_hostname(self.file)
@@ -449,6 +627,20 @@ class FileDownload(object):
                     raise
             # TODO: delete empty directories
 
+    def finalize_checksum(self, path):
+        """completes the inline checksum. the checksum plugin uses the result instead of hashing the whole file again"""
+        hasher = self.file.hasher
+        self.file.hasher = None
+        if hasher is None or not hasher.matches(self.file.hash_type, self.file.hash_value, self.file.size):
+            return
+        try:
+            valid = self.copypool.apply_e((BaseException,), hasher.finalize, (path,))
+        except (IOError, OSError) as e:
+            self.file.log.warning('error finalizing inline checksum: {}'.format(e))
+            return
+        self.file.checksum_result = hasher.hash_type, hasher.hash_value, valid
+        self.file.log.debug('inline {} checksum valid: {}'.format(hasher.hash_type, valid))
+
     #########################################################
     
     def forced_rename(self):
@@ -568,7 +760,13 @@ class FileDownload(object):
             self.file.log.debug('using {} chunks with blocksize of {}'.format(num, block))
 
         self.file.max_chunks = num
-        self.pool.set(num)
+
+        # start with a few chunks, more are opened by adapt_connections and steal_chunk
+        self.adaptive = config['adaptive_chunks'] and self.file.can_resume and num > 1
+        if self.adaptive:
+            num = min(num, max(1, config['adaptive_initial_chunks']))
+            block = int(math.ceil(self.file.size/num))
+        self.set_connections(num)
 
         if not self.file.can_resume and first_chunk.pos > 0:
             self.file.log.debug('first chunk is at position {} but we cannot resume. resetting chunks'.format(first_chunk.pos))
@@ -580,6 +778,10 @@ class FileDownload(object):
         if len(self.file.chunks) == num and self.file.chunks[-1].end == self.file.size:
             return
 
+        if self.adaptive and self.is_tiled():
+            self.file.log.debug('chunks are covering the whole file. using {} chunks'.format(len(self.file.chunks)))
+            return
+
         if num == 1:
             if len(self.file.chunks) == 0:
                 self.file.log.debug('created one single brand new chunk')
@@ -619,6 +821,15 @@ class FileDownload(object):
 
         return result
 
+    def is_tiled(self):
+        """checks if the chunks cover the whole file without gaps (e.g. after splits of a previous download)"""
+        end = 0
+        for chunk in sorted(self.file.chunks, key=lambda c: c.begin):
+            if chunk.begin != end or chunk.end is None:
+                return False
+            end = chunk.end
+        return end == self.file.size
+
     #########################################################
 
     def download(self, chunk):
@@ -659,7 +870,7 @@ class FileDownload(object):
                 chunk.retry('no more connections allowed', 90)
             else:
                 self.file.max_chunks -= 1
-                self.pool.set(self.file.max_chunks)
+                self.set_connections(self.connections)
         finally:
             with transaction:
                 close_stream(stream)
@@ -675,9 +886,17 @@ class FileDownload(object):
 
         dlfunc.chunk = chunk
 
-        with dlfunc, chunk.file.filehandle as output:
-            dlfunc.output = output
-            dlfunc.process()
+        try:
+            with dlfunc, chunk.file.filehandle as output:
+                dlfunc.output = output
+                if isinstance(dlfunc, DownloadFunction) and dlfunc.process.__func__ is DownloadFunction.process.__func__:
+                    # the remaining range of this chunk can be stolen now
+                    self.functions[chunk] = dlfunc
+                    if self.adaptive and not self.pool.full():
+                        self.event.set()
+                dlfunc.process()
+        finally:
+            self.functions.pop(chunk, None)
 
         if (chunk.end is not None and chunk.end != chunk.pos) or not chunk.pos:
             chunk.retry('chunk is incomplete (pos {} != end {})'.format(chunk.pos, chunk.end), 60)
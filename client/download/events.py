@@ -18,6 +18,7 @@ import re
 import os
 import gevent
 
+from . import scheduler
 from .engine import strategy, pool, lock, download_file, working_downloads, config
 from .. import event, core, reconnect, api, account, input
 from ..scheme import transaction
@@ -64,7 +65,7 @@ def spawn_tasks(e):
         if config.state != 'started':
             return
         blocked_hosts = set()
-        for file in core.files():
+        for file in scheduler.iter_candidates(blocked_hosts):
             if pool.full():
                 return
             spawn_download(file, blocked_hosts)
@@ -99,10 +100,8 @@ def spawn_download(file, blocked_hosts=None, retry=False, ignore_pools=False):
             return False
 
     # check if another mirror is already working
-    path = file.get_download_file()
-    for f in core.files():
-        if f != file and ((f.state == 'download' and f.working) or ('download' in f.completed_plugins and not f.last_error)) and f.get_download_file() == path:
-            return False
+    if scheduler.mirror_working(file, file.get_download_file()):
+        return False
 
     if file.account.weight is None:
         if file.account.next_try and file.substate[0] != 'waiting_account':
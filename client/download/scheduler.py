@@ -0,0 +1,231 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# incremental indexes of the download queue. they are maintained by the column
+# change hooks of core.File, so spawn_tasks does not have to walk over all files
+# on every tick.
+
+import heapq
+import bisect
+import itertools
+
+from .. import core, event
+
+ready = dict()          # host -> [(rank, file), ...] sorted by rank
+busy = dict()           # download file path -> set of files
+
+_ready_entries = dict() # file -> (host, (rank, file))
+_busy_paths = dict()    # file -> indexed download file path
+_ranks = dict()         # file -> position in core.files()
+_rank_counter = itertools.count()
+_order_dirty = True
+
+
+########################## index conditions
+
+def is_ready(file):
+    if file._table_deleted:
+        return False
+    if file.state != 'download':
+        return False
+    if not file.enabled:
+        return False
+    if file.working:
+        return False
+    if file.package is None or file.package.system == 'torrent':
+        return False
+    if file.last_error:
+        return False
+    if file.name is None:
+        return False
+    return True
+
+def is_busy(file):
+    if file._table_deleted:
+        return False
+    if file.state == 'download' and file.working:
+        return True
+    return bool(file.completed_plugins and 'download' in file.completed_plugins and not file.last_error)
+
+
+########################## index maintenance
+
+def _get_rank(file):
+    if file not in _ranks:
+        _ranks[file] = next(_rank_counter)
+    return _ranks[file]
+
+def _add_ready(file):
+    item = (_get_rank(file), file)
+    bisect.insort(ready.setdefault(file.host, []), item)
+    _ready_entries[file] = file.host, item
+
+def _remove_ready(file):
+    host, item = _ready_entries.pop(file)
+    files = ready[host]
+    i = bisect.bisect_left(files, item[:1])
+    if i < len(files) and files[i][1] is file:
+        del files[i]
+    else:
+        files.remove(item)
+    if not files:
+        del ready[host]
+
+def _update_ready(file):
+    entry = _ready_entries.get(file)
+    if is_ready(file):
+        if entry is not None:
+            if entry[0] is file.host:
+                return
+            _remove_ready(file)
+        _add_ready(file)
+    elif entry is not None:
+        _remove_ready(file)
+
+def _update_busy(file):
+    old = _busy_paths.pop(file, None)
+    if old is not None:
+        files = busy[old]
+        files.discard(file)
+        if not files:
+            del busy[old]
+    if is_busy(file):
+        path = file.get_download_file()
+        busy.setdefault(path, set()).add(file)
+        _busy_paths[file] = path
+
+def update(file):
+    """re-evaluates all index entries of file"""
+    _update_ready(file)
+    _update_busy(file)
+
+def remove(file):
+    if file in _ready_entries:
+        _remove_ready(file)
+    _update_busy(file)
+    _ranks.pop(file, None)
+
+def invalidate_order():
+    global _order_dirty
+    _order_dirty = True
+
+def _rebuild_order():
+    global _order_dirty, _rank_counter
+    _order_dirty = False
+    _ranks.clear()
+    for i, file in enumerate(core.files()):
+        _ranks[file] = i
+    _rank_counter = itertools.count(len(_ranks))
+
+    files = list(_ready_entries)
+    ready.clear()
+    _ready_entries.clear()
+    for file in files:
+        _add_ready(file)
+
+def rebuild():
+    """rebuilds all indexes from scratch"""
+    ready.clear()
+    busy.clear()
+    _ready_entries.clear()
+    _busy_paths.clear()
+    for file in core.files():
+        update(file)
+    _rebuild_order()
+
+
+########################## queries
+
+def mirror_working(file, path):
+    """checks if another mirror is already working on (or has completed) path"""
+    return any(f is not file for f in busy.get(path, ()))
+
+def iter_candidates(blocked_hosts):
+    """yields the ready files in queue order. a host is skipped as soon as its
+    download pool is full or it was added to blocked_hosts, so the costs depend
+    on the number of spawned (and rejected) files, not on the queue size.
+    """
+    if _order_dirty:
+        _rebuild_order()
+
+    heap = [(files[0][0], host) for host, files in ready.iteritems() if not host.download_pool.full()]
+    heapq.heapify(heap)
+    while heap:
+        rank, host = heapq.heappop(heap)
+        files = ready.get(host)
+        if not files:
+            continue
+        i = bisect.bisect_left(files, (rank,))
+        if i == len(files):
+            continue
+        if files[i][0] != rank:
+            heapq.heappush(heap, (files[i][0], host))
+            continue
+        file = files[i][1]
+        yield file
+        if host in blocked_hosts or host.download_pool.full():
+            continue
+        # the list may have changed while the file was spawned, so search by rank
+        files = ready.get(host)
+        if files:
+            i = bisect.bisect_left(files, (rank + 1,))
+            if i < len(files):
+                heapq.heappush(heap, (files[i][0], host))
+
+
+########################## change hooks
+
+@core.File.state.changed
+@core.File.enabled.changed
+@core.File.last_error.changed
+@core.File.working.changed
+@core.File.name.changed
+@core.File.host.changed
+@core.File.completed_plugins.changed
+def on_file_changed(file, old):
+    update(file)
+
+@core.File.url.changed
+def on_file_url_changed(file, old):
+    _update_busy(file)
+
+@core.File.package.changed
+def on_file_package_changed(file, old):
+    invalidate_order()
+    update(file)
+
+@core.Package.system.changed
+def on_package_system_changed(package, old):
+    for file in package.files:
+        update(file)
+
+@core.Package.download_dir.changed
+def on_package_download_dir_changed(package, old):
+    for file in package.files:
+        _update_busy(file)
+
+@core.Package.files.changed
+@core.Package.position.changed
+def on_package_order_changed(package, old):
+    invalidate_order()
+
+@event.register('file:deleted')
+def on_file_deleted(e, file):
+    remove(file)
+
+@core.config.register('add_part_extension')
+def on_add_part_extension_changed():
+    rebuild()
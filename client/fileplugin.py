@@ -18,15 +18,16 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import sys
 import os
+import time
 import bisect
 import gevent
 import tempfile
 import base64
 import webbrowser
 
-from collections import defaultdict
+from collections import defaultdict, Counter
 from gevent.pool import Group
-from gevent.lock import Semaphore
+from gevent.event import Event
 from gevent.threadpool import ThreadPool
 from gevent import subprocess
 
@@ -37,6 +38,9 @@ from .config import globalconfig
 log = logger.get('loader')
 
 config = globalconfig.new('file')
+config.default('device_slots', 1, int, description='Number of extractions and checksum checks running at once on one disk')
+config.default('plugin_slots', {'checksum': 2, 'zipextract': 1, 'tarextract': 1}, dict, description='Number of jobs of a file plugin running at once on all disks')
+config.default('threads', 4, int, description='Number of threads for extractions and checksum checks')
 
 
 class FilePath(str):
@@ -65,14 +69,265 @@ class FilePath(str):
         str.__init__(self, path)
 
 
+def get_device(path):
+    """returns the device of path or of its nearest existing parent directory"""
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+
+class IOJob(object):
+    """a slot request of a plugin, passed to the plugins as hddsem.
+
+    `with hddsem:` waits for a free slot on the device of the processed file.
+    plugins writing to another directory use `with hddsem(target):` to
+    also wait for a slot on the device of target.
+    """
+    def __init__(self, scheduler, plugin, path):
+        self.scheduler = scheduler
+        self.plugin = plugin.name
+        self.priority = getattr(plugin, 'priority', 100)
+        self.size = getattr(path, 'st_size', 0)
+        self.devices = set([get_device(path)])
+        self.number = None
+        self.queued = None
+        self.started = None
+        self.ready = None
+        self.acquired = ()
+        self.depth = 0
+
+    def __call__(self, *paths):
+        for path in paths:
+            self.devices.add(get_device(path))
+        return self
+
+    def key(self):
+        return self.priority, self.size, self.number
+
+    def __enter__(self):
+        if not self.depth:
+            self.scheduler.acquire(self)
+        self.depth += 1
+        return self
+
+    def __exit__(self, *args):
+        self.depth -= 1
+        if not self.depth:
+            self.scheduler.release(self)
+
+
+class IOScheduler(object):
+    """runs the disk heavy plugin jobs. the number of running jobs is limited
+    per device (file.device_slots) and per plugin (file.plugin_slots). waiting
+    jobs are started by plugin priority and size, so checksums and other small
+    jobs do not wait for large archives. a job that can not start does not block
+    the jobs on other devices.
+    """
+    def __init__(self):
+        self.queue = []
+        self.counter = 0
+        self.devices = Counter()    # device -> running jobs
+        self.plugins = Counter()    # plugin name -> running jobs
+        self.waits = dict()         # plugin name -> [jobs, total wait time, max wait time]
+
+    def can_start(self, job):
+        slots = config.device_slots
+        if any(self.devices[device] >= slots for device in job.devices):
+            return False
+        slots = config.plugin_slots.get(job.plugin)
+        if slots is not None and self.plugins[job.plugin] >= slots:
+            return False
+        return True
+
+    def acquire(self, job):
+        self.counter += 1
+        job.number = self.counter
+        job.queued = time.time()
+        job.ready = Event()
+        self.queue.append(job)
+        self.dispatch()
+        try:
+            job.ready.wait()
+        except:
+            if job.started is None:
+                self.queue.remove(job)
+            else:
+                self.release(job)
+            raise
+
+    def release(self, job):
+        for device in job.acquired:
+            self.devices[device] -= 1
+            if not self.devices[device]:
+                del self.devices[device]
+        self.plugins[job.plugin] -= 1
+        if not self.plugins[job.plugin]:
+            del self.plugins[job.plugin]
+        job.started = None
+        job.acquired = ()
+        self.dispatch()
+
+    def start(self, job):
+        self.queue.remove(job)
+        job.acquired = frozenset(job.devices)
+        for device in job.acquired:
+            self.devices[device] += 1
+        self.plugins[job.plugin] += 1
+        job.started = time.time()
+        wait = job.started - job.queued
+        stats = self.waits.setdefault(job.plugin, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += wait
+        stats[2] = max(stats[2], wait)
+        job.ready.set()
+
+    def dispatch(self):
+        for job in sorted(self.queue, key=IOJob.key):
+            if self.can_start(job):
+                self.start(job)
+
+    def stats(self):
+        """returns queue depth and wait times per device and plugin"""
+        now = time.time()
+        devices = defaultdict(lambda: dict(running=0, queued=0))
+        plugins = defaultdict(lambda: dict(running=0, queued=0, waiting=0.0))
+        for device, running in self.devices.iteritems():
+            devices[str(device)]['running'] = running
+        for name, running in self.plugins.iteritems():
+            plugins[name]['running'] = running
+        for job in self.queue:
+            for device in job.devices:
+                devices[str(device)]['queued'] += 1
+            plugin = plugins[job.plugin]
+            plugin['queued'] += 1
+            plugin['waiting'] = max(plugin['waiting'], now - job.queued)
+        for name, (jobs, total, longest) in self.waits.iteritems():
+            plugins[name].update(jobs=jobs, wait_avg=total/jobs, wait_max=longest)
+        return dict(
+            running=sum(self.plugins.itervalues()),
+            queued=len(self.queue),
+            devices=dict(devices),
+            plugins=dict(plugins))
+
+
+class ExtractCancelled(Exception):
+    pass
+
+
+def member_path(extract, name):
+    """returns the target path of an archive member or None when the name is empty.
+    absolute paths and parent directory references are removed."""
+    name = os.path.splitdrive(name.replace('\\', '/'))[1]
+    parts = [p for p in name.split('/') if p not in ('', '.', '..')]
+    if not parts:
+        return None
+    return os.path.join(extract, *parts)
+
+
+class MemberExtract(object):
+    """extracts an archive member by member.
+
+    every member is extracted by a job of the plugin thread pool that holds the
+    hddsem slot only for that member. the progress is updated while the job is
+    running and the extraction stops between two blocks when the greenlet gets
+    killed or the file gets disabled.
+
+    subclasses implement members(), a generator that extracts one member per
+    step (using copy()), and set total and position().
+    """
+    interval = 0.5
+
+    def __init__(self, path, file, extract, hddsem, threadpool, bs=1024*1024):
+        self.path = path
+        self.file = file
+        self.extract = extract
+        self.hddsem = hddsem
+        self.threadpool = threadpool
+        self.bs = bs
+        self.total = None
+        self.written = 0
+        self.cancelled = False
+
+    def members(self):
+        raise NotImplementedError()
+
+    def position(self):
+        return self.written
+
+    def copy(self, src, target):
+        """copies the stream src to target (runs in thread pool)"""
+        directory = os.path.dirname(target)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        try:
+            with open(target, 'wb', self.bs) as f:
+                while True:
+                    if self.cancelled:
+                        raise ExtractCancelled()
+                    data = src.read(self.bs)
+                    if not data:
+                        break
+                    f.write(data)
+                    self.written += len(data)
+        except:
+            try:
+                os.unlink(target)
+            except OSError:
+                pass
+            raise
+
+    def next_member(self, members):
+        """extracts the next member (runs in thread pool)"""
+        try:
+            return next(members, False)
+        except ExtractCancelled:
+            return None
+
+    def update_progress(self):
+        if self.file is not None and self.total:
+            self.file.set_progress(min(self.position(), self.total))
+
+    def is_cancelled(self):
+        return self.file is not None and (not self.file.enabled or self.file.last_error)
+
+    def run(self):
+        members = self.members()
+        if self.file is not None and self.total:
+            self.file.init_progress(self.total)
+        try:
+            while True:
+                with self.hddsem(self.extract):
+                    job = self.threadpool.spawn(self.next_member, members)
+                    try:
+                        while not job.ready():
+                            job.wait(self.interval)
+                            self.update_progress()
+                    except:
+                        self.cancelled = True
+                        job.wait()
+                        raise
+                if job.get() is False:
+                    break
+                if self.is_cancelled():
+                    raise gevent.GreenletExit()
+        finally:
+            members.close()
+        self.update_progress()
+
+
 class FilePluginManager(object):
     def __init__(self):
         self.plugins = []
         self.counter = 0
         self.pool = variablesizepool.VariableSizePool(1)
         self.group = Group()
-        self.hddsem = Semaphore(2)
-        self.threadpool = ThreadPool(2)
+        self.scheduler = IOScheduler()
+        self.threadpool = ThreadPool(config.threads)
         
     def add(self, plugin):
         self.counter += 1
@@ -148,7 +403,12 @@ class FilePluginManager(object):
     def execute_plugin(self, plugin, path, file):
         f = plugin.process
         args = [path, file]
-        kwargs = {arg: getattr(self, arg, None) for arg in f.func_code.co_varnames[2:f.func_code.co_argcount]}
+        kwargs = dict()
+        for arg in f.func_code.co_varnames[2:f.func_code.co_argcount]:
+            if arg == 'hddsem':
+                kwargs[arg] = IOJob(self.scheduler, plugin, path)
+            else:
+                kwargs[arg] = getattr(self, arg, None)
         return f(*args, **kwargs)
 
     def dispatch(self, fp, delete_after_processing=False):
@@ -203,6 +463,17 @@ def spawn_tasks(e, file, old):
 manager = FilePluginManager()
 
 
+@config.register('device_slots')
+@config.register('plugin_slots')
+def on_slots_changed():
+    manager.scheduler.dispatch()
+
+
+@config.register('threads')
+def on_threads_changed(value):
+    manager.threadpool.maxsize = value
+
+
 def init():
     for mod in plugintools.load("file"):
         manager.add(mod)
@@ -309,6 +580,10 @@ class FileInterface(interface.Interface):
         print "will select:", repr(show)
         return selectfiles(show)
 
+    def io_stats():
+        """returns the running and queued plugin jobs per device and plugin"""
+        return manager.scheduler.stats()
+
     def force_extract(fileids=None):
         if not fileids:
             return
@@ -0,0 +1,306 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import zlib
+import bisect
+import struct
+import hashlib
+
+from Crypto.Cipher import AES
+
+from .contrib.mega import crypto
+
+algorithms = set(hashlib.algorithms)
+
+
+########################## crc32
+
+def _gf2_matrix_times(mat, vec):
+    s = 0
+    i = 0
+    while vec:
+        if vec & 1:
+            s ^= mat[i]
+        vec >>= 1
+        i += 1
+    return s
+
+def _gf2_matrix_square(mat):
+    return [_gf2_matrix_times(mat, mat[n]) for n in xrange(32)]
+
+def crc32_combine(crc1, crc2, len2):
+    """returns the crc32 of the concatenation of two blocks (port of zlib's crc32_combine)"""
+    crc1 &= 0xffffffff
+    crc2 &= 0xffffffff
+    if len2 <= 0:
+        return crc1
+
+    odd = [0xedb88320] + [1 << n for n in xrange(31)]
+    even = _gf2_matrix_square(odd)
+    odd = _gf2_matrix_square(even)
+
+    while True:
+        even = _gf2_matrix_square(odd)
+        if len2 & 1:
+            crc1 = _gf2_matrix_times(even, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+        odd = _gf2_matrix_square(even)
+        if len2 & 1:
+            crc1 = _gf2_matrix_times(odd, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+
+    return crc1 ^ crc2
+
+
+class CRC32(object):
+    """hashlib compatible interface to crc32"""
+    name = 'crc32'
+    digest_size = 4
+    block_size = 64
+
+    def __init__(self, init=""):
+        self._hash = 0
+        self.update(init)
+
+    def digest(self):
+        return struct.pack("I", self._hash & 0xffffffff)
+
+    def hexdigest(self):
+        return "{:08x}".format(self._hash & 0xffffffff)
+
+    def update(self, bytes):
+        self._hash = zlib.crc32(bytes, self._hash)
+
+
+########################## mega cbc-mac
+
+class MegaCbcMac(object):
+    """interface for checking cbc-mac of mega.co.nz"""
+    name = "cbcmac"
+    digest_size = 4
+    block_size = 16
+
+    def __init__(self, file_key):
+        file_key = crypto.base64_to_a32(file_key)
+        key = (file_key[0] ^ file_key[4], file_key[1] ^ file_key[5],
+               file_key[2] ^ file_key[6], file_key[3] ^ file_key[7])
+        self.meta_mac = file_key[6:8]
+        self.file_mac = '\0' * 16
+        self.key = crypto.a32_to_str(key)
+        self.aes = AES.new(self.key, mode=AES.MODE_CBC, IV=self.file_mac)
+        self.IV = crypto.a32_to_str([file_key[4], file_key[5]]*2)
+
+    def chunk_mac(self, chunk):
+        """the mac of a single mega chunk (the last block of the cbc encrypted chunk)"""
+        if not chunk or len(chunk) % 16:
+            chunk += '\0' * (16 - len(chunk) % 16)
+        enc = AES.new(self.key, mode=AES.MODE_CBC, IV=self.IV)
+        return enc.encrypt(chunk)[-16:]
+
+    def update_mac(self, mac):
+        self.file_mac = self.aes.encrypt(mac)
+
+    def update(self, chunk):
+        self.update_mac(self.chunk_mac(chunk))
+
+algorithms.add("crc32")
+algorithms.add("cbc_mac_mega")
+hashlib.crc32 = CRC32
+
+
+########################## helpers
+
+def new(hash_type, hash_value):
+    if hash_type in algorithms:
+        if hash_type == "cbc_mac_mega":
+            return MegaCbcMac(hash_value)
+        return getattr(hashlib, hash_type)()
+    return hashlib.new(hash_type)
+
+def is_supported(hash_type):
+    if hash_type in algorithms:
+        return True
+    try:
+        hashlib.new(hash_type)
+        return True
+    except ValueError:
+        return False
+
+def verify(check, hash_value):
+    if check.name == "cbcmac":
+        file_mac = crypto.str_to_a32(check.file_mac)
+        return (file_mac[0] ^ file_mac[1], file_mac[2] ^ file_mac[3]) == tuple(check.meta_mac)
+    return check.hexdigest() == hash_value.lower()
+
+def _read_range(f, begin, end, bs=1024*1024):
+    f.seek(begin)
+    while begin < end:
+        data = f.read(min(bs, end - begin))
+        if not data:
+            raise IOError('unexpected end of file at position {}'.format(begin))
+        begin += len(data)
+        yield data
+
+
+########################## inline hashing of chunked downloads
+
+class Segment(object):
+    """a continuously hashed range of a file"""
+    def __init__(self, begin, state=None):
+        self.begin = begin
+        self.end = begin
+        self.state = state
+
+        # only used by mega cbc-mac
+        self.start = None
+        self.buf = []
+        self.buflen = 0
+
+
+class RangeHasher(object):
+    """hashes the data of a file while it is written by one or more chunks.
+
+    every chunk feeds a segment that starts at its position. crc32 and mega
+    cbc-mac segments are combined on finalize, other algorithms can only hash
+    the segment starting at position 0. all ranges that were not hashed while
+    downloading are read from disk.
+    """
+    def __init__(self, hash_type, hash_value, size):
+        self.hash_type = hash_type
+        self.hash_value = hash_value
+        self.size = size
+        self.check = new(hash_type, hash_value)
+        self.segments = dict() # segments by end position
+
+        if self.check.name == 'cbcmac':
+            self.kind = 'cbcmac'
+            self.chunks = list(crypto.get_chunks(size))
+            self.starts = [start for start, _ in self.chunks]
+            self.macs = dict()
+        elif self.check.name == 'crc32':
+            self.kind = 'crc32'
+        else:
+            self.kind = 'stream'
+
+    def matches(self, hash_type, hash_value, size):
+        return self.hash_type == hash_type and self.hash_value == hash_value and self.size == size
+
+    def update(self, pos, data):
+        segment = self.segments.pop(pos, None)
+        self._drop(pos, pos + len(data))
+        if segment is None:
+            if self.kind == 'stream':
+                if pos != 0:
+                    return
+                segment = Segment(0, new(self.hash_type, self.hash_value))
+            else:
+                segment = Segment(pos, 0)
+
+        if self.kind == 'stream':
+            segment.state.update(data)
+        elif self.kind == 'crc32':
+            segment.state = zlib.crc32(data, segment.state)
+        else:
+            self._update_cbcmac(segment, data)
+        segment.end += len(data)
+
+        other = self.segments.get(segment.end)
+        if other is None or other.begin > segment.begin:
+            self.segments[segment.end] = segment
+
+    def _drop(self, begin, end):
+        """forgets all hashed data of the range that is written again"""
+        if begin >= end:
+            return
+        for key, segment in self.segments.items():
+            if segment.begin < end and begin < segment.end:
+                del self.segments[key]
+        if self.kind == 'cbcmac':
+            i = max(0, bisect.bisect_right(self.starts, begin) - 1)
+            while i < len(self.chunks) and self.chunks[i][0] < end:
+                self.macs.pop(self.chunks[i][0], None)
+                i += 1
+
+    def _update_cbcmac(self, segment, data):
+        if segment.start is None:
+            # skip the data until the next mega chunk starts
+            i = bisect.bisect_left(self.starts, segment.end)
+            if i == len(self.starts):
+                return
+            skip = self.starts[i] - segment.end
+            if skip >= len(data):
+                return
+            segment.start = i
+            data = data[skip:]
+
+        segment.buf.append(str(data)) # data can be a buffer that is reused by the next read
+        segment.buflen += len(data)
+        while segment.start < len(self.chunks) and segment.buflen >= self.chunks[segment.start][1]:
+            start, size = self.chunks[segment.start]
+            data = ''.join(segment.buf)
+            self.macs[start] = self.check.chunk_mac(data[:size])
+            data = data[size:]
+            segment.buf = data and [data] or []
+            segment.buflen = len(data)
+            segment.start += 1
+
+    def finalize(self, path):
+        """hashes the missing ranges of path and returns True when the checksum is valid"""
+        with open(path, 'rb') as f:
+            if self.kind == 'stream':
+                segment = self.segments and self.segments.values()[0] or None
+                if segment is None:
+                    check, pos = new(self.hash_type, self.hash_value), 0
+                else:
+                    check, pos = segment.state, segment.end
+                for data in _read_range(f, pos, self.size):
+                    check.update(data)
+            elif self.kind == 'crc32':
+                check = CRC32()
+                check._hash = self._finalize_crc32(f)
+            else:
+                check = self.check
+                for start, size in self.chunks:
+                    mac = self.macs.get(start)
+                    if mac is None:
+                        mac = check.chunk_mac(''.join(_read_range(f, start, start + size)))
+                    check.update_mac(mac)
+        return verify(check, self.hash_value)
+
+    def _finalize_crc32(self, f):
+        segments = sorted(self.segments.itervalues(), key=lambda s: (s.begin, -s.end))
+        crc, pos, i = 0, 0, 0
+        while pos < self.size:
+            # skip the segments that are not usable anymore
+            while i < len(segments) and segments[i].begin < pos:
+                i += 1
+            if i < len(segments) and segments[i].begin == pos:
+                segment = segments[i]
+                i += 1
+                # empty segments and segments beyond the file size are skipped
+                if pos < segment.end <= self.size:
+                    crc = crc32_combine(crc, segment.state, segment.end - segment.begin)
+                    pos = segment.end
+                continue
+            end = segments[i].begin if i < len(segments) else self.size
+            for data in _read_range(f, pos, end):
+                crc = zlib.crc32(data, crc)
+            pos = end
+        return crc
@@ -16,22 +16,240 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
+import re
 import bisect
 
 from ..plugintools import Url, Matcher, all_url_regex
 
 plugins = []
 index = dict()
+router = None
+
+class Node(object):
+    __slots__ = ('children', 'wildcard', 'exact')
+
+    def __init__(self):
+        self.children = dict()
+        self.wildcard = set()
+        self.exact = set()
+
+
+class Router(object):
+    """index of the plugin patterns.
+
+    Matcher hosts in *.hostname and =hostname syntax are stored in a trie of
+    reversed host labels. plugins with any other pattern are tried on every url.
+    collect_links looks up the hostnames of the text in the trie, the link
+    regexes of the other plugins are combined to a few alternations that
+    find the positions where one of them may match.
+    """
+    max_alternatives = 90
+    skip_links = {'rtmp', 'http', 'ftp'}
+
+    def __init__(self, plugins):
+        self.root = Node()
+        self.fallback = set()
+        self.positions = dict()
+        self.plugins = [p[2] for p in plugins]
+        self.update_positions(plugins)
+        for plugin in self.plugins:
+            hostnames = self.get_hostnames(plugin)
+            if hostnames is None:
+                self.fallback.add(plugin)
+                continue
+            for wildcard, hostname in hostnames:
+                node = self.root
+                for label in reversed(hostname.split('.')):
+                    node = node.children.setdefault(label, Node())
+                (node.wildcard if wildcard else node.exact).add(plugin)
+
+        self.link_regexes = dict()   # plugin -> [schemeless regex, ...]
+        self.link_fallback = None    # combined regexes of the fallback plugins
+
+    def get_hostnames(self, plugin):
+        result = []
+        for pattern in plugin.patterns:
+            if not isinstance(pattern, Matcher) or pattern.hostnames is None:
+                return
+            result += pattern.hostnames
+        return result
+
+    def update_positions(self, plugins):
+        self.positions.clear()
+        for i, p in enumerate(plugins):
+            self.positions[p[2]] = i
+
+    def match_host(self, host):
+        """returns the indexed plugins whose hostnames match host"""
+        found = set()
+        node = self.root
+        labels = host.split('.')
+        for i in xrange(len(labels) - 1, -1, -1):
+            node = node.children.get(labels[i])
+            if node is None:
+                break
+            found.update(node.wildcard)
+            if i == 0:
+                found.update(node.exact)
+        return found
+
+    def lookup(self, host):
+        """returns the positions of all plugins that may match host"""
+        found = self.fallback
+        if host:
+            found = found | self.match_host(host)
+        return sorted(self.positions[plugin] for plugin in found)
+
+    def get_link_regexes(self, plugin):
+        try:
+            return self.link_regexes[plugin]
+        except KeyError:
+            result = []
+            if plugin.name not in self.skip_links:
+                for p in plugin.patterns:
+                    r = p.get_regex(False)
+                    if r:
+                        result.append(r)
+            self.link_regexes[plugin] = result
+            return result
+
+    def get_link_fallback(self):
+        if self.link_fallback is None:
+            patterns = []
+            for plugin in self.plugins:
+                if plugin in self.fallback and plugin.name not in self.skip_links:
+                    for p in plugin.patterns:
+                        if hasattr(p, 'get_regex_plain'):
+                            r = p.get_regex_plain(False)
+                            if r:
+                                patterns.append(r)
+            self.link_fallback = combine(patterns, self.max_alternatives)
+        return self.link_fallback
+
+    def iter_links(self, text):
+        """yields the url groups of all schemeless link matches in text"""
+        # indexed plugins only match at the start of a hostname
+        ends = dict()
+        for m in host_regex.finditer(text):
+            start = m.start()
+            for plugin in self.match_host(m.group()):
+                for r in self.get_link_regexes(plugin):
+                    if ends.get(r, 0) > start:
+                        continue
+                    match = r.match(text, start)
+                    if match is not None:
+                        ends[r] = match.end()
+                        yield match.group(1)
+
+        # every pattern continues behind its last match, like finditer does
+        for r, members in self.get_link_fallback():
+            if members is None:
+                for m in r.finditer(text):
+                    yield m.group('url')
+                continue
+            ends = [0]*len(members)
+            pos = 0
+            while True:
+                m = r.search(text, pos)
+                if m is None:
+                    break
+                start = m.start()
+                for i, member in enumerate(members):
+                    if ends[i] > start:
+                        continue
+                    match = member.match(text, start)
+                    if match is not None:
+                        ends[i] = max(match.end(), start + 1)
+                        yield match.group('url')
+                pos = start + 1
+
+host_regex = re.compile(r'\w[\w\-]*(?:\.[\w\-]+)+')
+
+_inline_flags = re.compile(r'\(\?[iLmsux]+\)')
+
+def combine(patterns, max_alternatives):
+    """returns (regex, members) tuples. regex is an alternation without groups
+    of the compiled member patterns. patterns that can not be combined are
+    returned alone with members None.
+    """
+    result = []
+    alternatives = []
+    for r in patterns:
+        flat = flatten_groups(r)
+        if flat is None:
+            result.append((re.compile(r), None))
+        else:
+            alternatives.append((flat, r))
+    for i in xrange(0, len(alternatives), max_alternatives):
+        chunk = alternatives[i:i + max_alternatives]
+        result.append((re.compile('|'.join(flat for flat, _ in chunk)), [re.compile(r) for _, r in chunk]))
+    return result
+
+def flatten_groups(r):
+    """turns all groups of r into non-capturing groups. returns None when r
+    refers to its groups or sets inline flags, the flags of python 2 apply to
+    the whole alternation.
+    """
+    result = []
+    i, cls = 0, False
+    while i < len(r):
+        c = r[i]
+        if c == '\\':
+            if r[i + 1:i + 2].isdigit():
+                return
+            result.append(r[i:i + 2])
+            i += 2
+            continue
+        if cls:
+            if c == ']':
+                cls = False
+        elif c == '[':
+            cls = True
+            # a ] right after [ or [^ is part of the class
+            if r[i + 1:i + 2] == '^':
+                result.append('[^')
+                i += 2
+            else:
+                result.append('[')
+                i += 1
+            if r[i:i + 1] == ']':
+                result.append(']')
+                i += 1
+            continue
+        elif c == '(':
+            if r.startswith('(?P=', i) or r.startswith('(?(', i) or _inline_flags.match(r, i):
+                return
+            if r.startswith('(?P<', i):
+                result.append('(?:')
+                i = r.index('>', i) + 1
+                continue
+            if not r.startswith('(?', i):
+                result.append('(?:')
+                i += 1
+                continue
+        result.append(c)
+        i += 1
+    return ''.join(result)
+
+def get_router():
+    global router
+    if router is None:
+        router = Router(plugins)
+    return router
 
 def add(module):
+    global router
     plugin = module.this.model(module)
     bisect.insort(plugins, (plugin.priority, 0, plugin))
+    router = None
 
 def find(url, ignore=None):
     if ignore is None:
         ignore = set()
     _url = Url(url)
-    for p in plugins:
+    r = get_router()
+    for pos in r.lookup(_url.host):
+        p = plugins[pos]
         plugin = p[2]
         if not plugin.name in ignore and not plugin.multihoster:
             assert plugin.name is not None
@@ -44,6 +262,7 @@ def find(url, ignore=None):
                     if p[1] == 0:
                         plugins.remove(p)
                         bisect.insort(plugins, (plugin.priority, -1, plugin))
+                        r.update_positions(plugins)
                     return plugin, pmatch
 
 def find_by_name(name, default=None):
@@ -67,19 +286,10 @@ def collect_links(text, schemeless=True):
         links.add(m.group('url'))
 
     if schemeless:
-        for host in plugins:
-            if host[2].name in {'rtmp', 'http', 'ftp'}:
+        for link in get_router().iter_links(text):
+            link = link.split(' ', 1)[0]
+            if '://' in link:
                 continue
-            for p in host[2].patterns:
-                if not hasattr(p, 'get_regex'):
-                    continue
-                r = p.get_regex(False)
-                if not r:
-                    continue
-                for m in r.finditer(text):
-                    link = m.group(1).split(' ', 1)[0]
-                    if '://' in link:
-                        continue
-                    link = u'http://'+link
-                    links.add(link)
+            link = u'http://'+link
+            links.add(link)
     return links
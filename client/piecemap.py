@@ -0,0 +1,149 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# compact piece maps of torrents. every piece has one of four states:
+# 0 missing, 1 available, 2 downloading, 3 completed. the states are packed
+# with 2 bits per piece (the first piece in the highest bits), run-length
+# encoded as (varint length, byte) pairs and base64 encoded for the api.
+# a diff is the encoded xor of two packed maps, so unchanged regions
+# collapse to a few bytes.
+
+import os
+import re
+import base64
+
+from binascii import hexlify, unhexlify
+
+_runs = re.compile(r'(.)\1*', re.S)
+
+# translate tables shifting a state (0-3) into its bit position and back
+_shift = [bytes(bytearray((i << s) & 0xff for i in xrange(256))) for s in (6, 4, 2, 0)]
+_unshift = [bytes(bytearray((i >> s) & 3 for i in xrange(256))) for s in (6, 4, 2, 0)]
+
+
+def _to_int(data):
+    return int(hexlify(data) or '0', 16)
+
+def _from_int(value, size):
+    if not size:
+        return ''
+    return unhexlify('{:0{}x}'.format(value, size*2))
+
+
+def pack(states):
+    """packs a bytearray of piece states with 2 bits per piece"""
+    states = bytes(states)
+    size = (len(states) + 3)//4
+    states += '\0'*(size*4 - len(states))
+    # the shifted states of one byte never share a bit, so the four slices
+    # can be added as big integers without carrying into the next byte
+    value = 0
+    for i in xrange(4):
+        value += _to_int(states[i::4].translate(_shift[i]))
+    return _from_int(value, size)
+
+def unpack(data, count):
+    """returns the bytearray with the first count piece states of data"""
+    data = bytes(data)
+    states = bytearray(len(data)*4)
+    for i in xrange(4):
+        states[i::4] = data.translate(_unshift[i])
+    del states[count:]
+    return states
+
+
+def rle_encode(data):
+    result = bytearray()
+    for m in _runs.finditer(bytes(data)):
+        length = m.end() - m.start()
+        while length > 0x7f:
+            result.append(0x80 | (length & 0x7f))
+            length >>= 7
+        result.append(length)
+        result += m.group(1)
+    return bytes(result)
+
+def rle_decode(data):
+    result = bytearray()
+    data = bytearray(data)
+    i = length = shift = 0
+    while i < len(data):
+        byte = data[i]
+        i += 1
+        length |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        if i == len(data):
+            raise ValueError('truncated run length data')
+        result += chr(data[i])*length
+        i += 1
+        length = shift = 0
+    return bytes(result)
+
+
+def xor(a, b):
+    """xor of two packed maps with the same size"""
+    if len(a) != len(b):
+        raise ValueError('piece maps differ in size')
+    return _from_int(_to_int(a) ^ _to_int(b), len(a))
+
+
+def encode(packed):
+    return base64.b64encode(rle_encode(packed))
+
+def decode(data):
+    return rle_decode(base64.b64decode(data))
+
+
+class PieceMapHistory(object):
+    """remembers the last packed piece maps of a torrent by version, so
+    clients that send their version get a diff instead of the whole map.
+    the versions start with a random epoch, so the version of another
+    history (another torrent or a restarted client) never matches.
+    """
+    def __init__(self, keep=8):
+        self.keep = keep
+        self.epoch = hexlify(os.urandom(6))
+        self.counter = 0
+        self.maps = []      # [(version, packed), ...] oldest first
+
+    @property
+    def version(self):
+        return '{}-{}'.format(self.epoch, self.counter)
+
+    def update(self, packed):
+        """adds packed when it differs from the current map and returns the current version"""
+        if not self.maps or self.maps[-1][1] != packed:
+            self.counter += 1
+            self.maps.append((self.version, packed))
+            del self.maps[:-self.keep]
+        return self.version
+
+    def get(self, states, version=None):
+        """returns the api representation of states. with a known version
+        only the encoded xor to that version is returned (diff=True).
+        """
+        packed = pack(states)
+        current = self.update(packed)
+        result = dict(version=current, count=len(states), diff=False)
+        for v, old in self.maps:
+            if v == version and len(old) == len(packed):
+                result['diff'] = True
+                result['data'] = encode(xor(old, packed))
+                return result
+        result['data'] = encode(packed)
+        return result
@@ -19,6 +19,7 @@ import os
 import re
 import sys
 import gevent
+import gevent.os
 import itertools
 import traceback
 
@@ -61,6 +62,24 @@ changed_rartool(config["rartool"])
 extractors = dict()
 blacklist = set()
 
+# the indicator is overwritten with backspaces, a percentage in a member name is not followed by one
+percentage_regex = re.compile(r'(?:^|[\s\x08])(\d{1,3})%(?=\x08|\s*$)')
+
+# -idcd prints the member names, only the error lines of unrar are checked
+member_regex = re.compile(r'^(?:Extracting|Creating|Skipping)\s')
+packed_crc_regex = re.compile(r'\s[-:] packed data (?:CRC failed|checksum error) in volume ')
+encrypted_crc_regex = re.compile(r'^(?:.*\s- )?(?:CRC failed|Checksum error) in the encrypted file ')
+bad_archive_regex = re.compile(r'^(?:ERROR: )?Bad archive ', re.I)
+next_volume_regex = re.compile(r"^Insert disk with (.*?((\.part\d+)?\.r..)) \[C\]ontinue\, \[Q\]uit")
+
+def pipe_reader(pipe, size=65536):
+    """returns a function that reads the available data of pipe without blocking the hub"""
+    fd = pipe.fileno()
+    if sys.platform == 'win32':
+        return lambda: gevent.os.tp_read(fd, size)
+    gevent.os.make_nonblocking(fd)
+    return lambda: gevent.os.nb_read(fd, size)
+
 
 def match(path, file):
     if not isinstance(file, core.File):
@@ -96,6 +115,7 @@ class StreamingExtract(object):
         self.library = None
         self._library_added = set()
         self._deleted_library = None
+        self._progress_file = None
         extractors[id] = self
 
     def feed_part(self, path, file):
@@ -139,7 +159,7 @@ class StreamingExtract(object):
             else:
                 rarpw = "-p-"
 
-            cmd = [rarfile.UNRAR_TOOL, "x", "-y", rarpw, "-idq", "-vp", path, file.get_extract_path() + os.sep]
+            cmd = [rarfile.UNRAR_TOOL, "x", "-y", rarpw, "-idcd", "-vp", path, file.get_extract_path() + os.sep]
             file.log.info("starting extraction of {} with params {}".format(path[1:], cmd))
             self.rar = rarfile.custom_popen(cmd)
 
@@ -201,20 +221,35 @@ class StreamingExtract(object):
                 core.config.bruteforce_passwords.append(self.password)
 
     def wait_data(self):
-        bytes = ''
+        read = pipe_reader(self.rar.stdout)
+        rest = ''
         while True:
-            data = self.rar.stdout.read(1)
+            data = read()
             if not data:
                 break
 
-            bytes += data
-            for i in bytes.splitlines():
-                if i:
-                    result = self.new_data(i)
-                    if result is True:
-                        bytes = ''
+            lines = (rest + data).splitlines()
+            if data[-1] in '\r\n':
+                rest = ''
+            else:
+                # unterminated output: percentage indicator or volume prompt
+                rest = lines.pop()
+            for line in lines:
+                if line:
+                    self.update_progress(line)
+                    result = self.new_data(line)
                     if result and result is not True:
                         raise result
+
+            if rest:
+                self.update_progress(rest)
+                # the indicator is overwritten with backspaces
+                rest = rest[rest.rfind('\b') + 1:]
+                result = self.new_data(rest)
+                if result is True:
+                    rest = ''
+                elif result:
+                    raise result
         result = self.rar.returncode
         if result is None:
             try:
@@ -227,6 +262,19 @@ class StreamingExtract(object):
         else:
             self.close()
 
+    def update_progress(self, data):
+        """sets the last percentage of the unrar output as progress of the current part"""
+        percentages = percentage_regex.findall(data)
+        if not percentages or self.current is None:
+            return
+        file = self.current[1]
+        if file is None:
+            return
+        if file is not self._progress_file:
+            file.init_progress(100)
+            self._progress_file = file
+        file.set_progress(int(percentages[-1]))
+
     def finish_file(self, path, file):
         if file is not None:
             with core.transaction:
@@ -237,16 +285,19 @@ class StreamingExtract(object):
     
     def new_data(self, data):
         """called when new data or new line"""
-        if "packed data CRC failed in volume" in data:
+        if member_regex.match(data):
+            return
+
+        if packed_crc_regex.search(data):
             return self.kill('checksum error in rar archive')
 
-        if data.startswith("CRC failed in the encrypted file"):  # corrupt file or download not complete
+        if encrypted_crc_regex.match(data):  # corrupt file or download not complete
             return self.kill('checksum error in rar archive. wrong password?')
 
-        if "bad archive" in data.lower():
+        if bad_archive_regex.match(data):
             return self.kill('Bad archive')
 
-        m = re.search(r"Insert disk with (.*?((\.part\d+)?\.r..)) \[C\]ontinue\, \[Q\]uit", data)
+        m = next_volume_regex.match(data)
         if not m:
             return
 
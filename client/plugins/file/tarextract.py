@@ -16,8 +16,11 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
+import os
 import tarfile
 
+from ...fileplugin import MemberExtract, member_path
+
 name = 'tarextract'
 priority = 100
 
@@ -40,14 +43,62 @@ def match(path, file):
     return False
 
 
+class CountingReader(object):
+    """counts the bytes read from the archive"""
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.count += len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+class TarExtract(MemberExtract):
+    """reads the archive in stream mode, so every block is decompressed only once.
+    the progress is the position in the (compressed) archive."""
+    def __init__(self, *args, **kwargs):
+        MemberExtract.__init__(self, *args, **kwargs)
+        self.total = self.path.st_size
+        self.reader = None
+
+    def position(self):
+        return self.reader.count if self.reader is not None else 0
+
+    def members(self):
+        self.reader = CountingReader(open(self.path, 'rb'))
+        try:
+            ball = tarfile.open(fileobj=self.reader, mode='r|' + (self.path.compression or ''))
+            for member in ball:
+                target = member_path(self.extract, member.name)
+                if target is None:
+                    continue
+                if member.isfile():
+                    self.copy(ball.extractfile(member), target)
+                    ball.chmod(member, target)
+                    ball.utime(member, target)
+                elif member.isdir():
+                    if not os.path.isdir(target):
+                        os.makedirs(target)
+                elif member.issym() or member.islnk():
+                    # links must stay inside of the extract directory
+                    if os.path.join(self.extract, member.name) != target:
+                        continue
+                    if os.path.isabs(member.linkname) or '..' in member.linkname.split('/'):
+                        continue
+                    ball.extract(member, self.extract)
+                yield member
+        finally:
+            self.reader.close()
+
+
 def process(path, file, hddsem, threadpool):
-    mode = "r"
-    if path.compression:
-        mode += ":"+path.compression
-    ball = tarfile.open(path, mode)
     if file is None:
         extract = path.dir
     else:
         extract = file.get_extract_path()
-    with hddsem:
-        threadpool.spawn(ball.extractall, extract).wait()  # xxx progress somehow?
+    TarExtract(path, file, extract, hddsem, threadpool).run()
@@ -16,9 +16,11 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
+import os
 import zipfile
 
 from ... import core
+from ...fileplugin import MemberExtract, member_path
 
 name = 'zipextract'
 priority = 100
@@ -28,12 +30,31 @@ def match(path, file):
     if core.config.autoextract and path.ext == "zip":
         return True
 
-  
+
+class ZipExtract(MemberExtract):
+    def __init__(self, *args, **kwargs):
+        MemberExtract.__init__(self, *args, **kwargs)
+        self.ball = zipfile.ZipFile(self.path)
+        self.total = sum(info.file_size for info in self.ball.infolist())
+
+    def members(self):
+        with self.ball:
+            for info in self.ball.infolist():
+                target = member_path(self.extract, info.filename)
+                if target is None:
+                    continue
+                if info.filename.endswith('/'):
+                    if not os.path.isdir(target):
+                        os.makedirs(target)
+                else:
+                    with self.ball.open(info) as src:
+                        self.copy(src, target)
+                yield info
+
+
 def process(path, file, hddsem, threadpool):
-    ball = zipfile.ZipFile(path)
-    with hddsem:
-        if file is None:
-            extract = path.dir
-        else:
-            extract = file.get_extract_path()
-        threadpool.spawn(ball.extractall, extract).wait()  # xxx flat unpack, xxx progress?
+    if file is None:
+        extract = path.dir
+    else:
+        extract = file.get_extract_path()
+    ZipExtract(path, file, extract, hddsem, threadpool).run()
@@ -586,6 +586,8 @@ class MatchContext(dict):
     def __delattr__(self, key):
         del self[key]
 
+_wildcard_chars = re.compile(r'[*?\[]')
+
 class Matcher(object):
     def __init__(self, _scheme=None, _host=None, _path=None, _query_string=None, **query):
         """query parameter usage:
@@ -601,6 +603,7 @@ class Matcher(object):
         """
         self.scheme = self._compile(_scheme)
         self.host = self._compile(_host)
+        self.hostnames = self._hostnames(_host)
         self.path = self._compile(_path)
         self.query_string = self._compile(_query_string)
         self.query = dict()
@@ -639,14 +642,27 @@ class Matcher(object):
                 if p.startswith('~'):
                     p = p[1:]
                 if p.startswith('='):
-                    class m(object):
-                        def match(self, other):
-                            return p[1:] == other
-                    return m()
+                    return re.compile(re.escape(p[1:]) + '\Z(?ms)')
                 return re.compile(p)
             p = map(c, isinstance(p, list) and p or [p])
         return p
 
+    def _hostnames(self, p):
+        """returns (wildcard, hostname) tuples for host patterns in *.hostname and
+        =hostname syntax. returns None when any pattern has no fixed hostname.
+        """
+        if p is None:
+            return
+        result = []
+        for p in isinstance(p, list) and p or [p]:
+            if p.startswith('*.') and not _wildcard_chars.search(p[2:]):
+                result.append((True, p[2:]))
+            elif p.startswith('='):
+                result.append((False, p[1:]))
+            else:
+                return
+        return result
+
     def match(self, url):
         ctx = MatchContext(self)
         ctx.tag = self.tag
@@ -690,7 +706,12 @@ class Matcher(object):
         if isinstance(pattern, list):
             pattern = '|'.join(self._decompile(p) for p in pattern)
             return '('+pattern+')'
-        return pattern.pattern.lstrip('^').rstrip('$').replace('\Z(?ms)', '')
+        pattern = pattern.pattern.lstrip('^').rstrip('$').replace('\Z(?ms)', '')
+        if pattern.startswith('(.*\.)?'):
+            # only match whole host labels. (.*\.)? spans whitespace and
+            # backtracks quadratically on long lines of text
+            pattern = r'(?:[\w\-]+\.)*' + pattern[7:]
+        return pattern
 
     def get_regex_plain(self, with_scheme=True):
         attr = '_decompiled_regex_plain' if with_scheme else '_decompiled_regex_plain_schemeless'
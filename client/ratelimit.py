@@ -17,18 +17,62 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
 import time
+import weakref
 import gevent
 import requests
 
 from . import event, logger, speedregister
+from .config import globalconfig
 
 log = logger.get('ratelimit')
 
-class Bucket(object):
+config = globalconfig.new('ratelimit')
+config.default('hosts', dict(), dict, description='Rate limits of host plugins in bytes per second by plugin name')
+config.default('accounts', dict(), dict, description='Rate limits of accounts in bytes per second by account id')
+config.default('packages', dict(), dict, description='Rate limits of packages in bytes per second by package id')
+config.default('fair_share', True, bool, description='Share the rate of a bucket equally between its active children')
+fair_share = config.handle('fair_share')
+
+
+class Limiter(object):
     sleepmax = 2
-    
-    def __init__(self, rate=0):
+
+    def register(self, size):
+        raise NotImplementedError()
+
+    def get_limit(self):
+        """returns a value that changes when the configured rate changes"""
+        raise NotImplementedError()
+
+    def sleep(self, size, subtract=0, sleepfunc=gevent.sleep):
+        tosleep = self.register(size) - subtract
+        if tosleep <= 0:
+            sleepfunc(0)
+        elif tosleep <= self.sleepmax:
+            sleepfunc(tosleep)
+        else:
+            oldrate = self.get_limit()
+            while tosleep > 0 and oldrate == self.get_limit():
+                s = min(self.sleepmax, tosleep)
+                sleepfunc(s)
+                tosleep -= s
+
+
+class Bucket(Limiter):
+    """token bucket. a bucket with a parent gets at most the fair share of the
+    parent's rate: the rate divided by the active siblings of the same level,
+    or the rate the siblings leave unused, whichever is bigger.
+    """
+    usage_interval = 1
+
+    def __init__(self, rate=0, parent=None, level=None):
         """`rate` in bytes per second"""
+        self.parent = parent
+        self.level = level
+        self.children = dict() # child -> time of last register
+        self.usage = 0.0
+        self.usage_start = time.time()
+        self.usage_bytes = 0
         self.set_rate(rate)
         
     def set_rate(self, rate=0):
@@ -36,16 +80,56 @@ class Bucket(object):
         self.int_rate = None
         self.currenttime = time.time()
         self.filled = 0
+
+    def get_limit(self):
+        return self.int_rate or self.rate
+
+    def get_rate(self):
+        """returns the current rate including the share of the parent"""
+        rate = self.int_rate or self.rate
+        if self.parent is not None and fair_share():
+            share = self.parent.get_share(self)
+            if share and (not rate or share < rate):
+                return share
+        return rate
+
+    def get_share(self, child):
+        """returns the part of our rate child may use"""
+        rate = self.get_rate()
+        if not rate:
+            return 0
+        active, used = 1, 0
+        for c in self.children.keys():
+            if c is not child and c.level == child.level:
+                active += 1
+                used += c.usage
+        return max(float(rate)/active, rate - used)
+
+    def track(self, size, now):
+        """updates the usage (bytes per second) and the active children of our parent"""
+        self.usage_bytes += size
+        elapsed = now - self.usage_start
+        if elapsed >= self.usage_interval:
+            self.usage = self.usage_bytes/elapsed
+            self.usage_bytes = 0
+            self.usage_start = now
+            limit = now - 2*self.usage_interval
+            for c, t in self.children.items():
+                if t < limit:
+                    del self.children[c]
+        if self.parent is not None:
+            self.parent.children[self] = now
         
     def register(self, size):
         """register size bytes, returns time to sleep
         """
-        rate = self.int_rate or self.rate
+        now = time.time()
+        self.track(size, now)
+        rate = self.get_rate()
         if not rate:
             return 0
         
         if self.filled < rate:
-            now = time.time()
             self.filled += rate * (now-self.currenttime)
             if self.filled > rate:
                 # never fill more than rate
@@ -59,52 +143,138 @@ class Bucket(object):
             # too much, sleep
             return float(-self.filled) / rate
         return 0
-        
-    def sleep(self, size, subtract=0, sleepfunc=gevent.sleep):
-        tosleep = self.register(size) - subtract
-        if tosleep <= 0:
-            sleepfunc(0)
-        elif tosleep <= self.sleepmax:
-            sleepfunc(tosleep)
-        else:
-            oldrate = self.int_rate or self.rate
-            while tosleep > 0 and oldrate == (self.int_rate or self.rate):
-                s = min(self.sleepmax, tosleep)
-                sleepfunc(s)
-                tosleep -= s
 
-default_bucket = Bucket()
+
+class Path(Limiter):
+    """consumes from all buckets of a path, the slowest one decides"""
+    def __init__(self, buckets):
+        self.buckets = buckets
+
+    def get_limit(self):
+        return [b.get_limit() for b in self.buckets]
+
+    def register(self, size):
+        return max(b.register(size) for b in self.buckets)
+
+default_bucket = Bucket(level='global')
 
 set_rate = default_bucket.set_rate
 sleep = default_bucket.sleep
 register = default_bucket.register
 
-checker = None
-class RateChecker(object):
-    def __init__(self, bucket, speed, check_interval=5, reset_interval=600, limit_percent=0.95):
+
+########################## buckets of hosts, accounts and packages
+
+buckets = dict(
+    host=weakref.WeakValueDictionary(),
+    account=weakref.WeakValueDictionary(),
+    package=weakref.WeakValueDictionary())
+
+def get_bucket(level, key, parent=default_bucket):
+    """returns the bucket of level ('host', 'account' or 'package') and key.
+    buckets only live as long as a path references them.
+    """
+    key = str(key)
+    bucket = buckets[level].get(key)
+    if bucket is None:
+        rate = config[level + 's'].get(key, 0)
+        bucket = Bucket(rate, parent, level)
+        buckets[level][key] = bucket
+    return bucket
+
+def get_path(file):
+    """returns the limiter of the downloads of file. the path is global -> host
+    plugin -> account. packages can span several hosts, so their buckets are
+    children of the global bucket and limit the package as a whole.
+    """
+    path = [default_bucket]
+    if file.host is not None:
+        host = get_bucket('host', file.host.name)
+        path.append(host)
+        if file.account is not None:
+            path.append(get_bucket('account', file.account.id, host))
+    if file.package is not None:
+        path.append(get_bucket('package', file.package.id))
+    return Path(path[::-1])
+
+def _update_rates(level, rates):
+    for key, bucket in buckets[level].items():
+        rate = rates.get(key, 0)
+        if rate != bucket.rate:
+            bucket.set_rate(rate)
+
+@config.register('hosts')
+def config_hosts(value):
+    _update_rates('host', value)
+
+@config.register('accounts')
+def config_accounts(value):
+    _update_rates('account', value)
+
+@config.register('packages')
+def config_packages(value):
+    _update_rates('package', value)
+
+
+########################## policies adjusting the internal rate of buckets
+
+policies = list()
+
+class RatePolicy(object):
+    """adjusts the internal rate of a bucket of any level. check is called
+    every check_interval seconds while the policy is started.
+    """
+    def __init__(self, bucket, check_interval=5):
         self.bucket = bucket
-        self.speed = speed
         self.check_interval = check_interval
-        self.reset_interval = reset_interval
-        self.limit_percent = limit_percent
-
-        self.init = None
-        self.last_reset = time.time()
         self.greenlet = None
-        self.bucket.ini_rate = None
+        self.bucket.int_rate = None
 
     def start(self):
         if self.greenlet is None:
-            self.greenlet = gevent.spawn(self.check)
+            self.greenlet = gevent.spawn(self.run)
 
     def stop(self):
         if self.greenlet is not None:
             self.greenlet.kill()
             self.greenlet = None
+            self.reset()
+
+    def reset(self):
+        self.bucket.int_rate = None
+
+    def limit(self, rate):
+        self.bucket.int_rate = rate
+
+    def run(self):
+        try:
+            self.check()
+        finally:
+            self.greenlet = gevent.spawn_later(self.check_interval, self.run)
+
+    def check(self):
+        raise NotImplementedError()
+
+
+class RateChecker(RatePolicy):
+    """limits the bucket to the current speed when the latency of a ping rises"""
+    def __init__(self, bucket, speed=None, check_interval=5, reset_interval=600, limit_percent=0.95):
+        self.speed = speed
+        self.reset_interval = reset_interval
+        self.limit_percent = limit_percent
+        self.init = None
+        self.last_reset = time.time()
+        RatePolicy.__init__(self, bucket, check_interval)
+
+    def reset(self):
+        RatePolicy.reset(self)
+        self.init = None
+        self.last_reset = time.time()
 
-            self.init = None
-            self.last_reset = time.time()
-            self.bucket.ini_rate = None
+    def get_speed(self):
+        if self.speed is None:
+            return self.bucket.usage
+        return self.speed.get_bytes()
 
     def benchmark(self):
         s = 0
@@ -121,33 +291,36 @@ class RateChecker(object):
         return s/(i + 1)
 
     def check(self):
-        try:
-            if self.last_reset + self.reset_interval < time.time():
-                self.init = None
-                self.last_reset = time.time()
-                self.bucket.ini_rate = None
-                #print "!"*100, 'complete reset'
-
-            t = self.benchmark()
-            if self.init is None or t < self.init:
-                self.init = t
-                #print "!"*100, 'BEST', self.init
-            
-            if t < self.init*1.5 and self.bucket.ini_rate is not None:
-                self.bucket.ini_rate = None
-                print "!"*100, 'reset', t
-
-            if t > self.init*2.0:
-                speed = self.speed.get_bytes()
-                if speed > 8192:
-                    self.bucket.int_rate = speed*self.limit_percent
-                    print "!"*100, 'limit', t, int(speed), int(self.bucket.int_rate)
-        finally:
-            self.greenlet = gevent.spawn_later(self.check_interval, self.check)
+        if self.last_reset + self.reset_interval < time.time():
+            self.reset()
+
+        t = self.benchmark()
+        if self.init is None or t < self.init:
+            self.init = t
+        
+        if t < self.init*1.5 and self.bucket.int_rate is not None:
+            RatePolicy.reset(self)
+            log.debug('reset, latency {}'.format(t))
+
+        if t > self.init*2.0:
+            speed = self.get_speed()
+            if speed > 8192:
+                self.limit(speed*self.limit_percent)
+                log.debug('limit, latency {}, speed {}, rate {}'.format(t, int(speed), int(self.bucket.int_rate)))
+
+def add_policy(policy):
+    policies.append(policy)
+    return policy
+
+def remove_policy(policy):
+    policy.stop()
+    policies.remove(policy)
+
+checker = None
 
 def init():
     global checker
-    checker = RateChecker(default_bucket, speedregister.globalspeed)
+    checker = add_policy(RateChecker(default_bucket, speedregister.globalspeed))
 
     @event.register('download:started')
     @event.register('torrent:started')
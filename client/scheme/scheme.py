@@ -16,10 +16,12 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
 from collections import deque
+from itertools import ifilter
 
 from .. import event, settings, logger
 from .transaction import transaction, TransactionError
 
+import os
 import sys
 import gevent
 from gevent.lock import Semaphore
@@ -39,7 +41,10 @@ def _patch_method(dst, cls, name):
         if self._table_column.table._table_deleted:
             raise TransactionError('trying to set value on a deleted table')
         transaction.set_dirty(self._table_column) # can this cause an exception with foreign keys?
-        return fn(self, *args, **kwargs)
+        result = fn(self, *args, **kwargs)
+        if self._table_column.column.aggregate is not None:
+            transaction.update_aggregate(self._table_column)
+        return result
 
     setattr(dst, name, func)
 
@@ -128,7 +133,16 @@ def patch(col, value):
         return value
 
 class ColumnData(object):
-    pass
+    """the value and state of a column in a single table instance"""
+    __slots__ = ('table', 'column', 'value', 'cache', 'refresh_cache', 'aggregated')
+
+    def __init__(self, table, column):
+        self.table = table
+        self.column = column
+        self.value = None
+        self.cache = None
+        self.refresh_cache = True
+        self.aggregated = None # (parent table, contributed value)
 
 def channels_to_set(channels):
     if type(channels) is set:
@@ -140,11 +154,42 @@ def channels_to_set(channels):
     else:
         return set([channels])
 
+def _add(a, b):
+    """adds two aggregate values. tuples are added element-wise, None is neutral"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if isinstance(a, tuple):
+        return tuple(x + y for x, y in zip(a, b))
+    return a + b
+
+def _neg(a):
+    if a is None:
+        return None
+    if isinstance(a, tuple):
+        return tuple(-x for x in a)
+    return -a
+
+def _is_zero(a):
+    if a is None:
+        return True
+    if isinstance(a, tuple):
+        return not any(a)
+    return not a
+
 class Column(object):
     def __init__(self, channels=None, on_get=None, on_set=None, on_changed=None, read_only=True, fire_event=False,
-            change_affects=None, always_use_getter=False, getter_cached=False, foreign_key=None):
+            change_affects=None, always_use_getter=False, getter_cached=False, foreign_key=None, aggregate=None,
+            index=False):
         """read_only is only for api calls that would change that column
         getter_cached will cache return value of getter function until column is set dirty
+        aggregate is [attribute, column, func]. the value of this column (or func(table)) is added
+            to the column of the table in attribute. only the difference is pushed when this column
+            is set dirty, so the column referenced by attribute has to affect this column.
+            a table can implement on_recompute_<column> for a consistency check (settings.check_aggregates)
+        index maintains a secondary index of the tables by value (compared like match_filter does)
+            for filter_objects_callback. the getter must only depend on the value of the column
         """
         self.channels = channels_to_set(channels)
         
@@ -168,6 +213,12 @@ class Column(object):
             foreign_key.append(None)
         self.foreign_key = foreign_key
 
+        if aggregate is not None and len(aggregate) == 2:
+            aggregate.append(None)
+        self.aggregate = aggregate
+
+        self.index = dict() if index else None
+
         self.name = None
         self.initialized = False
 
@@ -189,6 +240,27 @@ class Column(object):
             else:
                 self.on_get = lambda table, value: value
 
+        # setup consistency check of incrementally maintained aggregates
+        on_recompute_func = 'on_recompute_{}'.format(self.name)
+        if hasattr(cls, on_recompute_func):
+            def check_aggregate_func(table, value):
+                result = unchecked_on_get(table, value)
+                if settings.check_aggregates:
+                    expected = getattr(table, on_recompute_func)()
+                    if result != expected:
+                        log.error('aggregate {}.{} is {}, recomputed {}'.format(table._table_name, self.name, result, expected))
+                        return expected
+                return result
+            unchecked_on_get = self.on_get
+            self.on_get = check_aggregate_func
+
+        # setup the secondary index
+        if self.index is not None:
+            if self.always_use_getter:
+                raise ValueError('column {}.{} can not be indexed'.format(cls._table_name, name))
+            index_on_get = self.on_get
+            self.index_key = lambda table, value: str(index_on_get(table, value))
+
         # setup getter cache
         if self.getter_cached:
             def getter_cache_func(table, value):
@@ -236,13 +308,7 @@ class Column(object):
     def init_table_instance(self, table):
         """init a table instance and setup data and hooks"""
         # create our column data
-        data = ColumnData()
-        data.table = table
-        data.column = self
-        data.value = None
-        data.cache = None
-        data.refresh_cache = True
-        table._table_data[self.name] = data
+        table._table_data[self.name] = ColumnData(table, self)
 
         # update table channels
         table._table_channels |= self.channels
@@ -293,7 +359,11 @@ class Column(object):
         for hook in self.set_hooks:
             value = hook(table, value)
 
+        if self.index is not None:
+            self.index_remove(table, old)
         table._table_data[self.name].value = patch(table._table_data[self.name], value)
+        if self.index is not None:
+            self.index_add(table, value)
 
         self.handle_foreign_key(table, old, value)
 
@@ -308,11 +378,92 @@ class Column(object):
         for hook in self.changed_hooks:
             hook(table, old)
 
+    # secondary index
+
+    def index_add(self, table, value):
+        key = self.index_key(table, value)
+        tables = self.index.get(key)
+        if tables is None:
+            tables = self.index[key] = set()
+        tables.add(table)
+
+    def index_remove(self, table, value):
+        key = self.index_key(table, value)
+        tables = self.index.get(key)
+        if tables is not None:
+            tables.discard(table)
+            if not tables:
+                del self.index[key]
+
+    def lookup(self, value):
+        """returns the tables that may match value in match_filter"""
+        values = [value]
+        if isinstance(value, (tuple, list, set)):
+            values.extend(value)
+        result = set()
+        for v in values:
+            result.update(self.index.get(str(v), ()))
+        return result
+
+    # aggregates
+
+    def update_aggregate(self, data):
+        """pushes the difference of our contribution to the aggregated column of the parent table.
+        returns the column data of all changed aggregates (of tables that are not deleted)
+        """
+        table = data.table
+        parent, value = None, None
+        if not table._table_deleted:
+            parent = getattr(table, self.aggregate[0])
+            if parent is not None:
+                value = self.aggregate[2](table) if self.aggregate[2] else self.get_value(table)
+                if isinstance(value, bool):
+                    value = int(value)
+
+        changed = list()
+        def push(target, delta):
+            if target is None or _is_zero(delta):
+                return
+            target_data = target._table_data[self.aggregate[1]]
+            target_data.value = _add(target_data.value, delta)
+            if not target._table_deleted:
+                changed.append(target_data)
+
+        old_parent, old_value = data.aggregated or (None, None)
+        if old_parent is parent:
+            push(parent, _add(value, _neg(old_value)))
+        else:
+            push(old_parent, _neg(old_value))
+            push(parent, value)
+        data.aggregated = (parent, value) if parent is not None else None
+        return changed
+
+
+# uids are reserved in blocks. the file holds the first uid of the next block,
+# so ids are never reused after a restart (at most one block is skipped).
+uid_block_size = 1024
+_uid_block = None # [next uid, end of block, file]
+
+def _read_uid():
+    uid = 1
+    # the temporary file is left over when we crashed while writing
+    for path in (settings.next_uid_file, settings.next_uid_file+'.tmp'):
+        try:
+            with open(path, 'r') as f:
+                uid = max(uid, int(f.read()))
+        except (IOError, ValueError):
+            pass
+    return uid
 
 def _write_uid(i, retry=2):
     try:
-        with open(settings.next_uid_file, 'wb+') as f:
+        with open(settings.next_uid_file+'.tmp', 'wb') as f:
             f.write(str(i))
+        try:
+            os.unlink(settings.next_uid_file)
+        except OSError:
+            pass
+        os.rename(settings.next_uid_file+'.tmp', settings.next_uid_file)
     except BaseException as e:
         if not retry:
             log.critical("could not write to app folder: {}".format(e))
@@ -322,23 +473,49 @@ def _write_uid(i, retry=2):
             _write_uid(i, retry-1)
     
 def get_next_uid():
+    global _uid_block
     with lock:
         if type(settings.next_uid_file) == int:
             settings.next_uid_file += 1
             return settings.next_uid_file
         else:
-            try:
-                with open(settings.next_uid_file, 'r') as f:
-                    uid = int(f.read())
-            except IOError:
-                uid = 1
-            except ValueError:
-                uid = 1
-                
-            _write_uid(uid+1)
-            
+            block = _uid_block
+            if block is None or block[0] >= block[1] or block[2] != settings.next_uid_file:
+                uid = _read_uid()
+                _write_uid(uid + uid_block_size)
+                block = _uid_block = [uid, uid + uid_block_size, settings.next_uid_file]
+            uid = block[0]
+            block[0] += 1
             return uid
 
+
+class TableLayout(object):
+    """the columns of a table class, computed when the first instance is created.
+    columns added to the class later have to be initialized with
+    Column.init_table_instance (see config and torrent).
+    """
+    def __init__(self, cls):
+        columns = dict()
+        channels = set()
+        for c in cls.__mro__:
+            if issubclass(c, Table):
+                for key, col in c.__dict__.iteritems():
+                    if isinstance(col, Column):
+                        col.init_table_class(cls, key)
+                        # like before, the column of a base class wins when it is overwritten
+                        columns[key] = col
+                        channels |= col.channels
+        self.columns = columns.items()
+        self.channels = frozenset(channels)
+
+        # columns that have to be set dirty explicitly when a table is created because
+        # they change other tables. all other columns of new tables are dirty implicitly.
+        self.dirty = [key for key, col in self.columns
+            if col.aggregate is not None or any(not isinstance(k, basestring) for k in col.change_affects)]
+
+        self.indexed = [(key, col) for key, col in self.columns if col.index is not None]
+
+
 class Table(object):
     _table_name = None
     _table_collection = None
@@ -349,34 +526,21 @@ class Table(object):
     def __new__(cls, *args, **kwargs):
         new = object.__new__(cls, *args, **kwargs)
 
+        layout = cls.__dict__.get('_table_layout')
+        if layout is None:
+            layout = TableLayout(cls)
+            cls._table_layout = layout
+
         # assign some internal variables
-        new._table_channels = set()
+        new._table_channels = layout.channels
         new._table_deleted = False
 
-        new._table_data = dict()
-
-        # initialize the base class
-        """if not hasattr(cls, '_table_columns'):
-            cls._table_columns = dict()
-            cc = [cls]
-            for c in cc:
-                if issubclass(c, Table):
-                    for key, col in c.__dict__.iteritems():
-                        if isinstance(col, Column) and key not in cls._table_columns:
-                            col.init_table_class(cls, key)
-                    cc += c.__bases__"""
-
-        columns = list()
-        for c in cls.__mro__:
-            if issubclass(c, Table):
-                for key, col in c.__dict__.iteritems():
-                    if isinstance(col, Column):
-                        col.init_table_class(cls, key)
-                        columns.append(col)
-
         # initialize this instance
-        for col in columns:
-            col.init_table_instance(new)
+        data = new._table_data = dict()
+        for key, col in layout.columns:
+            data[key] = ColumnData(new, col)
+        for key, col in layout.indexed:
+            col.index_add(new, None)
 
         # assign uuid
         if 'id' in kwargs and kwargs['id'] is not None:
@@ -384,9 +548,10 @@ class Table(object):
         else:
             new._uuid = get_next_uid()
 
-        # set all columns dirty (performance killer, about 20%)
-        for col in new._table_data.itervalues():
-            transaction.set_dirty(col)
+        # set table dirty. this sets all columns dirty, too
+        transaction.set_new(new)
+        for key in layout.dirty:
+            transaction.set_dirty(data[key])
 
         # set the table id
         if not hasattr(new, 'id') or new.id is None:
@@ -402,9 +567,6 @@ class Table(object):
         # add to main collection
         all_tables[new._uuid] = new
 
-        # set table dirty
-        transaction.set_new(new)
-
         return new
 
     def set_column_dirty(self, name):
@@ -433,8 +595,14 @@ class Table(object):
     #    return json.dumps(self.serialize(), sort_keys=True)
 
     def match_filter(self, channels=None, not_filter=None, **filter):
+        """compares the raw values of the columns. filters of the api channel
+        are compared with the values like they are sent to the api
+        """
         channels = channels_to_set(channels)
-        match = lambda key, v: str(getattr(self, key)) == str(v)
+        if 'api' in channels:
+            match = lambda key, v: str(getattr(self.__class__, key).get_value(self)) == str(v)
+        else:
+            match = lambda key, v: str(getattr(self, key)) == str(v)
         for k, v in filter.iteritems():
             col = getattr(self.__class__, k)
             if channels and not (channels & col.channels):
@@ -472,7 +640,12 @@ class Table(object):
         if self._table_deleted:
             return
         self._table_deleted = True
-        del all_tables[self._uuid]
+        self._table_remove_from_dict()
+
+        # withdraw our contributions to aggregates of other tables
+        for data in self._table_data.values():
+            if data.aggregated is not None:
+                transaction.update_aggregate(data)
         
         # tell listeners that we are dead
         transaction.set_delete(self)
@@ -508,6 +681,8 @@ class Table(object):
     def _table_add_to_dict(self):
         """internal"""
         all_tables[self._uuid] = self
+        for key, col in self._table_layout.indexed:
+            col.index_add(self, self._table_data[key].value)
 
     def _table_remove_from_dict(self):
         """internal"""
@@ -515,9 +690,32 @@ class Table(object):
             del all_tables[self._uuid]
         except KeyError:
             pass
-
-
-def filter_objects_callback(objects, filter, func):
-    for obj in objects:
-        if obj.match_filter('api', **filter):
-            func(obj)
+        for key, col in self._table_layout.indexed:
+            col.index_remove(self, self._table_data[key].value)
+
+
+def _plan(table, filter):
+    """returns the candidates of the most selective index of the filter or None"""
+    best = None
+    for key, value in filter.iteritems():
+        col = getattr(table, key, None)
+        if not isinstance(col, Column) or col.index is None or 'api' not in col.channels:
+            continue
+        candidates = col.lookup(value)
+        if best is None or len(candidates) < len(best):
+            best = candidates
+    return best
+
+def select(objects, filter, table=None):
+    """returns the objects matching the api filter in the order of objects.
+    when table is the class of the objects and the filter contains an indexed
+    column, only the objects in the index are checked with match_filter.
+    """
+    candidates = _plan(table, filter) if table is not None and filter else None
+    if candidates is not None:
+        objects = ifilter(candidates.__contains__, objects)
+    return [obj for obj in objects if obj.match_filter('api', **filter)]
+
+def filter_objects_callback(objects, filter, func, table=None):
+    for obj in select(objects, filter, table):
+        func(obj)
@@ -99,7 +99,14 @@ class TransactionManager(list):
             if table._table_created_event:
                 event.fire('{}:created'.format(table._table_name), table)
 
+        # all columns of new tables are dirty
+        for table in data.new:
+            for col in table._table_data.values():
+                col.column.on_changed(table, None)
+
         for t in data.dirty:
+            if t.column.table in data.new:
+                continue
             t.column.column.on_changed(t.column.table, t.old)
 
         for table in data.delete:
@@ -109,16 +116,30 @@ class TransactionManager(list):
         for listener in self:
             result = dict()
 
+            for table in data.new:
+                if not (listener.channels & table._table_channels):
+                    continue
+                values = {
+                    'table': table._table_name,
+                    'id': table.id,
+                    'action': 'new'}
+                for col in table._table_data.itervalues():
+                    if listener.channels & col.column.channels:
+                        values[col.column.name] = col.column.get_value(table)
+                result[table._uuid] = values
+
             for t in data.dirty:
                 col = t.column
                 if not (listener.channels & col.column.channels):
                     continue
+                if col.table in data.new:
+                    continue
                 uid = col.table._uuid
                 if uid not in result:
                     result[uid] = {
                         'table': col.table._table_name,
                         'id': col.table.id,
-                        'action': col.table in data.new and 'new' or 'update'}
+                        'action': 'update'}
                 result[uid][col.column.name] = col.column.get_value(col.table)
 
             for table in data.delete:
@@ -193,6 +214,25 @@ class Transaction(object):
                 t.column.column.set_value(t.column.table, t.old, _set_dirty=False)
                 t.column.refresh_cache = True
 
+        # bring the aggregates in line with the restored values
+        for table in data.new:
+            for column in table._table_data.values():
+                self._restore_aggregate(column)
+        for table in data.delete:
+            for column in table._table_data.values():
+                self._restore_aggregate(column)
+        for t in data.dirty:
+            t.column.refresh_cache = True
+            self._restore_aggregate(t.column)
+
+    def _restore_aggregate(self, column):
+        """updates the aggregates of column without marking them dirty"""
+        if column.column.aggregate is None:
+            return
+        for col in column.column.update_aggregate(column):
+            col.refresh_cache = True
+            self._restore_aggregate(col)
+
     def __enter__(self):
         self.acquire()
 
@@ -238,9 +278,13 @@ class Transaction(object):
         if column.table in data.delete:
             raise TransactionError('set on a deleted table: {}'.format(column.table))
         s = hash(column)
-        if s not in data.dirty:
+        if column.table in data.new:
+            pass # all columns of new tables are dirty
+        elif s not in data.dirty:
             data.dirty.append(TransactionColumn(column))
         column.refresh_cache = True
+        if column.column.aggregate is not None:
+            self._update_aggregate(data, column)
         for key in column.column.change_affects:
             if isinstance(key, basestring):
                 col = column.table._table_data[key]
@@ -251,6 +295,15 @@ class Transaction(object):
                 col = t._table_data[key[1]]
             self._set_dirty(data, col)
 
+    def update_aggregate(self, column):
+        """pushes the contribution of column to its aggregate and marks the aggregate dirty"""
+        data = self.get_chain()[-1]
+        self._update_aggregate(data, column)
+
+    def _update_aggregate(self, data, column):
+        for col in column.column.update_aggregate(column):
+            self._set_dirty(data, col)
+
     def set_new(self, table):
         data = self.get_chain()[-1]
         self._set_new(table, data)
@@ -15,13 +15,27 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
 import os
+import io
 import sys
+import mmap
 import traceback
-import io
 
 from gevent.lock import Semaphore
 from gevent.threadpool import ThreadPool
 
+from .config import globalconfig
+
+config = globalconfig.new('seekingfile')
+config.default('backend', 'buffered', str, enum="buffered positional mmap".split())
+config.default('preallocate', 'fallocate', str, enum="sparse fallocate".split())
+config.default('mmap_min_size', 256*1024*1024, int)
+config.default('threaded', False, bool)
+config.default('threads', 4, int)
+
+pwrite = None
+pread = None
+buffer_address = None
+
 try:
     import win32api
     import win32file
@@ -58,12 +72,79 @@ except ImportError:
         except OSError:
             traceback.print_exc()
             return
-            
+
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except (ImportError, OSError):
+        libc = None
+
+    def _libc_func(names, restype, argtypes):
+        for name in names:
+            func = libc is not None and getattr(libc, name, None)
+            if func:
+                func.restype = restype
+                func.argtypes = argtypes
+                return func
+
+    def _raise_errno():
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+    _as_read_buffer = libc is not None and getattr(ctypes.pythonapi, 'PyObject_AsReadBuffer', None)
+    if _as_read_buffer:
+        _as_read_buffer.argtypes = [ctypes.py_object, ctypes.POINTER(ctypes.c_void_p), ctypes.POINTER(ctypes.c_ssize_t)]
+
+        def buffer_address(data):
+            """returns the address and size of a str, buffer or bytearray without copying it"""
+            address, size = ctypes.c_void_p(), ctypes.c_ssize_t()
+            if _as_read_buffer(data, ctypes.byref(address), ctypes.byref(size)) != 0:
+                raise TypeError('expected a buffer object, got {}'.format(type(data)))
+            return address, size.value
+
+    if hasattr(os, 'pwrite'):
+        pwrite = os.pwrite
+        pread = os.pread
+    else:
+        _pwrite = _libc_func(('pwrite64', 'pwrite'), ctypes.c_ssize_t,
+                             [ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int64])
+        _pread = _libc_func(('pread64', 'pread'), ctypes.c_ssize_t,
+                            [ctypes.c_int, ctypes.c_char_p, ctypes.c_size_t, ctypes.c_int64])
+        if _pwrite and _pread and buffer_address:
+            def pwrite(fd, data, pos):
+                address, size = buffer_address(data)
+                written = _pwrite(fd, address, size, pos)
+                if written < 0:
+                    _raise_errno()
+                return written
+
+            def pread(fd, size, pos):
+                buf = ctypes.create_string_buffer(size)
+                read = _pread(fd, buf, size, pos)
+                if read < 0:
+                    _raise_errno()
+                return buf.raw[:read]
+
+    # linux fallocate() fails on filesystems without support instead of writing zeros like posix_fallocate()
+    _fallocate = _libc_func(('fallocate64', 'fallocate'), ctypes.c_int,
+                            [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64])
+
+    def fallocate(fd, size):
+        """reserves the blocks of the file. returns False when this is not supported"""
+        if _fallocate:
+            return _fallocate(fd, 0, 0, size) == 0
+        return False
+
     def allocate_file(path, size):
         f = os.open(path, os.O_CREAT | os.O_RDWR)
-        os.lseek(f, size - 1, os.SEEK_SET)
-        os.write(f, b'\x00')
-        os.close(f)
+        try:
+            if config.preallocate == 'fallocate' and fallocate(f, size):
+                return
+            os.lseek(f, size - 1, os.SEEK_SET)
+            os.write(f, b'\x00')
+        finally:
+            os.close(f)
 
 def check_space(path, size):
     free = get_free_space(path)
@@ -75,15 +156,111 @@ def check_space(path, size):
 
 open_lock = Semaphore()
 allocate_pool = ThreadPool(1)
+io_pool = None
+
+def get_io_pool():
+    global io_pool
+    if io_pool is None:
+        io_pool = ThreadPool(config.threads)
+    return io_pool
+
+
+########################## backends
+
+class BufferedBackend(object):
+    """one buffered handle for all chunks, seeks when the position changes"""
+    threadsafe = False
+
+    def __init__(self, fd, size):
+        self.f = io.BufferedRandom(io.FileIO(fd, "w+"), 4*1024*1024)
+        self.pos = 0
+
+    def write(self, data, pos):
+        if self.pos != pos:
+            self.f.seek(pos)
+        self.f.write(data)
+        self.pos = pos + len(data)
+
+    def read(self, bytes, pos):
+        if self.pos != pos:
+            self.f.seek(pos)
+        data = self.f.read(bytes)
+        self.pos = pos + len(data)
+        return data
+
+    def close(self):
+        self.f.flush()
+        self.f.close()
+
+
+class PositionalBackend(object):
+    """unbuffered positional writes (pwrite), the chunks share no file position"""
+    threadsafe = True
+
+    def __init__(self, fd, size):
+        self.fd = fd
+
+    def write(self, data, pos):
+        while data:
+            written = pwrite(self.fd, data, pos)
+            data = data[written:]
+            pos += written
+
+    def read(self, bytes, pos):
+        return pread(self.fd, bytes, pos)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class MmapBackend(PositionalBackend):
+    """maps the whole file into memory. writes beyond the mapped size use pwrite"""
+    def __init__(self, fd, size):
+        PositionalBackend.__init__(self, fd, size)
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+        self.size = size
+        self.map = mmap.mmap(fd, size)
+        self.address = ctypes.addressof(ctypes.c_char.from_buffer(self.map))
+
+    def write(self, data, pos):
+        end = pos + len(data)
+        if end > self.size:
+            return PositionalBackend.write(self, data, pos)
+        address, size = buffer_address(data)
+        ctypes.memmove(self.address + pos, address, size)
+
+    def read(self, bytes, pos):
+        if pos + bytes > self.size:
+            return PositionalBackend.read(self, bytes, pos)
+        return self.map[pos:pos + bytes]
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        PositionalBackend.close(self)
+
+backends = dict(buffered=BufferedBackend, positional=PositionalBackend, mmap=MmapBackend)
+
+def get_backend(name, size):
+    if pwrite is None:
+        return BufferedBackend
+    if name == 'mmap' and not size:
+        return PositionalBackend
+    return backends[name]
+
 
 class SeekingFile(object):
-    def __init__(self, filepath, size=None):
+    def __init__(self, filepath, size=None, backend=None, threaded=None):
         self.filepath = filepath
         self.size = size
+        self.backend = backend
+        self.threaded = threaded
 
         self.lock = Semaphore()
+        self.write_lock = Semaphore()
         self.refcount = 0
-        self.pos = 0
+        self.pool = None
         self.f = None
 
     def __del__(self):
@@ -93,16 +270,21 @@ class SeekingFile(object):
     def write(self, data, pos):
         if not self.f:
             raise IOError("not opened")
-        if self.pos != pos:
-            self.f.seek(pos)
-        self.f.write(data)
+        if self.pool is None:
+            self.f.write(data, pos)
+        elif self.f.threadsafe:
+            self.pool.apply(self.f.write, (data, pos))
+        else:
+            with self.write_lock:
+                self.pool.apply(self.f.write, (data, pos))
 
     def read(self, bytes, pos):
         if not self.f:
             raise IOError("not opened")
-        if self.pos != pos:
-            self.f.seek(pos)
-        self.f.read(bytes)
+        if self.pool is None:
+            return self.f.read(bytes, pos)
+        with self.write_lock:
+            return self.pool.apply(self.f.read, (bytes, pos))
 
     def open(self):
         with open_lock, self.lock:
@@ -116,8 +298,23 @@ class SeekingFile(object):
                     flags |= os.O_BINARY | os.O_RANDOM
                 if hasattr(os, 'O_NOATIME'):
                     flags |= os.O_NOATIME
-                raw = io.FileIO(os.open(self.filepath, flags), "w+")
-                self.f = io.BufferedRandom(raw, 4*1024*1024)
+                fd = os.open(self.filepath, flags)
+                name = self.backend
+                if name is None:
+                    name = config.backend
+                    if name == 'mmap' and (self.size or 0) < config.mmap_min_size:
+                        name = 'positional'
+                backend = get_backend(name, self.size)
+                try:
+                    self.f = backend(fd, self.size)
+                except (EnvironmentError, OverflowError, ValueError):
+                    # mmap fails for files that do not fit into the address space
+                    if backend is not MmapBackend:
+                        os.close(fd)
+                        raise
+                    self.f = PositionalBackend(fd, self.size)
+                threaded = config.threaded if self.threaded is None else self.threaded
+                self.pool = get_io_pool() if threaded else None
         self.refcount += 1
         return self
 
@@ -125,9 +322,11 @@ class SeekingFile(object):
         with self.lock:
             self.refcount -= 1
             if self.refcount <= 0 and self.f:
-                self.f.flush()
-                self.f.close()
-                self.f = None
+                f, self.f = self.f, None
+                if self.pool is not None:
+                    self.pool.apply(f.close)
+                else:
+                    f.close()
 
     def __enter__(self):
         return self.open()
@@ -40,6 +40,7 @@ else:
 
 app_uuid_file = os.path.join(data_dir, '.app.uuid')
 next_uid_file = os.path.join(data_dir, '.next.id')    # when integer no file is used. useful for debug
+check_aggregates = False    # compare incrementally maintained aggregates with a full recomputation. useful for debug
 
 db_file = os.path.join(data_dir, 'dlam.db')
 config_file = os.path.join(data_dir, 'config.json')
@@ -57,6 +58,8 @@ torrent_dht_state_file = os.path.join(data_dir, 'torrent-dht.state')
 
 external_plugins = os.path.join(data_dir, "extern")
 
+check_cache_misses_file = os.path.join(data_dir, 'check-cache-misses.bloom')
+
 
 frontend_domain = "www.download.am"
 patchserver = "http://repo.download.am"
@@ -14,11 +14,10 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
+import math
 import time
-import gevent
 
-from collections import deque
-from gevent.coros import Semaphore
+from array import array
 
 from .config import globalconfig
 
@@ -26,64 +25,141 @@ config = globalconfig.new("speed")
 config.default("default_precision", 0.5, float)
 config.default("default_interval", 10, int)
 config.default("default_track", 60, int)
- 
+
+
 class SpeedRegister(object):
-    def __init__(self, minimal_precision=None, max_track=None):
+    """registers transferred bytes in a ring buffer with one bucket per
+    `minimal_precision` seconds. the bytes of the last `interval` seconds are
+    kept as a running sum, so register() and get_bytes() are O(1).
+
+    registered bytes are also added to the `parent` register, so aggregated
+    speeds (file -> package -> global) do not have to be summed up. reset()
+    and set_parent() remove the tracked bytes from the former parents again.
+
+    `clock` returns the current time, it defaults to time.time.
+    """
+    def __init__(self, minimal_precision=None, max_track=None, interval=None, parent=None, clock=None):
         if minimal_precision is None:
             minimal_precision = config.default_precision
         if max_track is None:
             max_track = config.default_track
+        if interval is None:
+            interval = config.default_interval
         self.min_prec = minimal_precision
         self.max_track = max_track
-        self.registred = deque()
-        self.lock = Semaphore(1)
-    
+        self.interval = interval
+        self.parent = parent
+        self.clock = clock or _time
+        self.window = max(1, int(math.ceil(interval/minimal_precision)))
+        self.size = max(self.window, int(math.ceil(max_track/minimal_precision))) + 1
+        self._clear()
+
     def reset(self):
-        self.registred = deque()
+        """drops the tracked bytes, also from the parents"""
+        for register in self._parents():
+            self._apply(register, -1)
+        self._clear()
+
+    def set_parent(self, parent):
+        """moves the tracked bytes from the old to the new parents"""
+        old = self._parents()
+        self.parent = parent
+        new = self._parents()
+        for register in old:
+            if register not in new:
+                self._apply(register, -1)
+        for register in new:
+            if register not in old:
+                self._apply(register, 1)
 
-    def register(self, bytes):
-        with self.lock:
-            now = time.time()
-            if self.registred and (now - self.registred[-1][0]) < self.min_prec:
-                self.registred[-1][1] += bytes
-            else:
-                self.registred.append([now, bytes])
-        self._cleanup()
+    def _parents(self):
+        result = []
+        register = self.parent
+        while register is not None:
+            result.append(register)
+            register = register.parent
+        return result
+
+    def _apply(self, register, sign):
+        """adds (sign 1) or subtracts (sign -1) the tracked bytes to the buckets of register"""
+        if self.head is None or register.min_prec != self.min_prec:
+            return
+        if sign < 0 and register.head is None:
+            return
+        slot = int(self.clock()/self.min_prec)
+        self._advance(slot)
+        register._advance(slot)
+        if self.head != slot or register.head != slot:
+            return  # registered in the future
+        for i in xrange(min(self.size, register.size)):
+            bytes = self.buckets[(slot - i) % self.size]
+            if bytes:
+                register.buckets[(slot - i) % register.size] += sign*bytes
+                if i < register.window:
+                    register.sum += sign*bytes
+        if sign > 0 and self.first is not None:
+            if register.first is None or self.first < register.first:
+                register.first = self.first
+            register.last = max(register.last, self.last)
+
+    def _clear(self):
+        self.buckets = array('d', [0.0])*self.size
+        self.head = None    # slot number of the newest bucket
+        self.sum = 0        # bytes of the last `window` buckets
+        self.first = None   # first registration inside the window
+        self.last = None    # last registration
+
+    def _advance(self, slot):
+        """moves the head to slot and drops the buckets that left the ring"""
+        head = self.head
+        if head is None or slot - head >= self.size:
+            if head is not None:
+                self.buckets = array('d', [0.0])*self.size
+            self.sum = 0
+            self.first = None
+        elif slot > head:
+            buckets, size, window = self.buckets, self.size, self.window
+            for s in xrange(head + 1, slot + 1):
+                self.sum -= buckets[(s - window) % size]
+                buckets[s % size] = 0.0
+            if slot - head >= window:
+                self.sum = 0
+                self.first = None
+        else:
+            return
+        self.head = slot
+
+    def register(self, bytes, now=None):
+        if now is None:
+            now = self.clock()
+        slot = int(now/self.min_prec)
+        self._advance(slot)
+        self.buckets[slot % self.size] += bytes
+        self.sum += bytes
+        if self.first is None:
+            self.first = now
+        self.last = now
+        if self.parent is not None:
+            self.parent.register(bytes, now)
 
     def get_bytes(self, interval=None):
-        """return how much bytes were registred in the last `interval` seconds"""
-        if interval is None:
-            interval = config.default_interval
-        stoptime = time.time() - interval
-        mintime = 0
-        bytes = 0
-        for t, byte in reversed(self.registred):
-            if t < stoptime:
-                break
-            else:
-                mintime = t
-                bytes += byte
-        maxtime = self.registred and self.registred[-1][0] or 0
-        return bytes/(maxtime - mintime + 1)
-
-    def _cleanup(self):
-        with self.lock:
-            now = time.time()
-            to_pop = 0
-            for t, _ in self.registred:
-                if now - t > self.max_track:
-                    to_pop += 1
-                else:
-                    break
-            for i in xrange(to_pop):
-                self.registred.popleft()
- 
-    def _run_cleanup(self):
-        while 1:
-            gevent.sleep(self.max_track)
-            self._cleanup()
- 
-    def start_cleanup(self):
-        gevent.spawn(self._run_cleanup)
+        """return how much bytes per second were registred in the last `interval` seconds"""
+        if self.head is None:
+            return 0
+        self._advance(int(self.clock()/self.min_prec))
+        if interval is None or interval == self.interval:
+            bytes = self.sum
+            interval = self.interval
+        else:
+            n = min(self.size, max(1, int(math.ceil(interval/self.min_prec))))
+            bytes = sum(self.buckets[(self.head - i) % self.size] for i in xrange(n))
+        if not bytes:
+            return 0
+        span = min(interval, self.last - self.first) if self.first is not None else interval
+        return bytes/(span + 1)
+
+def _time():
+    # looked up on every call, patches of time.time apply to existing registers
+    return time.time()
 
 globalspeed = SpeedRegister()
@@ -18,8 +18,11 @@ import os
 import time
 import gevent
 import urllib
+import operator
 import libtorrent as lt
 
+from itertools import compress, count, imap
+
 from gevent.lock import Semaphore
 from gevent.pool import Group
 
@@ -427,6 +430,8 @@ def on_file_enabled_changed(e, file, old):
         return
     i = int(file.split_url.fragment)
     torrents[file.package.id].handle.file_priority(i, file.enabled and 1 or 0)
+    torrents[file.package.id].update_incomplete(file)
+    torrents[file.package.id].invalidate_file_progress()
     if file.enabled and not file.working:
         if file.state == 'download':
             with transaction:
@@ -440,6 +445,16 @@ def on_file_deleted(e, file):
         return
     i = int(file.split_url.fragment)
     torrents[file.package.id].handle.file_priority(i, 0)
+    torrents[file.package.id].incomplete.discard(i)
+
+@event.register('file.state:changed')
+def on_file_state_changed(e, file, old):
+    if file.package.system != 'torrent':
+        return
+    if file.package.id not in torrents:
+        return
+    torrents[file.package.id].update_incomplete(file)
+    torrents[file.package.id].invalidate_file_progress()
 
 
 """@event.register('package.name:changed')
@@ -554,10 +569,14 @@ class TorrentJob(Torrent):
         self.last_resume_data_save = 0
         
         self.file_objects = dict()
+        self.last_file_bytes = None
+        self.revisit_files = set()
+        self.incomplete = set()     # indexes of the enabled files that are not downloaded yet
         for f in package.files:
             f._state_download_incomplete = True
             f.progress_initialized = False
             self.file_objects[int(f.split_url.fragment)] = f
+            self.update_incomplete(f)
 
         # inject new torrent columns
         if not isinstance(package, TorrentPackage):
@@ -660,6 +679,7 @@ class TorrentJob(Torrent):
 
     def on_state_changed(self):
         #print "!"*100, 'CURRENT_STATE', self.state
+        self.invalidate_file_progress()
         if self.state in ('check', 'download'):
             with transaction:
                 for file in self.file_objects.values():
@@ -708,15 +728,37 @@ class TorrentJob(Torrent):
             if state in ('check', 'download'):
                 self.update_file_progress()
 
+    def invalidate_file_progress(self):
+        """lets the next progress update check all files"""
+        self.last_file_bytes = None
+
+    def update_incomplete(self, file):
+        """updates the incomplete set after the state or the enabled flag of a file changed"""
+        i = int(file.split_url.fragment)
+        if file.enabled and file.state == 'download' and file._state_download_incomplete:
+            self.incomplete.add(i)
+        else:
+            self.incomplete.discard(i)
+
     def update_file_progress(self):
         ##print "update file progress"
-        n = 0
         with transaction:
-            file_progress = self.file_progress
-            if file_progress is None:
+            file_bytes = self.file_bytes
+            if file_bytes is None:
                 return
+            sizes = self.file_sizes
+
+            # only the files with changed bytes and the files with a speed are updated
+            last = self.last_file_bytes
+            if self.state == 'check' or last is None or len(last) != len(file_bytes):
+                indexes = xrange(len(file_bytes))
+            else:
+                indexes = set(compress(count(), imap(operator.ne, file_bytes, last)))
+                indexes.update(self.revisit_files)
+            self.last_file_bytes = file_bytes
+            self.revisit_files = set()
 
-            for i in xrange(len(file_progress)):
+            for i in indexes:
                 try:
                     file = self.file_objects[i]
                 except KeyError:
@@ -729,8 +771,8 @@ class TorrentJob(Torrent):
                 if file.state != 'download':
                     continue
 
-                progress = file_progress[i]*file.size
-                n += 1
+                # divide first, bytes/size*size is exact for complete files
+                progress = file_bytes[i]/sizes[i]*file.size
 
                 if self.state == 'check' or not file.progress_initialized or file.progress is None or file._max_progress is None:
                     file.init_progress(file.get_any_size() or 0) # TODO: any size should never be none here
@@ -746,6 +788,8 @@ class TorrentJob(Torrent):
                         file.register_speed(0)
                         file.set_column_dirty('speed')
                         file._last_speed = file._speed.get_bytes() > 0 and True or False
+                    if file._last_speed:
+                        self.revisit_files.add(i)
 
                 #if file.progress == file.get_any_size() and self.state in ('download', 'seed', 'finish'):
                 if file.progress == file.get_any_size() and self.state in ('download', 'seed'):
@@ -753,9 +797,10 @@ class TorrentJob(Torrent):
                     file._state_download_incomplete = False
                     if file.greenlet:
                         file.greenlet.kill()
-                    n -= 1
-            
-        if n == 0:
+                    self.revisit_files.discard(i)
+                    self.incomplete.discard(i)
+
+        if not self.incomplete:
             #if self.state not in ('seed', 'finish'):
             if self.state not in ('seed',):
                 self.state = 'finish'
@@ -919,3 +964,9 @@ class Interface(interface.Interface):
 
     def get_pieces(id=None):
         return torrents[id].pieces
+
+    def get_piece_map(id=None, version=None):
+        """returns the piece states packed with 2 bits per piece, run-length and
+        base64 encoded. with the version string of a previous result only the
+        xor to that map is returned (diff=True)"""
+        return torrents[id].piece_map(version)
@@ -17,14 +17,17 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 import os
 import gevent
 import chardet
+import operator
 import libtorrent as lt
 
+from array import array
+from itertools import izip_longest
 from urllib import unquote
 from gevent import Timeout
 from gevent.lock import RLock
 from gevent.event import Event, AsyncResult
 
-from . import logger
+from . import logger, piecemap
 from .config import globalconfig
 
 log = logger.get('torrentengine')
@@ -64,6 +67,11 @@ def utf8_encoded(s, encoding="utf8"):
         s = s.encode("utf8")
     return s
 
+def file_ratios(progress, sizes):
+    """divides the downloaded bytes by the file sizes. the division is exact,
+    so a complete file has a ratio of exactly 1.0"""
+    return map(operator.truediv, progress, sizes)
+
 def sanitize_filepath(filepath, folder=False):
     """
     Returns a sanitized filepath to pass to libotorrent rename_file().
@@ -458,6 +466,10 @@ class Torrent(object):
 
         self.alerts = dict()
 
+        self._files = None          # cached file table, paths change on rename
+        self._file_sizes = None     # divisors of the file progress, immutable
+        self._piece_maps = None
+
         self._id_event = Event()
         self.save_lock = RLock()
         self.edit_lock = RLock()
@@ -594,18 +606,32 @@ class Torrent(object):
 
     @property
     def files(self):
-        """Returns a list of files this torrent contains"""
-        if not self.has_metadata:
-            return []
-        ret = []
-        files = self.info.files()
-        for index, file in enumerate(files):
-            ret.append({
-                'index': index,
-                'path': file.path.decode("utf8").replace('\\', '/'),
-                'size': file.size,
-                'offset': file.offset})
-        return ret
+        """Returns a list of files this torrent contains. The list is cached
+        and must not be modified"""
+        if self._files is None:
+            if not self.has_metadata:
+                return []
+            ret = []
+            files = self.info.files()
+            for index, file in enumerate(files):
+                ret.append({
+                    'index': index,
+                    'path': file.path.decode("utf8").replace('\\', '/'),
+                    'size': file.size,
+                    'offset': file.offset})
+            self._files = ret
+        return self._files
+
+    def invalidate_files(self):
+        """the file paths have changed"""
+        self._files = None
+
+    @property
+    def file_sizes(self):
+        """the file sizes as floats, empty files have a size of 1"""
+        if self._file_sizes is None:
+            self._file_sizes = array('d', (f['size'] or 1 for f in self.files))
+        return self._file_sizes
 
     @property
     def peers(self):
@@ -638,61 +664,55 @@ class Torrent(object):
 
         return ret
 
+    @property
+    def file_bytes(self):
+        """Returns the downloaded bytes of every file"""
+        if not self.has_metadata:
+            return
+
+        return self.handle.file_progress()
+
     @property
     def file_progress(self):
         """Returns the file progress as a list of floats.. 0.0 -> 1.0"""
         if not self.has_metadata:
             return
 
-        file_progress = self.handle.file_progress()
-        ret = []
-        for i, f in enumerate(self.files):
-            try:
-                ret.append(float(file_progress[i]) / float(f["size"]))
-            except ZeroDivisionError:
-                ret.append(0.0)
-
-        return ret
+        return file_ratios(self.handle.file_progress(), self.file_sizes)
 
     @property
-    def pieces(self):
+    def piece_states(self):
+        """Returns a bytearray with the state of every piece: 0 missing,
+        1 available, 2 downloading, 3 completed"""
         if not self.has_metadata:
             return None
 
-        pieces = dict()
-        # First get the pieces availability.
-        availability = self.handle.piece_availability()
+        pieces = self.status.pieces
+        # the availability is empty when there is no piece picker (seeding)
+        availability = self.handle.piece_availability()[:len(pieces)]
+        states = bytearray(3 if have else (count > 0) for have, count in izip_longest(pieces, availability, fillvalue=0))
         # Pieces from connected peers
         for peer_info in self.handle.get_peer_info():
-            if peer_info.downloading_piece_index < 0:
-                # No piece index, then we're not downloading anything from
-                # this peer
-                continue
-            pieces[peer_info.downloading_piece_index] = 2
+            if 0 <= peer_info.downloading_piece_index < len(states):
+                states[peer_info.downloading_piece_index] = 2
+        return states
 
-        # Now, the rest of the pieces
-        for idx, piece in enumerate(self.status.pieces):
-            if idx in pieces:
-                # Piece beeing downloaded, handled above
-                continue
-            elif piece:
-                # Completed Piece
-                pieces[idx] = 3
-                continue
-            elif availability[idx] > 0:
-                # Piece not downloaded nor beeing downloaded but available
-                pieces[idx] = 1
-                continue
-            # If we reached here, it means the piece is missing, ie, there's
-            # no known peer with this piece, or this piece has not been asked
-            # for so far.
-            pieces[idx] = 0
+    @property
+    def pieces(self):
+        states = self.piece_states
+        if states is None:
+            return None
+        return list(states)
 
-        sorted_indexes = pieces.keys()
-        sorted_indexes.sort()
-        # Return only the piece states, no need for the piece index
-        # Keep the order
-        return [pieces[idx] for idx in sorted_indexes]
+    def piece_map(self, version=None):
+        """Returns the packed piece states. Clients sending the version of
+        their last map get the changes only (see piecemap)"""
+        states = self.piece_states
+        if states is None:
+            return None
+        if self._piece_maps is None:
+            self._piece_maps = piecemap.PieceMapHistory()
+        return self._piece_maps.get(states, version)
 
     def pause(self):
         self.auto_managed(False)
@@ -807,6 +827,7 @@ class Torrent(object):
             result = AsyncResult()
 
             def _on_file_renamed_alert(alert):
+                self.invalidate_files()
                 if alert.index in pending:
                     del pending[alert.index]
                 if not pending:
@@ -859,6 +880,7 @@ class Torrent(object):
                             result.get(timeout=1)
                             break
                         except Timeout:
+                            self.invalidate_files()
                             files = self.files
                             for index, filename in pending.items():
                                 if files[index]['path'] == filename:
@@ -871,6 +893,7 @@ class Torrent(object):
                                 raise
                     #print "!"*100, "rename done"
             finally:
+                self.invalidate_files()
                 self.unregister_alert('file_renamed_alert', _on_file_renamed_alert)
                 self.unregister_alert('file_rename_failed_alert', _on_file_rename_failed_alert)
 
@@ -0,0 +1,134 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+# compares hoster.find and hoster.collect_links with the former linear scan
+# over all plugins.
+# usage: python -m tests.benchmark_router [number of plugins] [size of the paste in KiB]
+
+import sys
+import time
+import random
+import bisect
+
+from tests import loader
+loader.init()
+
+from client.hoster import manager
+from client.plugintools import Url, Matcher, all_url_regex
+
+class Plugin(object):
+    multihoster = False
+
+    def __init__(self, name, patterns, priority=100):
+        self.name = name
+        self.patterns = patterns
+        self.priority = priority
+
+def old_find(url, ignore=None):
+    if ignore is None:
+        ignore = set()
+    _url = Url(url)
+    for p in manager.plugins:
+        plugin = p[2]
+        if not plugin.name in ignore and not plugin.multihoster:
+            for pattern in plugin.patterns:
+                if isinstance(pattern, Matcher):
+                    pmatch = pattern.match(_url)
+                else:
+                    pmatch = pattern.match(url)
+                if pmatch is not None:
+                    return plugin, pmatch
+
+def old_collect_links(text):
+    links = set([])
+    for m in all_url_regex.finditer(text):
+        links.add(m.group('url'))
+    for host in manager.plugins:
+        if host[2].name in {'rtmp', 'http', 'ftp'}:
+            continue
+        for p in host[2].patterns:
+            if not hasattr(p, 'get_regex'):
+                continue
+            r = p.get_regex(False)
+            if not r:
+                continue
+            for m in r.finditer(text):
+                link = m.group(1).split(' ', 1)[0]
+                if '://' in link:
+                    continue
+                links.add(u'http://'+link)
+    return links
+
+def setup(count):
+    del manager.plugins[:]
+    manager.router = None
+    for i in xrange(count):
+        if i % 10 == 0:
+            patterns = [Matcher('https?', r'~mirror{}-\d+\.net'.format(i), '/get/(?P<id>\w+)')]
+        else:
+            patterns = [Matcher('https?', '*.host{}.com'.format(i), '!/file/<id>')]
+        bisect.insort(manager.plugins, (100, 0, Plugin('host{}'.format(i), patterns)))
+    bisect.insort(manager.plugins, (200, 0, Plugin('http', [Matcher('https?')], 200)))
+
+def make_urls(count, n):
+    random.seed(1)
+    urls = []
+    for i in xrange(n):
+        j = random.randrange(count)
+        if j % 10 == 0:
+            urls.append('http://mirror{}-{}.net/get/{}'.format(j, i, i))
+        else:
+            urls.append('http://www.host{}.com/file/{}'.format(j, i))
+    return urls
+
+def make_paste(count, size):
+    random.seed(2)
+    words = 'lorem ipsum dolor sit amet consectetur adipiscing elit'.split()
+    lines = []
+    length = 0
+    while length < size:
+        j = random.randrange(count*5)
+        if j < count:
+            link = 'www.host{}.com/file/{}'.format(j, length)
+        else:
+            link = ' '.join(random.sample(words, 4))
+        lines.append(link)
+        length += len(link) + 1
+    return '\n'.join(lines)
+
+def measure(name, func, *args):
+    t = time.time()
+    result = func(*args)
+    print "{:>30}: {:.3f}s".format(name, time.time() - t)
+    return result
+
+def main(count=200, size=1024):
+    setup(count)
+    urls = make_urls(count, 5000)
+    paste = make_paste(count, size*1024)
+
+    old = measure('find (linear scan)', lambda: [old_find(url) for url in urls])
+    new = measure('find (router)', lambda: [manager.find(url) for url in urls])
+    assert [r[0] for r in old] == [r[0] for r in new]
+
+    old = measure('collect_links (linear scan)', old_collect_links, paste)
+    new = measure('collect_links (router)', manager.collect_links, paste)
+    print "{:>30}: {} links, {} differ".format('result', len(new), len(old ^ new))
+    assert old == new
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,62 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+# measures the creation rate and memory usage of core.File and core.Chunk rows.
+# usage: python -m tests.benchmark_scheme [number of files] [chunks per file]
+
+import gc
+import sys
+import time
+import resource
+
+from tests import loader
+loader.init()
+
+from client import core
+from client.scheme import transaction
+
+class Host(object):
+    name = 'benchmark'
+
+    def get_hostname(self, file):
+        return self.name
+
+def rss():
+    """maximum resident set size in MiB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+
+def main(files=20000, chunks=2):
+    gc.collect()
+    mem = rss()
+    t = time.time()
+    with transaction:
+        package = core.Package(name='benchmark')
+        for i in xrange(files):
+            file = core.File(package=package, name='file{}'.format(i), url='http://example.com/{}'.format(i), host=Host(), pmatch=1)
+            for j in xrange(chunks):
+                core.Chunk(file=file, begin=j*1000, end=(j + 1)*1000)
+        created = time.time()
+    committed = time.time()
+    rows = files*(1 + chunks)
+
+    print "{:>8} files, {} chunks per file".format(files, chunks)
+    print "{:>12.0f} rows/s created".format(rows/(created - t))
+    print "{:>12.0f} rows/s including commit".format(rows/(committed - t))
+    print "{:>12.0f} bytes per row".format((rss() - mem)*1024*1024/rows)
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,63 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# compares the write throughput of the seekingfile backends.
+# usage: python -m tests.benchmark_seekingfile [size in MiB] [block size in KiB]
+
+import os
+import sys
+import time
+import tempfile
+
+import gevent
+
+from client import seekingfile
+
+CHUNKS = [1, 2, 5, 10, 20]
+BACKENDS = ['buffered', 'positional', 'mmap']
+
+def write_chunk(f, data, begin, end):
+    for pos in xrange(begin, end, len(data)):
+        f.write(data[:end - pos], pos)
+        gevent.sleep(0)
+
+def run(path, size, block, chunks, backend, threaded):
+    data = os.urandom(block)
+    f = seekingfile.SeekingFile(path, size, backend=backend, threaded=threaded)
+    step = size//chunks
+    t = time.time()
+    with f:
+        greenlets = [gevent.spawn(write_chunk, f, data, i*step, size if i == chunks - 1 else (i + 1)*step)
+                     for i in xrange(chunks)]
+        gevent.joinall(greenlets, raise_error=True)
+    t = time.time() - t
+    os.unlink(path)
+    return size/t/1024/1024
+
+def main(size=256, block=64):
+    size *= 1024*1024
+    block *= 1024
+    path = os.path.join(tempfile.gettempdir(), 'benchmark_seekingfile.bin')
+
+    print "{:>12} {:>8}".format('backend', 'threaded') + "".join("{:>9}".format('{} ch'.format(c)) for c in CHUNKS)
+    for backend in BACKENDS:
+        for threaded in (False, True):
+            results = [run(path, size, block, chunks, backend, threaded) for chunks in CHUNKS]
+            print "{:>12} {:>8}".format(backend, threaded) + "".join("{:>9.1f}".format(r) for r in results)
+    print "(MiB/s)"
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
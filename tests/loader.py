@@ -60,6 +60,7 @@ def init():
     settings.next_uid_file = 0
     settings.config_file = None
     settings.log_file = None
+    settings.check_cache_misses_file = None
 
     settings.init()
     db.init()
@@ -0,0 +1,81 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+from . import loader
+loader.init()
+
+from client.account import models
+from client.account.manager import manager
+from client.scheme import transaction
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class Hoster(object):
+    name = 'ranking'
+    max_check_tasks = max_check_tasks_free = max_check_tasks_premium = 1
+    max_download_tasks = max_download_tasks_free = max_download_tasks_premium = 1
+    max_download_speed_free = max_download_speed_premium = None
+    has_captcha_free = has_captcha_premium = False
+    waiting_time_free = waiting_time_premium = None
+
+class Account(models.PremiumAccount):
+    hoster = Hoster
+
+    def boot(self, return_when_locked=False):
+        pass
+
+    def on_changed_next_try(self, old):
+        pass
+
+def test_ranking():
+    clock = Clock()
+    old_time = models.time.time
+    models.time.time = clock
+    pool = manager.get_pool('ranking', Account)
+    try:
+        a = pool.add(username='a')
+        b = pool.add(username='b')
+        assert [r[1] for r in pool.get_ranking()[1]] == [a, b]
+
+        # the hooked columns drop the cached ranking
+        with transaction:
+            b.premium = True
+        assert pool._ranking is None
+        assert [r[1] for r in pool.get_ranking()[1]] == [b, a]
+        with transaction:
+            b.enabled = False
+        assert pool.get_ranking() == ([a], [(a.weight, a)])
+        with transaction:
+            b.enabled = True
+            b.expires = 1100
+        assert [r[1] for r in pool.get_ranking()[1]] == [b, a]
+
+        # the ranking is recomputed when b expires
+        cached = pool._ranking
+        clock.now = 1099
+        assert pool.get_ranking() == cached[1:]
+        clock.now = 1100
+        assert [r[1] for r in pool.get_ranking()[1]] == [a, b]
+        assert pool._ranking is not cached
+    finally:
+        models.time.time = old_time
+        manager.remove_pool('ranking')
@@ -0,0 +1,158 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import gevent
+
+from . import loader
+loader.init()
+
+from client import core
+from client.core import functions
+from client.scheme import transaction
+
+class Pool(object):
+    def full(self):
+        return False
+
+class Host(object):
+    use_check_cache = True
+
+    def __init__(self, name):
+        self.name = name
+        self.check_pool = Pool()
+        self.download_pool = Pool()
+        self.accounts = []
+
+    def weight(self, file):
+        return 0
+
+    def normalize_url(self, url, pmatch):
+        return url
+
+    def get_account(self, kind, file):
+        self.accounts.append(file)
+
+def lock_free():
+    # core.lock is reentrant, probe it from another greenlet
+    def probe():
+        if not core.lock.acquire(blocking=False):
+            return False
+        core.lock.release()
+        return True
+    return gevent.spawn(probe).get()
+
+class TestAddLinks(object):
+    def setup(self):
+        self.host = Host('links')
+        self.progress = []
+        self.Progress = functions.Progress
+        def progress(*args, **kwargs):
+            p = self.Progress(*args, **kwargs)
+            self.progress.append(p)
+            return p
+        functions.Progress = progress
+        with transaction:
+            core.config.add_links_batch_size = 2
+
+    def teardown(self):
+        functions.Progress = self.Progress
+        with transaction:
+            core.config.add_links_batch_size = 500
+            for package in core.packages():
+                package.erase()
+
+    def link(self, i):
+        return dict(url='http://links/f{}'.format(i), name='f{}'.format(i), host=self.host, pmatch=True)
+
+    def files(self):
+        return [f for p in core.packages() for f in p.files]
+
+    def test_batches(self):
+        added = core.add_links([self.link(i) for i in range(5)], package_name='batches')
+        assert len(added) == 5
+        assert sorted(f.id for f in self.files()) == sorted(added)
+        assert len(list(core.packages())) == 1
+        assert len(self.progress) == 1
+        assert self.progress[0]._table_deleted
+        assert self.progress[0].max == self.progress[0].current == 5
+
+        # a single short batch needs no progress
+        core.add_links([self.link(5)], package_name='batches')
+        assert len(self.progress) == 1
+        assert len(list(core.packages())) == 1
+        assert len(self.files()) == 6
+
+    def test_generator(self):
+        free = []
+        def links():
+            for i in range(5):
+                free.append(lock_free())
+                yield self.link(i)
+        added = core.add_links(links(), package_name='generator')
+        assert len(added) == 5
+        assert len(self.files()) == 5
+        # the lock is released while the next batch is read
+        assert all(free)
+        assert self.progress[0]._table_deleted
+
+    def test_progress_on_error(self):
+        def links():
+            for i in range(3):
+                yield self.link(i)
+            raise ValueError('broken input')
+        try:
+            core.add_links(links(), package_name='error')
+        except ValueError:
+            pass
+        else:
+            assert False, 'add_links swallowed the error'
+        # the first batch is kept, the progress is gone
+        assert len(self.files()) == 2
+        assert len(self.progress) == 1
+        assert self.progress[0]._table_deleted
+        assert lock_free()
+
+    def test_url_index(self):
+        url = self.link(0)['url']
+        core.add_links([self.link(0)], package_name='index')
+        files = functions.find_files_by_url(url)
+        assert len(files) == 1
+        file = next(iter(files))
+
+        # a link that is still checked is skipped
+        core.add_links([self.link(0)], package_name='index')
+        assert functions.find_files_by_url(url) == set([file])
+
+        # a queued link is added again as disabled duplicate
+        with transaction:
+            file.state = 'download'
+        core.add_links([self.link(0)], package_name='index')
+        files = functions.find_files_by_url(url)
+        assert len(files) == 2
+        dupe = (files - set([file])).pop()
+        assert dupe.enabled is False
+        assert dupe.last_error == 'link already exists'
+
+        with transaction:
+            file.url = 'http://links/moved'
+        assert functions.find_files_by_url(url) == set([dupe])
+        assert functions.find_files_by_url('http://links/moved') == set([file])
+
+        file.delete()
+        dupe.delete()
+        assert not functions.find_files_by_url(url)
+        assert not functions.find_files_by_url('http://links/moved')
+        assert url not in functions.url_index
@@ -0,0 +1,63 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import tempfile
+
+from client import bloomfilter
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_bloomfilter():
+    f = bloomfilter.BloomFilter(1 << 16, 5)
+    for i in xrange(1000):
+        f.add(str(i))
+    assert all(str(i) in f for i in xrange(1000))
+    false = sum(1 for i in xrange(1000, 11000) if str(i) in f)
+    assert false < 100, false
+
+def test_expiring():
+    clock = Clock()
+    old_time = bloomfilter.time.time
+    bloomfilter.time.time = clock
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        f = bloomfilter.ExpiringBloomFilter(100, capacity=1000, bits=1 << 16, hashes=5)
+        f.add(u'a')
+        clock.now += 60
+        f.add('b')
+        assert 'a' in f and 'b' in f
+        clock.now += 60
+        assert 'a' not in f and 'b' in f
+
+        f.save(path)
+        g = bloomfilter.ExpiringBloomFilter(100, capacity=1000, bits=1 << 16, hashes=5)
+        assert g.load(path)
+        assert 'b' in g and 'a' not in g
+        assert not bloomfilter.ExpiringBloomFilter(100, bits=1 << 17).load(path)
+
+        clock.now += 200
+        assert g.load(path)
+        assert not len(g)
+    finally:
+        bloomfilter.time.time = old_time
+        os.unlink(path)
@@ -0,0 +1,119 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from client import cache
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_cached_dict():
+    clock = Clock()
+    old_time = cache.time.time
+    cache.time.time = clock
+    try:
+        wheel = cache.TimerWheel(1.0, 4, 2)
+        expired = []
+        d = cache.CachedDict(10, expired.append, wheel=wheel)
+        d['a'] = 1
+        d['b'] = 2
+        long = cache.CachedDict(100, expired.append, wheel=wheel)
+        long['c'] = 3
+
+        for i in xrange(8):
+            clock.now += 1
+            wheel.advance(clock.now)
+        assert d['a'] == 1 # touch
+
+        clock.now += 3
+        wheel.advance(clock.now)
+        assert 'b' not in d and 'a' in d
+        assert expired == [2]
+
+        clock.now += 7
+        wheel.advance(clock.now)
+        assert not d and expired == [2, 1]
+
+        # scheduled beyond the last level
+        clock.now += 80
+        wheel.advance(clock.now)
+        assert long['c'] == 3
+        clock.now += 100
+        wheel.advance(clock.now)
+        assert not long and expired == [2, 1, 3]
+        assert wheel.count == 0
+    finally:
+        cache.time.time = old_time
+
+def test_cascade():
+    clock = Clock()
+    old_time = cache.time.time
+    cache.time.time = clock
+    try:
+        wheel = cache.TimerWheel(1.0, 64, 3)
+        expired = []
+        for livetime in range(60, 200) + [600, 4100, 5000]:
+            d = cache.CachedDict(livetime, wheel=wheel, callback=expired.append)
+            d['key'] = clock.now + livetime
+        # keys moved down from the upper levels keep their deadline
+        while wheel.count:
+            clock.now += 1
+            wheel.advance(clock.now)
+            for deadline in expired:
+                assert deadline <= clock.now < deadline + 2
+            del expired[:]
+    finally:
+        cache.time.time = old_time
+
+def test_idle_wheel():
+    clock = Clock()
+    old_time = cache.time.time
+    cache.time.time = clock
+    try:
+        wheel = cache.TimerWheel(1.0, 64, 3)
+        clock.now += 4*24*3600
+        expired = []
+        d = cache.CachedDict(30, expired.append, wheel=wheel)
+        d['a'] = 1
+        assert not wheel.overflow
+        clock.now += 29
+        wheel.advance(clock.now)
+        assert not expired
+        clock.now += 2
+        wheel.advance(clock.now)
+        assert expired == [1]
+
+        # an empty wheel does not walk over the missed ticks
+        clock.now += 10**6
+        wheel.advance(clock.now)
+        assert wheel.current == int(clock.now)
+    finally:
+        cache.time.time = old_time
+
+def test_max_size():
+    d = cache.CachedDict(60, max_size=3)
+    for i in xrange(3):
+        d[i] = i
+    d[0]
+    d[3] = 3
+    assert sorted(d) == [0, 2, 3]
+    del d[2]
+    d[4] = 4
+    d[5] = 5
+    assert sorted(d) == [3, 4, 5]
@@ -0,0 +1,148 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+from . import loader
+loader.init()
+
+from client import core, check, api
+from client.bloomfilter import ExpiringBloomFilter
+from client.scheme import transaction
+
+class Pool(object):
+    def full(self):
+        return False
+
+class Host(object):
+    use_check_cache = True
+
+    def __init__(self, name):
+        self.name = name
+        self.check_pool = Pool()
+
+    def weight(self, file):
+        return 0
+
+def add_file(package, name, host):
+    return core.File(package=package, host=host, pmatch=True, url='http://{}/{}'.format(host.name, name), name=name)
+
+class TestCheckViaApi(object):
+    def setup(self):
+        self.host = Host('cache')
+        with transaction:
+            self.package = core.Package(name='check')
+            self.files = [add_file(self.package, 'f{}'.format(i), self.host) for i in range(3)]
+        self.keys = [f.hashed_url for f in self.files]
+        self.pages = []
+        self.cache_get = check.cache.get
+        self.cache_misses = check.cache_misses
+        self.connected = True
+        api.client.is_connected = lambda: self.connected
+        check.cache_misses = ExpiringBloomFilter(3600)
+        with transaction:
+            check.config.cache_page_size = 1
+
+    def teardown(self):
+        check.cache.get = self.cache_get
+        del api.client.is_connected
+        check.cache_misses = self.cache_misses
+        with transaction:
+            check.config.cache_page_size = 500
+            for package in core.packages():
+                package.erase()
+
+    def get(self, result):
+        def get(page):
+            self.pages.append(page)
+            return dict((key, value) for key, value in result.iteritems() if key in page)
+        check.cache.get = get
+
+    def test_misses(self):
+        # the backend answers None for unknown links and skips the others
+        self.get({self.keys[0]: None, self.keys[1]: None})
+        check._check_via_api()
+        assert len(self.pages) == 3
+        assert self.keys[0] in check.cache_misses
+        assert self.keys[1] in check.cache_misses
+        assert self.keys[2] not in check.cache_misses
+
+    def test_disconnected(self):
+        # cache.get answers nothing after the api disconnected
+        def get(page):
+            self.pages.append(page)
+            self.connected = False
+            return {}
+        check.cache.get = get
+        check._check_via_api()
+        assert len(self.pages) == 1
+        assert not any(key in check.cache_misses for key in self.keys)
+
+class TestReadyQueues(object):
+    def setup(self):
+        self.hosts = [Host('a'), Host('b')]
+        with transaction:
+            self.package = core.Package(name='queues')
+            self.files = [add_file(self.package, 'f{}'.format(i), self.hosts[i % 2]) for i in range(6)]
+
+    def teardown(self):
+        with transaction:
+            for package in core.packages():
+                package.erase()
+
+    def candidates(self, spawned=True):
+        result = []
+        candidates = check.iter_candidates()
+        try:
+            file = next(candidates)
+            while True:
+                result.append(file)
+                file = candidates.send(spawned)
+        except StopIteration:
+            return result
+
+    def test_fairness(self):
+        result = self.candidates()
+        assert sorted(result) == sorted(self.files)
+        # the hosts take turns
+        assert all(a.host is not b.host for a, b in zip(result, result[1:]))
+        assert [f for f in result if f.host is self.hosts[0]] == self.files[0::2]
+
+        # every round starts with the next host and rejected hosts are skipped
+        rejected = self.candidates(False)
+        assert len(rejected) == 2
+        assert rejected[0].host is not result[0].host
+
+    def test_full_pool(self):
+        self.hosts[0].check_pool.full = lambda: True
+        assert self.candidates() == self.files[1::2]
+
+    def test_remove(self):
+        with transaction:
+            self.files[0].state = 'collect'
+            self.files[1].enabled = False
+            self.files[2].last_error = 'error'
+        self.files[3].delete()
+        assert check.ready[self.hosts[0]].keys() == [self.files[4]]
+        assert check.ready[self.hosts[1]].keys() == [self.files[5]]
+
+        with transaction:
+            self.files[1].enabled = True
+        assert check.ready[self.hosts[1]].keys() == [self.files[5], self.files[1]]
+
+        with transaction:
+            self.files[4].host = self.hosts[1]
+        assert self.hosts[0] not in check.ready
+        assert self.files[4] in check.ready[self.hosts[1]]
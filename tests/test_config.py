@@ -0,0 +1,58 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from client import config
+from client.scheme import transaction
+
+cfg = config.globalconfig.new('test_config')
+cfg.default('value', 1, int)
+cfg.default('entries', list(), list)
+
+def test_handle():
+    value = cfg.handle('value')
+    assert value is cfg.handle('value')
+    assert value() == 1
+
+    with transaction:
+        cfg.value = '2'
+        assert value() == 2
+    assert value() == 2
+    cfg.value = 3
+    assert value() == 3 == cfg.value
+
+    entries = cfg.handle('entries')
+    with transaction:
+        cfg.entries.append(1)
+    assert entries() == [1]
+
+    try:
+        cfg.handle('missing')
+    except AttributeError:
+        pass
+    else:
+        assert False, 'handle of an undefined key'
+
+def test_read_counts():
+    value = cfg.handle('value')
+    config.set_profile(True)
+    try:
+        for i in xrange(3):
+            value()
+        cfg.value
+        assert config.read_counts['test_config.value'] == 4
+    finally:
+        config.set_profile(False)
+    assert not config.read_counts
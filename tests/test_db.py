@@ -0,0 +1,98 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import sqlite3
+
+from . import loader
+loader.init()
+
+from client import db
+from client.scheme import transaction
+
+def chunk(action, id, **values):
+    values.update(table='chunk', action=action, id=id)
+    return {'chunk{}'.format(id): values}
+
+def read(id):
+    with db.Cursor() as c:
+        return c.execute('SELECT * FROM chunk WHERE id=?', [id]).fetchone()
+
+def test_coalesce():
+    listener = db.BufferedSqlListener()
+    listener.on_commit(chunk('new', 1001, begin=0, end=100, pos=0, state=u'download'))
+    listener.on_commit(chunk('update', 1001, pos=50))
+    listener.on_commit(chunk('update', 1001, pos=60))
+    assert listener.updates == {('chunk', 1001): dict(id=1001, begin=0, end=100, pos=60, state=u'download')}
+    listener.flush()
+    assert listener.stats['last_rows'] == 1
+    row = read(1001)
+    assert row['pos'] == 60 and row['end'] == 100
+
+def test_delete_then_new():
+    listener = db.BufferedSqlListener()
+    listener.on_commit(chunk('new', 1002, begin=0, end=100, pos=0, state=u'download'))
+    listener.flush()
+    listener.on_commit(chunk('delete', 1002))
+    assert listener.deletes == set([('chunk', 1002)])
+    listener.on_commit(chunk('new', 1002, begin=5, end=10, pos=5, state=u'new'))
+    assert not listener.deletes
+    listener.flush()
+    row = read(1002)
+    assert row['begin'] == 5 and json.loads(row['state']) == u'new'
+
+    listener.on_commit(chunk('update', 1002, pos=7))
+    listener.on_commit(chunk('delete', 1002))
+    listener.flush()
+    assert read(1002) is None
+
+def test_flush_rows():
+    with transaction:
+        db.config.flush_rows = 3
+    try:
+        listener = db.BufferedSqlListener()
+        for id in (1003, 1004):
+            listener.on_commit(chunk('new', id, begin=0, end=1, pos=0, state=u'download'))
+        assert listener.greenlet is not None and len(listener.updates) == 2
+        listener.on_commit(chunk('new', 1005, begin=0, end=1, pos=0, state=u'download'))
+        assert not listener.updates and listener.greenlet is None
+        assert listener.stats['flushes'] == 1 and listener.stats['rows'] == 3
+    finally:
+        with transaction:
+            db.config.flush_rows = 1000
+
+def test_requeue():
+    listener = db.BufferedSqlListener()
+    listener.on_commit(chunk('new', 1006, begin=0, end=100, pos=0, state=u'download'))
+    write = listener.write
+
+    def failing_write(c, updates, deletes):
+        # a newer change arrives while the rows are written
+        listener.on_commit(chunk('update', 1006, pos=30))
+        raise sqlite3.OperationalError('disk I/O error')
+    listener.write = failing_write
+    try:
+        listener.flush()
+    except sqlite3.OperationalError:
+        pass
+    else:
+        assert False, 'error not raised'
+    assert listener.updates[('chunk', 1006)]['pos'] == 30
+    assert listener.updates[('chunk', 1006)]['end'] == 100
+
+    listener.write = write
+    listener.close()
+    assert read(1006)['pos'] == 30
@@ -0,0 +1,164 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import zlib
+import hashlib
+import tempfile
+
+from gevent.lock import Semaphore
+from gevent.threadpool import ThreadPool
+
+from . import loader
+loader.init()
+
+from client import fileplugin
+from client.download import engine
+from client.plugins.file import checksum
+from client.scheme import transaction
+
+KB = 1024
+
+class Log(object):
+    def debug(self, msg):
+        pass
+
+class Chunk(object):
+    def __init__(self, pos, end):
+        self.begin = self.pos = pos
+        self.end = end
+        self.state = 'download'
+        self.log = Log()
+        self.file = None
+
+def function(chunk, speed):
+    func = engine.DownloadFunction(None)
+    func.chunk = chunk
+    func.get_speed = lambda: speed
+    return func
+
+def set_config(**values):
+    with transaction:
+        for key, value in values.iteritems():
+            engine.config[key] = value
+
+def test_block_size():
+    set_config(blocksize=8*KB, max_blocksize=512*KB, rate_limit=0)
+    try:
+        assert function(None, 0).get_block_size() == 8*KB
+        assert function(None, 20*64*KB + 1).get_block_size() == 128*KB
+        assert function(None, 100*1024*KB).get_block_size() == 512*KB
+        # the rate limit allows about 10 reads per second
+        set_config(rate_limit=160*KB)
+        assert function(None, 100*1024*KB).get_block_size() == 16*KB
+    finally:
+        set_config(blocksize=8*KB, max_blocksize=512*KB, rate_limit=0)
+
+def test_steal_chunk():
+    min_size = engine.config.min_chunk_size
+    chunk = Chunk(0, 2*min_size + 600*KB)
+    slow = function(chunk, 10*KB)
+    # the slow connection is reading a large block
+    slow.pending = 512*KB
+    fast = function(Chunk(0, None), 10000*KB)
+
+    download = engine.FileDownload.__new__(engine.FileDownload)
+    download.file = None
+    download.functions = {chunk: slow, fast.chunk: fast}
+
+    Chunk_ = engine.core.Chunk
+    engine.core.Chunk = lambda file, begin, end: (begin, end)
+    try:
+        begin, end = download.steal_chunk()
+    finally:
+        engine.core.Chunk = Chunk_
+
+    # the block in flight stays with the slow connection
+    assert chunk.end == begin == 512*KB + min_size
+    assert end == 2*min_size + 600*KB
+
+    slow.last_read = slow.pending
+    assert 0 < slow.get_read_size() <= min_size
+
+def test_read_size_clamp():
+    func = function(Chunk(0, 100*KB), 0)
+    func.last_read = 200*KB
+    assert func.get_read_size() == 0
+
+class HashFile(object):
+    log = Log()
+    hasher = None
+    checksum_result = None
+    fatal_called = None
+
+    def __init__(self, path, size, hash_type, hash_value):
+        self.path = path
+        self.size = size
+        self.hash_type = hash_type
+        self.hash_value = hash_value
+
+    def get_complete_file(self):
+        return self.path
+
+    def fatal(self, msg):
+        self.fatal_called = msg
+
+def write_range(func, data, begin, end, bs=8*KB):
+    for pos in xrange(begin, end, bs):
+        func.update_hash(data[pos:min(pos + bs, end)], pos)
+
+def test_inline_checksum():
+    data = os.urandom(300*KB)
+    fd, path = tempfile.mkstemp()
+    try:
+        os.write(fd, data)
+        os.close(fd)
+
+        for hash_type, hash_value in [
+                ('crc32', '{:08x}'.format(zlib.crc32(data) & 0xffffffff)),
+                ('md5', hashlib.md5(data).hexdigest())]:
+            file = HashFile(path, len(data), hash_type, hash_value)
+            chunks = [Chunk(0, 100*KB), Chunk(100*KB, len(data))]
+            first, second = [function(chunk, 0) for chunk in chunks]
+            for chunk in chunks:
+                chunk.file = file
+
+            # both chunks are restarted after they wrote other data
+            first.update_hash('\xff'*50*KB, 0)
+            second.update_hash('\xff'*10*KB, 100*KB)
+            write_range(first, data, 0, 100*KB)
+            write_range(second, data, 100*KB, len(data))
+
+            download = engine.FileDownload.__new__(engine.FileDownload)
+            download.file = file
+            download.finalize_checksum(path)
+            assert file.hasher is None
+            assert file.checksum_result == (hash_type, hash_value, True)
+
+            checksum.process(fileplugin.FilePath(path), file, Semaphore(), ThreadPool(1))
+            assert file.fatal_called is None, hash_type
+
+            # an invalid inline result is checked again on the disk
+            file.checksum_result = hash_type, hash_value, False
+            checksum.process(fileplugin.FilePath(path), file, Semaphore(), ThreadPool(1))
+            assert file.fatal_called is None, hash_type
+
+            file.hash_value = '0'*len(hash_value)
+            file.checksum_result = hash_type, file.hash_value, False
+            checksum.process(fileplugin.FilePath(path), file, Semaphore(), ThreadPool(1))
+            assert file.fatal_called == 'file checksum invalid'
+    finally:
+        os.unlink(path)
@@ -21,6 +21,7 @@ loader.init()
 
 import os
 import gevent
+from contextlib import contextmanager
 from gevent.pool import Pool
 
 from client import event, core, fileplugin, debugtools, download, torrent
@@ -187,6 +188,141 @@ def test_fileplugin_rarextract():
 def test_fileplugin_zipextract():
     _test_file('test_fileplugin.zip', 'zipextract')
 
+
+class Plugin(object):
+    def __init__(self, name, priority):
+        self.name = name
+        self.priority = priority
+
+
+class Path(str):
+    st_size = 0
+
+
+checksum = Plugin('checksum', 50)
+extract = Plugin('zipextract', 100)
+tar = Plugin('tarextract', 100)
+
+
+@contextmanager
+def fake_devices():
+    """uses the first directory of a path as its device"""
+    get_device = fileplugin.get_device
+    fileplugin.get_device = lambda path: path.split('/')[1]
+    try:
+        yield
+    finally:
+        fileplugin.get_device = get_device
+
+
+def run(scheduler, plugin, path, target, log, size=0):
+    path = Path(path)
+    path.st_size = size
+    job = fileplugin.IOJob(scheduler, plugin, path)
+    with job(target):
+        log.append(('start', path))
+        gevent.sleep(0.01)
+        log.append(('stop', path))
+
+
+def test_devices():
+    with fake_devices():
+        scheduler = fileplugin.IOScheduler()
+        log = []
+        # the extractions on different disks run in parallel, the checksum on disk a waits
+        jobs = [
+            gevent.spawn(run, scheduler, extract, '/a/1.zip', '/a/out', log),
+            gevent.spawn(run, scheduler, tar, '/b/2.tar', '/c/out', log),
+            gevent.spawn(run, scheduler, checksum, '/a/3.bin', '/a', log)]
+        gevent.sleep(0)
+        assert scheduler.stats()['running'] == 2
+        assert scheduler.stats()['devices']['a'] == dict(running=1, queued=1)
+        gevent.joinall(jobs, raise_error=True)
+        assert log.index(('start', '/a/3.bin')) > log.index(('stop', '/a/1.zip'))
+        assert log.index(('start', '/b/2.tar')) < log.index(('stop', '/a/1.zip'))
+        stats = scheduler.stats()
+        assert stats['running'] == stats['queued'] == 0
+        assert stats['plugins']['tarextract']['jobs'] == 1
+        assert stats['plugins']['checksum']['wait_max'] > 0
+
+
+def test_priority():
+    with fake_devices():
+        scheduler = fileplugin.IOScheduler()
+        log = []
+        first = gevent.spawn(run, scheduler, extract, '/a/1.zip', '/a', log)
+        gevent.sleep(0)
+        jobs = [
+            gevent.spawn(run, scheduler, extract, '/a/big.zip', '/a', log, 1000),
+            gevent.spawn(run, scheduler, extract, '/a/small.zip', '/a', log, 10),
+            gevent.spawn(run, scheduler, checksum, '/a/file.bin', '/a', log, 5000)]
+        gevent.joinall([first] + jobs, raise_error=True)
+        started = [path for action, path in log if action == 'start']
+        assert started == ['/a/1.zip', '/a/file.bin', '/a/small.zip', '/a/big.zip']
+
+
+def test_plugin_slots():
+    with fake_devices():
+        scheduler = fileplugin.IOScheduler()
+        log = []
+        with transaction:
+            fileplugin.config.device_slots = 2
+        try:
+            jobs = [gevent.spawn(run, scheduler, extract, '/a/{}.zip'.format(i), '/a', log) for i in xrange(2)]
+            gevent.sleep(0)
+            # the zipextract plugin is limited to one job
+            assert scheduler.stats()['plugins']['zipextract']['queued'] == 1
+            gevent.joinall(jobs, raise_error=True)
+        finally:
+            with transaction:
+                fileplugin.config.device_slots = 1
+
+
+def test_cancel():
+    with fake_devices():
+        scheduler = fileplugin.IOScheduler()
+        log = []
+        first = gevent.spawn(run, scheduler, extract, '/a/1.zip', '/a', log)
+        waiting = gevent.spawn(run, scheduler, checksum, '/a/2.bin', '/a', log)
+        gevent.sleep(0)
+        assert scheduler.stats()['queued'] == 1
+        waiting.kill()
+        assert scheduler.stats()['queued'] == 0
+        first.kill()
+        assert scheduler.stats()['running'] == 0
+        assert not scheduler.devices and not scheduler.plugins
+
+
+def test_reacquire():
+    with fake_devices():
+        scheduler = fileplugin.IOScheduler()
+        active = []
+        overlaps = []
+
+        def run_members(path, members):
+            job = fileplugin.IOJob(scheduler, extract, Path(path))
+            for i in xrange(members):
+                with job('/a'):
+                    active.append(path)
+                    overlaps.append(len(active))
+                    gevent.sleep(0.001)
+                    active.remove(path)
+
+        jobs = [gevent.spawn(run_members, '/a/{}.zip'.format(i), 3) for i in xrange(3)]
+        gevent.joinall(jobs, raise_error=True)
+        # every member waited for the slot of the device
+        assert len(overlaps) == 9
+        assert max(overlaps) == 1
+        assert not scheduler.queue and not scheduler.devices and not scheduler.plugins
+
+
+def test_member_path():
+    assert fileplugin.member_path('/x', 'a/b.txt') == os.path.join('/x', 'a', 'b.txt')
+    assert fileplugin.member_path('/x', '../../etc/passwd') == os.path.join('/x', 'etc', 'passwd')
+    assert fileplugin.member_path('/x', '/abs/./file') == os.path.join('/x', 'abs', 'file')
+    assert fileplugin.member_path('/x', './') is None
+
+
 if __name__ == '__main__':
     test_rar_multipart()
     test_fileplugin_rarextract()
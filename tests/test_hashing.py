@@ -0,0 +1,95 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import zlib
+import hashlib
+import tempfile
+
+from client import hashing
+
+data = os.urandom(3*1024*1024 + 12345)
+ranges = [
+    [(0, len(data))],
+    [(0, 1000000), (1000000, 2000000), (2500000, len(data))],
+    [(5, 100), (1000, 2000000)],
+    []]
+
+def feed(hasher, parts, bs=8192):
+    for begin, end in parts:
+        for pos in xrange(begin, end, bs):
+            hasher.update(pos, data[pos:min(pos + bs, end)])
+
+def feed_garbage(hasher, begin, end, bs=8192):
+    for pos in xrange(begin, end, bs):
+        hasher.update(pos, '\xff'*(min(pos + bs, end) - pos))
+
+def check(hash_type, hash_value, path):
+    for parts in ranges:
+        hasher = hashing.RangeHasher(hash_type, hash_value, len(data))
+        feed(hasher, parts)
+        assert hasher.finalize(path), parts
+
+    # chunks that restart at their begin overwrite the hashed ranges
+    for garbage, parts in [
+            ((0, 500000), ranges[0]),
+            ((1000000, 1500000), ranges[1]),
+            ((900000, 1100000), ranges[1]),
+            ((1000, 1500000), ranges[2])]:
+        hasher = hashing.RangeHasher(hash_type, hash_value, len(data))
+        feed_garbage(hasher, *garbage)
+        feed(hasher, parts)
+        assert hasher.finalize(path), (garbage, parts)
+
+    # empty writes and writes beyond the file size are ignored
+    hasher = hashing.RangeHasher(hash_type, hash_value, len(data))
+    hasher.update(1000, '')
+    hasher.update(len(data) - 10, '\xff'*100)
+    feed(hasher, [(0, 5000)])
+    assert hasher.finalize(path)
+
+def test_crc32_combine():
+    a, b = data[:1000], data[1000:5000]
+    assert hashing.crc32_combine(zlib.crc32(a), zlib.crc32(b), len(b)) == zlib.crc32(a + b) & 0xffffffff
+
+def test_range_hasher():
+    fd, path = tempfile.mkstemp()
+    try:
+        os.write(fd, data)
+        os.close(fd)
+
+        check('crc32', '{:08x}'.format(zlib.crc32(data) & 0xffffffff), path)
+        check('md5', hashlib.md5(data).hexdigest(), path)
+
+        hasher = hashing.RangeHasher('md5', hashlib.md5('').hexdigest(), len(data))
+        feed(hasher, ranges[0])
+        assert not hasher.finalize(path)
+
+        # key with a aes key of (3, 4, 3, 4) and the meta mac of our data
+        key = hashing.crypto.a32_to_base64([3, 4, 3, 4, 0, 0, 0, 0])
+        mac = hashing.MegaCbcMac(key)
+        for start, size in hashing.crypto.get_chunks(len(data)):
+            mac.update(data[start:start + size])
+        file_mac = hashing.crypto.str_to_a32(mac.file_mac)
+        meta_mac = file_mac[0] ^ file_mac[1], file_mac[2] ^ file_mac[3]
+        key = hashing.crypto.a32_to_base64([3, 4, 3 ^ meta_mac[0], 4 ^ meta_mac[1], 0, 0, meta_mac[0], meta_mac[1]])
+        check('cbc_mac_mega', key, path)
+    finally:
+        os.unlink(path)
+
+if __name__ == '__main__':
+    test_crc32_combine()
+    test_range_hasher()
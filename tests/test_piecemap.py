@@ -0,0 +1,81 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import random
+
+from client import piecemap
+
+def naive_pack(states):
+    states = list(states) + [0]*(-len(states) % 4)
+    return bytes(bytearray(a << 6 | b << 4 | c << 2 | d for a, b, c, d in zip(*[iter(states)]*4)))
+
+def test_pack():
+    for count in (0, 1, 3, 4, 5, 7, 10001):
+        states = bytearray(random.randint(0, 3) for _ in xrange(count))
+        packed = piecemap.pack(states)
+        assert packed == naive_pack(states), count
+        assert piecemap.unpack(packed, count) == states
+        assert piecemap.decode(piecemap.encode(packed)) == packed
+
+def test_rle():
+    data = '\xff'*300 + '\x00' + '\x12'*2
+    encoded = piecemap.rle_encode(data)
+    assert encoded == '\xac\x02\xff\x01\x00\x02\x12'
+    assert piecemap.rle_decode(encoded) == data
+    try:
+        piecemap.rle_decode('\x05')
+    except ValueError:
+        pass
+    else:
+        assert False, 'truncated data decoded'
+
+def test_history():
+    history = piecemap.PieceMapHistory(keep=2)
+    states = bytearray([3])*90000 + bytearray(10000)
+    first = history.get(states)
+    assert first['version'] == history.epoch + '-1' and not first['diff']
+    assert len(first['data']) < 20
+
+    # the same map keeps its version
+    assert history.get(states)['version'] == first['version']
+
+    changed = bytearray(states)
+    changed[70000] = 3
+    changed[99999] = 2
+    diff = history.get(changed, first['version'])
+    assert diff['version'] == history.epoch + '-2' and diff['diff']
+    packed = piecemap.xor(piecemap.decode(first['data']), piecemap.decode(diff['data']))
+    assert piecemap.unpack(packed, diff['count']) == changed
+
+    # unknown and dropped versions get the whole map
+    history.get(bytearray(100000))
+    for version in (first['version'], 1, '12345', None):
+        result = history.get(bytearray(100000), version)
+        assert not result['diff']
+        assert piecemap.unpack(piecemap.decode(result['data']), result['count']) == bytearray(100000)
+
+def test_history_epoch():
+    # the versions of another history never match, even with the same counter
+    states = bytearray([3])*1000
+    history = piecemap.PieceMapHistory()
+    version = history.get(states)['version']
+    other = piecemap.PieceMapHistory()
+    other.get(bytearray(1000))
+    assert history.epoch != other.epoch
+    result = other.get(states, version)
+    assert not result['diff']
+    assert result['version'] != version
+    assert piecemap.unpack(piecemap.decode(result['data']), result['count']) == states
@@ -0,0 +1,97 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+
+from gevent.queue import Queue
+
+from . import loader
+loader.init()
+
+from client import interface
+from client.api import push, proto
+
+def file_update(action='update', **values):
+    values.update(action=action, table='file', id=1)
+    return values
+
+def test_split_volatile():
+    listener = push.ApiListener()
+    listener.last_volatile = time.time()
+    update = {
+        'file1': file_update(progress=10, speed=5),
+        'file2': file_update(progress=10, state='download'),
+        'file3': file_update('new', progress=0)}
+    update, deferred = listener.split_volatile(update)
+    assert sorted(update) == ['file2', 'file3']
+    assert sorted(deferred) == ['file1']
+
+    # after volatile_interval everything is sent
+    listener.last_volatile = 0
+    update, deferred = listener.split_volatile({'file1': file_update(progress=20)})
+    assert deferred is None and sorted(update) == ['file1']
+
+def test_defer_order():
+    listener = push.ApiListener()
+    # committed while the last push was sent
+    listener.update = {'file1': file_update(progress=20)}
+    listener.defer({'file1': file_update(progress=10, speed=5), 'file2': file_update(eta=3)})
+    assert listener.update['file1'] == file_update(progress=20, speed=5)
+    assert listener.update['file2'] == file_update(eta=3)
+
+    listener.update = {'file1': file_update('delete')}
+    listener.defer({'file1': file_update(progress=10)})
+    assert listener.update['file1'] == file_update('delete')
+
+def test_adapt_delay():
+    listener = push.ApiListener()
+    listener.adapt_delay(0.2, 0)
+    assert listener.delay == 0.2
+
+    # the local frontends did not send the last push yet
+    listener.adapt_delay(0.0, 3)
+    assert listener.delay == 0.4
+    for i in xrange(10):
+        listener.adapt_delay(0.0, 3)
+    assert listener.delay == push.config['max_interval']
+
+    # drained connections shrink the delay with the measured write time
+    for i in xrange(30):
+        listener.adapt_delay(0.0, 0)
+    assert listener.delay < 0.01
+    assert listener.metrics.get()['delay'] == listener.delay
+
+class Connection(object):
+    def __init__(self, queued):
+        self.socket = self
+        self.client_queue = Queue()
+        for i in xrange(queued):
+            self.client_queue.put(i)
+
+def test_backlog():
+    connections = [Connection(2), Connection(0), Connection(1)]
+    proto.connections.extend(connections)
+    try:
+        assert proto.get_backlog() == 3
+    finally:
+        for connection in connections:
+            proto.remove_connection(connection)
+    assert proto.get_backlog() == 0
+
+def test_metrics_interface():
+    metrics = interface.call('api', 'push_metrics')
+    assert metrics['pushes'] == push.listener.metrics.pushes
+    assert 'drain_time' in metrics
@@ -0,0 +1,101 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+
+from . import loader
+loader.init()
+
+from client.plugins.file import rarextract
+
+class Process(object):
+    returncode = 0
+    stdout = None
+
+    def wait(self):
+        return self.returncode
+
+class File(object):
+    def __init__(self):
+        self.progress = []
+
+    def init_progress(self, max):
+        self.progress.append(('init', max))
+
+    def set_progress(self, value):
+        self.progress.append(value)
+
+class TestWaitData(object):
+    def setup(self):
+        self.pipe_reader = rarextract.pipe_reader
+        self.extract = rarextract.StreamingExtract('test', None, None)
+        self.extract.rar = Process()
+        self.file = File()
+        self.extract.current = self.extract.first = (rarextract.fileplugin.FilePath(os.path.join(os.path.dirname(__file__), '1mb.part1.rar')), self.file)
+        self.errors = []
+        self.next = []
+        self.closed = []
+        self.extract.kill = lambda exc='', _del_lib=True: self.errors.append(exc)
+        self.extract.find_next = lambda: self.next.append(self.extract.next) or True
+        self.extract.finish_file = lambda path, file: None
+        self.extract.close = lambda: self.closed.append(True)
+
+    def teardown(self):
+        rarextract.pipe_reader = self.pipe_reader
+        del rarextract.extractors['test']
+
+    def feed(self, *chunks):
+        chunks = list(chunks) + ['']
+        rarextract.pipe_reader = lambda pipe: lambda: chunks.pop(0)
+        self.extract.wait_data()
+
+    def test_progress(self):
+        self.feed(
+            'Extracting from 1mb.part1.rar\n\n',
+            'Extracting  a.bin      \x08\x08\x08\x08  5%',
+            '\x08\x08\x08\x08 42%',
+            '\x08\x08\x08\x08 99%',
+            '\x08\x08\x08\x08\x08  OK \r',
+            '\nAll OK\r\n')
+        assert self.file.progress == [('init', 100), 5, 42, 99, 99]
+        assert not self.errors
+        assert self.closed
+
+    def test_member_names(self):
+        # the member names are no errors and no percentages
+        self.feed(
+            'Extracting  bad archive 50%.txt      \x08\x08\x08\x08  0%\x08\x08\x08\x08\x08  OK \n',
+            'Extracting  CRC failed in the encrypted file x - packed data CRC failed in volume y  OK \n')
+        assert self.file.progress == [('init', 100), 0]
+        assert not self.errors
+
+    def test_errors(self):
+        for line, error in [
+                ('a.bin - packed data CRC failed in volume 1mb.part1.rar', 'checksum error in rar archive'),
+                ('CRC failed in the encrypted file a.bin (password incorrect ?)', 'checksum error in rar archive. wrong password?'),
+                ('ERROR: Bad archive 1mb.part1.rar', 'Bad archive')]:
+            self.errors = []
+            self.feed('Extracting  a.bin      \x08\x08\x08\x08  0%\n', line, '\r', '\n')
+            assert set(self.errors) == set([error])
+
+    def test_volume_prompt(self):
+        # the prompt has no line break and arrives in parts
+        self.feed(
+            'Extracting  a.bin      \x08\x08\x08\x08 99%\x08\x08\x08\x08\x08  OK \n',
+            '\nInsert disk with 1mb.part2.rar',
+            ' [C]ontinue, [Q]uit ')
+        assert self.next == [os.path.join(os.path.dirname(__file__), '1mb.part2.rar')]
+        assert not self.errors
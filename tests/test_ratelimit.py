@@ -0,0 +1,78 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from client import ratelimit
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def simulate(clock, paths, seconds=60, size=100):
+    """lets every path read as fast as its buckets allow, returns the bytes per second"""
+    received = [0]*len(paths)
+    ready = [clock.now]*len(paths)
+    end = clock.now + seconds
+    while True:
+        i = min(xrange(len(paths)), key=ready.__getitem__)
+        if ready[i] >= end:
+            break
+        clock.now = ready[i]
+        received[i] += size
+        ready[i] = clock.now + 0.01 + paths[i].register(size)
+    return [r/float(seconds) for r in received]
+
+def near(value, expected):
+    return abs(value - expected) < expected*0.1
+
+def test_ratelimit():
+    clock = Clock()
+    old_time = ratelimit.time.time
+    ratelimit.time.time = clock
+    try:
+        root = ratelimit.Bucket(1000, level='global')
+        a = ratelimit.Bucket(0, root, 'host')
+        b = ratelimit.Bucket(0, root, 'host')
+
+        # unlimited siblings share the parent's rate
+        a1, b1 = simulate(clock, [ratelimit.Path([a, root]), ratelimit.Path([b, root])])
+        assert near(a1, 500) and near(b1, 500), (a1, b1)
+
+        # a limited sibling leaves the rest to the others
+        a.set_rate(200)
+        a1, b1 = simulate(clock, [ratelimit.Path([a, root]), ratelimit.Path([b, root])])
+        assert near(a1, 200) and near(b1, 800), (a1, b1)
+
+        # children of a limited bucket share its rate
+        a2 = ratelimit.Bucket(0, a, 'account')
+        a3 = ratelimit.Bucket(0, a, 'account')
+        paths = [ratelimit.Path([a2, a, root]), ratelimit.Path([a3, a, root]), ratelimit.Path([b, root])]
+        a2, a3, b1 = simulate(clock, paths)
+        assert near(a2, 100) and near(a3, 100) and near(b1, 800), (a2, a3, b1)
+
+        # policies adjust the internal rate of a bucket
+        policy = ratelimit.RatePolicy(b)
+        policy.limit(300)
+        assert b.get_rate() == 300
+        policy.reset()
+        assert near(b.get_rate(), 800)
+    finally:
+        ratelimit.time.time = old_time
+
+if __name__ == '__main__':
+    test_ratelimit()
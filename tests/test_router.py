@@ -0,0 +1,104 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import bisect
+
+from . import loader
+loader.init()
+
+from client.hoster import manager
+from client.plugintools import Matcher
+
+from .benchmark_router import Plugin, old_find, old_collect_links
+
+patterns = [
+    # indexed by the trie
+    ('alpha', [Matcher('https?', '*.alpha.com', '!/file/<id>')]),
+    ('exact', [Matcher('https?', '=exact.org', r'/f/(?P<id>\d+)')]),
+    # nested and named groups
+    ('beta', [Matcher('https?', r'~(?:www\.)?(beta|gamma)(-(?P<n>\d+))?\.net', r'/(get|dl)/(?P<id>\w+)')]),
+    # backreference
+    ('mirror', [Matcher('https?', r'~(?P<m>ab|cd)\.(?P=m)\.org', r'/(?P<id>\w+)')]),
+    # inline flags
+    ('caps', [Matcher('https?', r'~(?i)caps\.io', r'/x/(?P<id>\w+)')]),
+    ('dots', [Matcher('https?', r'~(?s)dots\.io', r'/y/(?P<id>.+)')]),
+    # overlapping links of two fallback plugins
+    ('foo', [Matcher('https?', r'~foo\.com', r'/a.*')]),
+    ('subfoo', [Matcher('https?', r'~(?:[\w\-]+\.)*foo\.com', r'/a/b.*')]),
+    ('http', [Matcher('https?')]),
+]
+
+urls = [
+    'http://alpha.com/file/1', 'https://www.alpha.com/file/2', 'http://alpha.com/other',
+    'http://exact.org/f/3', 'http://www.exact.org/f/3',
+    'http://beta.net/get/4', 'http://www.gamma-12.net/dl/5', 'http://BETA.net/get/4',
+    'http://ab.ab.org/6', 'http://ab.cd.org/6',
+    'http://caps.io/x/7', 'http://CAPS.IO/x/7', 'http://dots.io/y/8',
+    'http://foo.com/a/b', 'http://www.foo.com/a/b', 'http://foo.com/a',
+    'http://unknown.com/file/9']
+
+text = u'''
+see alpha.com/file/1 and www.alpha.com/file/2, exact.org/f/3
+beta.net/get/4 www.gamma-12.net/dl/5 BETA.net/get/10 gamma-1.net/dl/11
+ab.ab.org/6 ab.cd.org/12 cd.cd.org/13
+caps.io/x/7 CAPS.IO/x/14 Caps.io/x/15 BETA.NET/get/16 dots.io/y/8
+www.foo.com/a/b foo.com/a foo.com/a/b/c x.y.foo.com/a/b
+http://alpha.com/file/17 <https://beta.net/get/18>
+'''
+
+class TestRouter(object):
+    def setup(self):
+        self.plugins = manager.plugins[:]
+        del manager.plugins[:]
+        for name, p in patterns:
+            bisect.insort(manager.plugins, (200 if name == 'http' else 100, 0, Plugin(name, p)))
+        manager.router = None
+
+    def teardown(self):
+        manager.plugins[:] = self.plugins
+        manager.router = None
+
+    def test_flatten_groups(self):
+        assert manager.flatten_groups(r'(?P<url>(a|b)(?P<c>c)[(]\(d)') == r'(?:(?:a|b)(?:c)[(]\(d)'
+        assert manager.flatten_groups(r'[^]()](?:x)(?=y)') == r'[^]()](?:x)(?=y)'
+        assert manager.flatten_groups(r'(a)\1') is None
+        assert manager.flatten_groups(r'(?P<a>a)(?P=a)') is None
+        assert manager.flatten_groups(r'(?i)a') is None
+        assert manager.flatten_groups(r'a(?ms)') is None
+
+    def test_find(self):
+        for url in urls:
+            old = old_find(url)
+            new = manager.find(url)
+            if old is None:
+                assert new is None, url
+            else:
+                assert new[0] is old[0], url
+                assert dict(new[1]) == dict(old[1]), url
+
+    def test_collect_links(self):
+        old = old_collect_links(text)
+        assert manager.collect_links(text) == old
+        assert u'http://foo.com/a/b' in old and u'http://www.foo.com/a/b' in old
+        assert u'http://CAPS.IO/x/14' in old and u'http://BETA.NET/get/16' not in old
+
+    def test_combine(self):
+        # the flagged patterns are not combined with the others
+        r = manager.get_router()
+        combined = r.get_link_fallback()
+        assert [members is None for _, members in combined] == [True, True, True, False]
+        assert not combined[-1][0].groups
@@ -0,0 +1,132 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+from . import loader
+loader.init()
+
+from client import core
+from client.download import scheduler
+from client.scheme import transaction
+
+class Pool(object):
+    def full(self):
+        return False
+
+class Host(object):
+    def __init__(self, name):
+        self.name = name
+        self.download_pool = Pool()
+
+    def weight(self, file):
+        return 0
+
+hosts = [Host('a'), Host('b')]
+
+def add_file(package, name, host, state='download'):
+    return core.File(package=package, host=host, pmatch=True, url='http://{}/{}'.format(host.name, name), name=name, state=state)
+
+def full_scan():
+    ready = dict()
+    busy = dict()
+    for file in core.files():
+        if scheduler.is_ready(file):
+            ready.setdefault(file.host, []).append(file)
+        if scheduler.is_busy(file):
+            busy.setdefault(file.get_download_file(), set()).add(file)
+    return ready, busy
+
+def assert_indexes():
+    ready, busy = full_scan()
+    assert dict((host, [f for _, f in files]) for host, files in scheduler.ready.iteritems()) == ready
+    assert scheduler.busy == busy
+
+class TestScheduler(object):
+    def setup(self):
+        with transaction:
+            self.package = core.Package(name='scheduler', state='download')
+            self.files = [add_file(self.package, 'f{}'.format(i), hosts[i % 2]) for i in range(6)]
+        scheduler.rebuild()
+
+    def teardown(self):
+        with transaction:
+            for package in core.packages():
+                package.erase()
+
+    def test_rebuild(self):
+        assert_indexes()
+        assert sorted(scheduler.ready) == sorted(hosts)
+        assert list(scheduler.iter_candidates(set())) == self.files
+
+    def test_add(self):
+        with transaction:
+            file = add_file(self.package, 'new', hosts[0])
+        assert_indexes()
+        assert list(scheduler.iter_candidates(set()))[-1] is file
+
+    def test_transitions(self):
+        file = self.files[0]
+        with transaction:
+            file.enabled = False
+        assert_indexes()
+        with transaction:
+            file.enabled = True
+            self.files[1].last_error = 'error'
+        assert_indexes()
+        with transaction:
+            self.files[1].last_error = None
+            file.greenlet = object()
+        assert_indexes()
+        assert scheduler.mirror_working(self.files[2], file.get_download_file())
+        with transaction:
+            file.greenlet = None
+            file.state = 'download_complete'
+            file.completed_plugins.add('download')
+            file.completed_plugins = file.completed_plugins
+        assert_indexes()
+        with transaction:
+            self.files[2].host = hosts[1]
+        assert_indexes()
+
+    def test_package_system(self):
+        with transaction:
+            self.package.system = 'torrent'
+        assert_indexes()
+        assert not scheduler.ready
+        with transaction:
+            self.package.system = 'download'
+        assert_indexes()
+
+    def test_url(self):
+        file = self.files[0]
+        with transaction:
+            file.greenlet = object()
+        with transaction:
+            file.url = 'file:///tmp/f0'
+        assert_indexes()
+        assert scheduler.busy.keys() == ['/tmp/f0']
+        with transaction:
+            file.greenlet = None
+
+    def test_remove(self):
+        file = self.files[0]
+        with transaction:
+            file.greenlet = object()
+        with transaction:
+            file.greenlet = None
+            file.delete()
+        assert_indexes()
+        assert file not in scheduler._ranks
@@ -14,9 +14,12 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
+import os
 import json
+import shutil
+import tempfile
 
-from client import scheme
+from client import scheme, settings
 from client.scheme import transaction, TransactionError
 from client.scheme.transaction import PassiveListener
 
@@ -142,5 +145,150 @@ def test_scheme():
         test.table_delete()
     assert listener.pop() == {si+1: {'action': 'delete', 'table': 'test', 'id': si+1}}
 
+def test_new_table():
+    changed = []
+    hook = TableTest.test.changed(lambda table, old: changed.append((table, old)))
+    try:
+        with transaction:
+            with transaction:
+                test = TableTest(test="new")
+            test.test = "changed"
+        # the columns of new tables are dirty once, with the old value None
+        assert changed == [(test, None)]
+    finally:
+        TableTest.test.remove_changed(hook)
+
+    with transaction:
+        test.table_delete()
+    assert isinstance(TableTest.__dict__['_table_layout'], scheme.scheme.TableLayout)
+    assert not hasattr(test._table_data['test'], '__dict__')
+
+class ParentTest(scheme.Table):
+    _table_name = 'parent'
+
+    total = scheme.Column('test', always_use_getter=True, getter_cached=True)
+    children = scheme.Column(None)
+
+    def __init__(self):
+        self.children = []
+
+    def on_get_total(self, value):
+        return value or 0
+
+    def on_recompute_total(self):
+        return sum(c.size or 0 for c in self.children)
+
+class ChildTest(scheme.Table):
+    _table_name = 'child'
+
+    parent = scheme.Column(None, foreign_key=[ParentTest, 'children'], change_affects=['size'])
+    size = scheme.Column('test', aggregate=['parent', 'total'])
+
+    def __init__(self, parent, size):
+        self.parent = parent
+        self.size = size
+
+def test_aggregate():
+    with transaction:
+        a, b = ParentTest(), ParentTest()
+        c1 = ChildTest(a, 10)
+        c2 = ChildTest(a, 5)
+    assert a.total == 15
+
+    with transaction:
+        c1.size = 20
+        c2.parent = b
+    assert a.total == 20 and b.total == 5
+
+    try:
+        with transaction:
+            ChildTest(b, 7)
+            raise ValueError('foo')
+    except ValueError:
+        pass
+    assert b.total == 5
+
+    with transaction:
+        c1.table_delete()
+    assert a.total == 0 and a.total == a.on_recompute_total()
+    assert b.total == b.on_recompute_total()
+
+class IndexTest(scheme.Table):
+    _table_name = 'index'
+
+    state = scheme.Column('api', index=True)
+    name = scheme.Column('api')
+
+    def __init__(self, state, name):
+        self.state = state
+        self.name = name
+
+def test_index():
+    with transaction:
+        tables = [IndexTest(i % 3, 'name{}'.format(i)) for i in xrange(30)]
+    select = lambda filter: scheme.scheme.select(tables, filter, IndexTest)
+    scan = lambda filter: scheme.scheme.select(tables, filter)
+
+    for filter in [dict(state=1), dict(state=[0, 2]), dict(state='2', name='name5'), dict(name='name3')]:
+        assert select(filter) == scan(filter), filter
+    assert len(select(dict(state=1))) == 10
+
+    # the result keeps the order of the objects
+    reverse = scheme.scheme.select(tables[::-1], dict(state=[0, 2]), IndexTest)
+    assert reverse == scan(dict(state=[0, 2]))[::-1]
+
+    with transaction:
+        tables[1].state = 2
+        tables[2].table_delete()
+    assert tables[1] in select(dict(state=2))
+    assert tables[1] not in select(dict(state=1))
+    assert tables[2] not in select(dict(state=2))
+
+    try:
+        with transaction:
+            tables[0].table_delete()
+            raise ValueError('foo')
+    except ValueError:
+        pass
+    assert tables[0] in select(dict(state=0))
+
+class FilterTest(scheme.Table):
+    _table_name = 'filter'
+
+    url = scheme.Column('api', lambda self, url: url.upper())
+
+    def __init__(self, url):
+        self.url = url
+
+def test_match_filter():
+    with transaction:
+        table = FilterTest('http://foo')
+    assert table.match_filter(url='http://foo')
+    assert not table.match_filter(url='HTTP://FOO')
+    assert table.match_filter('api', url='HTTP://FOO')
+    assert not table.match_filter('api', url='http://foo')
+    assert scheme.scheme.select([table], dict(url='HTTP://FOO')) == [table]
+
+def test_uid():
+    path = tempfile.mkdtemp()
+    old_file, old_block = settings.next_uid_file, scheme.scheme._uid_block
+    try:
+        settings.next_uid_file = os.path.join(path, '.next.id')
+        uids = [scheme.scheme.get_next_uid() for _ in xrange(scheme.scheme.uid_block_size + 1)]
+        assert uids == range(1, len(uids) + 1)
+        with open(settings.next_uid_file) as f:
+            assert int(f.read()) == 2*scheme.scheme.uid_block_size + 1
+
+        # a restart continues with the next block
+        scheme.scheme._uid_block = None
+        assert scheme.scheme.get_next_uid() == 2*scheme.scheme.uid_block_size + 1
+    finally:
+        settings.next_uid_file, scheme.scheme._uid_block = old_file, old_block
+        shutil.rmtree(path)
+
 if __name__ == '__main__':
     test_scheme()
+    test_new_table()
+    test_aggregate()
+    test_index()
+    test_uid()
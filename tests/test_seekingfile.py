@@ -0,0 +1,58 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import tempfile
+
+import gevent
+
+from client import seekingfile
+
+data = os.urandom(1024*1024 + 123)
+
+def write_chunk(f, begin, end, bs=10000):
+    buf = bytearray(bs)
+    for pos in xrange(begin, end, bs):
+        size = min(bs, end - pos)
+        if pos % 2:
+            f.write(data[pos:pos + size], pos)
+        else:
+            # reused buffers of the zero-copy read path
+            buf[:size] = data[pos:pos + size]
+            f.write(buffer(buf, 0, size), pos)
+        gevent.sleep(0)
+
+def test_backends():
+    path = os.path.join(tempfile.gettempdir(), 'test_seekingfile.bin')
+    for backend in seekingfile.backends:
+        for threaded in (False, True):
+            f = seekingfile.SeekingFile(path, len(data), backend=backend, threaded=threaded)
+            try:
+                with f:
+                    step = len(data)//3
+                    gevent.joinall([
+                        gevent.spawn(write_chunk, f, 0, step),
+                        gevent.spawn(write_chunk, f, step, 2*step),
+                        gevent.spawn(write_chunk, f, 2*step, len(data))], raise_error=True)
+                    assert f.read(100, step - 50) == data[step - 50:step + 50]
+                assert f.f is None
+                with open(path, 'rb') as g:
+                    assert g.read() == data, (backend, threaded)
+            finally:
+                os.unlink(path)
+
+if __name__ == '__main__':
+    test_backends()
@@ -0,0 +1,85 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from client import speedregister
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_speedregister():
+    clock = Clock()
+    parent = speedregister.SpeedRegister(0.5, 60, 10, clock=clock)
+    a = speedregister.SpeedRegister(0.5, 60, 10, parent, clock)
+    b = speedregister.SpeedRegister(0.5, 60, 10, parent, clock)
+    assert a.get_bytes() == 0
+
+    for i in xrange(40):
+        a.register(1000)
+        b.register(500)
+        clock.now += 0.5
+    # the current bucket is still empty
+    assert a.get_bytes() == 19*1000/11.0
+    assert parent.get_bytes() == 19*1500/11.0
+    assert a.get_bytes(5) == 9*1000/6.0
+
+    # buckets that left the interval are dropped lazily
+    clock.now += 5
+    assert a.get_bytes() == 9*1000/11.0
+    clock.now += 60
+    assert a.get_bytes() == 0
+    assert parent.get_bytes() == 0
+
+    a.register(1000)
+    assert a.get_bytes() == 1000
+    a.reset()
+    assert a.get_bytes() == 0
+
+def test_detach():
+    clock = Clock()
+    root = speedregister.SpeedRegister(0.5, 60, 10, clock=clock)
+    first = speedregister.SpeedRegister(0.5, 60, 10, root, clock)
+    second = speedregister.SpeedRegister(0.5, 60, 10, root, clock)
+    a = speedregister.SpeedRegister(0.5, 60, 10, first, clock)
+    b = speedregister.SpeedRegister(0.5, 60, 10, first, clock)
+    for i in xrange(40):
+        a.register(1000)
+        b.register(500)
+        clock.now += 0.5
+    assert first.get_bytes() == 19*1500/11.0
+    assert root.get_bytes() == 19*1500/11.0
+
+    # a moved register takes its bytes along, the common parent keeps them
+    a.set_parent(second)
+    assert first.get_bytes() == 19*500/11.0
+    assert second.get_bytes() == 19*1000/11.0
+    assert root.get_bytes() == 19*1500/11.0
+    assert a.get_bytes(5) == second.get_bytes(5) == 9*1000/6.0
+
+    # a stopped register does not count in its parents any more
+    b.reset()
+    assert first.get_bytes() == 0
+    assert root.get_bytes() == 19*1000/11.0
+
+    a.set_parent(None)
+    assert second.get_bytes() == root.get_bytes() == 0
+    assert a.get_bytes() == 19*1000/11.0
+
+if __name__ == '__main__':
+    test_speedregister()
@@ -0,0 +1,172 @@
+"""Copyright (C) 2013 COLDWELL AG
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from . import loader
+loader.init()
+
+import random
+import gevent
+
+from array import array
+
+from client import torrentengine, torrent
+
+def test_file_ratios():
+    sizes = [random.randint(1, 10**10) for _ in xrange(10000)] + [49, 98, 103]
+    ratios = torrentengine.file_ratios(sizes, array('d', sizes))
+    # the torrent job multiplies the ratio with the size and checks for completion
+    assert all(r*size == size for r, size in zip(ratios, sizes))
+    assert torrentengine.file_ratios([0, 50], array('d', [1, 100])) == [0.0, 0.5]
+
+
+class Handle(object):
+    def __init__(self, sizes):
+        self.bytes = [0]*len(sizes)
+
+    def has_metadata(self):
+        return True
+
+    def file_progress(self):
+        return list(self.bytes)
+
+class Log(object):
+    def info(self, *args):
+        pass
+
+class Speed(object):
+    def get_bytes(self):
+        return 0
+
+class Url(object):
+    def __init__(self, index):
+        self.fragment = str(index)
+
+class File(object):
+    log = Log()
+    _speed = Speed()
+
+    def __init__(self, index, size):
+        self.split_url = Url(index)
+        self.size = size
+        self.enabled = True
+        self.state = 'download'
+        self.working = True
+        self.greenlet = None
+        self.progress = None
+        self.progress_initialized = False
+        self._max_progress = None
+        self._state_download_incomplete = True
+        self._last_speed = False
+        self.speeds = []
+
+    def get_any_size(self):
+        return self.size
+
+    def init_progress(self, size):
+        self._max_progress = size
+
+    def set_progress(self, progress):
+        self.progress = progress
+
+    def register_speed(self, size):
+        self.speeds.append(size)
+
+    def set_column_dirty(self, name):
+        pass
+
+def create_job(sizes):
+    job = torrent.TorrentJob.__new__(torrent.TorrentJob)
+    job.handle = Handle(sizes)
+    job.state = 'download'
+    job._file_sizes = array('d', (size or 1 for size in sizes))
+    job.file_objects = dict()
+    job.last_file_bytes = None
+    job.revisit_files = set()
+    job.incomplete = set()
+    for i, size in enumerate(sizes):
+        job.file_objects[i] = File(i, size)
+        job.update_incomplete(job.file_objects[i])
+    job.finished = []
+    job.finish = lambda: job.finished.append(True)
+    return job
+
+def update(job):
+    job.update_file_progress()
+    gevent.sleep(0)
+
+def test_changed_files():
+    job = create_job([100, 200, 49])
+    files = job.file_objects
+    update(job)
+    assert all(f.progress == 0 for f in files.values())
+
+    # only the file with new bytes gets a speed, the file is revisited until the speed decays
+    job.handle.bytes[1] = 50
+    update(job)
+    assert files[1].progress == 50
+    assert files[1].speeds == [50]
+    assert files[0].speeds == [] and files[2].speeds == []
+    assert job.revisit_files == set([1])
+
+    files[1].speeds = []
+    update(job)
+    assert files[1].speeds == [0]
+    assert job.revisit_files == set()
+
+    # unchanged files are not touched
+    files[1].speeds = []
+    update(job)
+    assert files[1].speeds == []
+
+def test_finish():
+    job = create_job([100, 200, 49])
+    files = job.file_objects
+    update(job)
+    assert job.incomplete == set([0, 1, 2])
+
+    job.handle.bytes = [100, 200, 0]
+    update(job)
+    assert not files[0]._state_download_incomplete
+    assert job.incomplete == set([2])
+    assert not job.finished
+
+    # a disabled file is not waited for
+    files[2].enabled = False
+    job.update_incomplete(files[2])
+    update(job)
+    assert job.finished
+    assert job.state == 'finish'
+
+def test_state_change():
+    job = create_job([100, 200])
+    files = job.file_objects
+    files[1].state = 'collect'
+    job.update_incomplete(files[1])
+    job.handle.bytes = [100, 200]
+    update(job)
+    assert files[1].progress is None
+    assert job.finished
+
+    # a file that is queued again is checked even though its bytes did not change
+    job.finished = []
+    job.state = 'download'
+    files[1].state = 'download'
+    job.update_incomplete(files[1])
+    job.invalidate_file_progress()
+    update(job)
+    assert files[1].progress == 200
+    assert not job.incomplete
+    assert job.finished